@@ -104,14 +104,118 @@ if DB_NAME and DB_USER and DB_PASSWORD:
     }
 else:
     # Development: Use SQLite
+    # The busy timeout and IMMEDIATE transactions let concurrent writers
+    # (threaded runserver, concurrency tests) queue instead of erroring.
+    # Tests use a file database because the shared-cache in-memory database
+    # raises "table is locked" instead of waiting.
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+            },
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
         }
     }
 
 
+# Caches
+# 'counters' holds the write-behind engagement counter buffer (core.counters).
+# It must not evict live entries, hence the large MAX_ENTRIES (and, on a
+# shared backend, no eviction policy). The buffer relies on add() and incr()
+# being atomic across every process that shares it: keep the default locmem
+# cache (private to each process, flushed by its own thread) or, to share it
+# between gunicorn workers, use 'django.core.cache.backends.redis.RedisCache'
+# or PyMemcacheCache. FileBasedCache and DatabaseCache are not supported:
+# their add() and incr() race between processes and lose increments.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'counters': {
+        'BACKEND': config('COUNTER_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('COUNTER_CACHE_LOCATION', default='vyra-counters'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000000,
+        },
+    },
+}
+
+# Video engagement counters are flushed to the database every
+# VIDEO_COUNTER_FLUSH_INTERVAL seconds or after VIDEO_COUNTER_FLUSH_THRESHOLD
+# buffered increments, whichever comes first. Each process flushes its buffers
+# from a background thread too, so quiet rows are written; with the default
+# locmem cache that thread is the only thing that can reach them, as
+# flush_video_counters (run from cron) sees a shared cache only.
+COUNTER_FLUSH_THREAD = config('COUNTER_FLUSH_THREAD', default=True, cast=bool)
+VIDEO_COUNTER_CACHE = 'counters'
+VIDEO_COUNTER_FLUSH_INTERVAL = config('VIDEO_COUNTER_FLUSH_INTERVAL', default=2.0, cast=float)
+VIDEO_COUNTER_FLUSH_THRESHOLD = config('VIDEO_COUNTER_FLUSH_THRESHOLD', default=500, cast=int)
+# Live battle votes (core.battles) are counted in the database with their
+# debit, spread over BATTLE_VOTE_SHARDS rows per battle, and added to the
+# battle's tallies (and pushed to the live room) every
+# BATTLE_VOTE_FLUSH_INTERVAL seconds by the same kind of flusher thread.
+BATTLE_VOTE_SHARDS = config('BATTLE_VOTE_SHARDS', default=16, cast=int)
+BATTLE_VOTE_FLUSH_INTERVAL = config('BATTLE_VOTE_FLUSH_INTERVAL', default=1.0, cast=float)
+# Micro-awards of VyRa Points (core.points: likes, shares, buzzes, comments)
+# are buffered too, and written as one balance update per user per flush.
+POINTS_AWARD_CACHE = 'counters'
+POINTS_AWARD_FLUSH_INTERVAL = config('POINTS_AWARD_FLUSH_INTERVAL', default=5.0, cast=float)
+POINTS_AWARD_FLUSH_THRESHOLD = config('POINTS_AWARD_FLUSH_THRESHOLD', default=1000, cast=int)
+# Leaderboards (core.leaderboards): each process keeps the global boards in
+# memory, holds the top LEADERBOARD_TOP_K of each ready, and catches up on
+# changed scores at most every LEADERBOARD_SYNC_SECONDS.
+LEADERBOARD_TOP_K = config('LEADERBOARD_TOP_K', default=100, cast=int)
+LEADERBOARD_SYNC_SECONDS = config('LEADERBOARD_SYNC_SECONDS', default=5.0, cast=float)
+# The points ledger (core.rollups): rollup_points folds rows older than
+# POINTS_ROLLUP_AFTER_DAYS into daily totals and, on PostgreSQL, creates the
+# monthly ledger partitions up to POINTS_PARTITION_MONTHS_AHEAD months ahead.
+POINTS_ROLLUP_AFTER_DAYS = config('POINTS_ROLLUP_AFTER_DAYS', default=30, cast=int)
+POINTS_PARTITION_MONTHS_AHEAD = config('POINTS_PARTITION_MONTHS_AHEAD', default=3, cast=int)
+
+
+# Home timelines (core.timeline): authors with more followers than this are
+# not fanned out on write; their videos are pulled into feeds at read time.
+TIMELINE_FANOUT_MAX_FOLLOWERS = config('TIMELINE_FANOUT_MAX_FOLLOWERS', default=10000, cast=int)
+# How many recent videos per author are copied into a timeline on follow/backfill
+TIMELINE_BACKFILL_PER_AUTHOR = config('TIMELINE_BACKFILL_PER_AUTHOR', default=100, cast=int)
+
+# Trending score half-life (core.trending); scores are refreshed by the
+# refresh_trending_scores command
+TRENDING_HALF_LIFE_HOURS = config('TRENDING_HALF_LIFE_HOURS', default=24.0, cast=float)
+# Half-life of per-user hashtag/creator interest weights (core.interests)
+INTEREST_HALF_LIFE_DAYS = config('INTEREST_HALF_LIFE_DAYS', default=14.0, cast=float)
+# In-memory autocomplete (core.autocomplete): entries kept per kind (users,
+# hashtags) in each process, and how often ranks are rebuilt from the database
+AUTOCOMPLETE_MAX_ENTRIES = config('AUTOCOMPLETE_MAX_ENTRIES', default=100000, cast=int)
+AUTOCOMPLETE_REFRESH_SECONDS = config('AUTOCOMPLETE_REFRESH_SECONDS', default=600, cast=int)
+# Notifications (core.notifications) are queued in an outbox and coalesced per
+# (recipient, type, video) over NOTIFICATION_COALESCE_MINUTES windows by a
+# worker thread, which waits NOTIFICATION_BATCH_DELAY seconds to batch bursts.
+# With the thread off, run the process_notifications command instead.
+NOTIFICATION_COALESCE_MINUTES = config('NOTIFICATION_COALESCE_MINUTES', default=60, cast=int)
+NOTIFICATION_BATCH_DELAY = config('NOTIFICATION_BATCH_DELAY', default=1.0, cast=float)
+NOTIFICATION_BATCH_SIZE = config('NOTIFICATION_BATCH_SIZE', default=1000, cast=int)
+NOTIFICATION_WORKER_THREAD = config('NOTIFICATION_WORKER_THREAD', default=True, cast=bool)
+# Real-time WebSocket gateway (core.realtime, served by VyRa/asgi.py). The
+# in-memory layer reaches sockets in its own process only; with more than one
+# ASGI worker use core.realtime.RedisChannelLayer (needs the redis package).
+REALTIME_CHANNEL_LAYER = config('REALTIME_CHANNEL_LAYER', default='core.realtime.InMemoryChannelLayer')
+REALTIME_REDIS_URL = config('REALTIME_REDIS_URL', default='redis://localhost:6379/0')
+REALTIME_QUEUE_SIZE = config('REALTIME_QUEUE_SIZE', default=256, cast=int)
+# Live room presence (core.presence): viewers drop out PRESENCE_TTL_SECONDS
+# after their last heartbeat; counts are written to LiveRoom every
+# PRESENCE_FLUSH_SECONDS by a background thread
+PRESENCE_TTL_SECONDS = config('PRESENCE_TTL_SECONDS', default=30, cast=int)
+PRESENCE_FLUSH_SECONDS = config('PRESENCE_FLUSH_SECONDS', default=5.0, cast=float)
+PRESENCE_SHARDS = config('PRESENCE_SHARDS', default=16, cast=int)
+PRESENCE_FLUSH_THREAD = config('PRESENCE_FLUSH_THREAD', default=True, cast=bool)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -158,6 +262,33 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Resumable video uploads (core.uploads): chunks are kept outside MEDIA_ROOT,
+# so they are never served, until finalize assembles them into the video.
+VIDEO_UPLOAD_DIR = config('VIDEO_UPLOAD_DIR', default=os.path.join(BASE_DIR, 'upload_chunks'))
+VIDEO_UPLOAD_CHUNK_SIZE = config('VIDEO_UPLOAD_CHUNK_SIZE', default=8 * 1024 * 1024, cast=int)
+VIDEO_UPLOAD_MAX_CHUNK_SIZE = config('VIDEO_UPLOAD_MAX_CHUNK_SIZE', default=64 * 1024 * 1024, cast=int)
+VIDEO_UPLOAD_MAX_SIZE = config('VIDEO_UPLOAD_MAX_SIZE', default=4 * 1024 ** 3, cast=int)
+VIDEO_UPLOAD_EXPIRE_HOURS = config('VIDEO_UPLOAD_EXPIRE_HOURS', default=24, cast=int)
+# Media processing (core.media): uploaded videos are queued for a poster,
+# preview and HLS renditions, made by local ffmpeg/ffprobe binaries under
+# MEDIA_ROOT/processed/. MEDIA_PROCESSING_WORKERS jobs run at once, each
+# ffmpeg with MEDIA_PROCESSING_THREADS threads, so together they fill the
+# CPUs without oversubscribing them. Each ffmpeg run is stopped after
+# MEDIA_PROCESSING_TIMEOUT seconds; a job whose worker has not checked in for
+# MEDIA_PROCESSING_LEASE seconds (longer than any single run) is taken over.
+# Failed jobs are retried, up to MEDIA_PROCESSING_MAX_ATTEMPTS times. With the
+# worker threads off, run the process_media_jobs command instead.
+FFMPEG_BINARY = config('FFMPEG_BINARY', default='ffmpeg')
+FFPROBE_BINARY = config('FFPROBE_BINARY', default='ffprobe')
+MEDIA_PROCESSING_WORKERS = config('MEDIA_PROCESSING_WORKERS', default=max(1, (os.cpu_count() or 1) // 2), cast=int)
+MEDIA_PROCESSING_THREADS = config(
+    'MEDIA_PROCESSING_THREADS', default=max(1, (os.cpu_count() or 1) // MEDIA_PROCESSING_WORKERS), cast=int
+)
+MEDIA_PROCESSING_TIMEOUT = config('MEDIA_PROCESSING_TIMEOUT', default=3600, cast=int)
+MEDIA_PROCESSING_LEASE = config('MEDIA_PROCESSING_LEASE', default=2 * MEDIA_PROCESSING_TIMEOUT, cast=int)
+MEDIA_PROCESSING_MAX_ATTEMPTS = config('MEDIA_PROCESSING_MAX_ATTEMPTS', default=3, cast=int)
+MEDIA_PROCESSING_WORKER_THREADS = config('MEDIA_PROCESSING_WORKER_THREADS', default=True, cast=bool)
+
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -25,6 +25,8 @@ router.register(r'chat-messages', api_views.ChatMessageViewSet, basename='chat-m
 urlpatterns = [
     path('auth/signup/', api_views.signup, name='api-signup'),
     path('auth/signin/', api_views.signin, name='api-signin'),
+    path('autocomplete/', api_views.autocomplete, name='api-autocomplete'),
+    path('badges/', api_views.badge_counts, name='api-badges'),
     path('', include(router.urls)),
 ]
 
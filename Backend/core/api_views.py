@@ -5,10 +5,10 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from django.db.models import Q, Count, Sum, F
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db.models import Q, Count, F, Exists, OuterRef, prefetch_related_objects
+from django.db import models, transaction
 from django.utils import timezone
-from datetime import timedelta
 import json
 
 from .models import (
@@ -16,7 +16,7 @@ from .models import (
     Follow, Product, Battle, BattleVote, Notification, VyRaPointsTransaction,
     Club, ClubMember, ClubPost, Challenge, UserChallengeProgress,
     LiveRoom, LiveBattle, Sound, ProfileSkin, UserSkin, Block, VideoAnalytics, Status, StatusView,
-    Chat, ChatMessage
+    Chat, ChatMessage, InterestProfile, VideoUpload
 )
 from .serializers import (
     ProfileSerializer, VideoSerializer, CommentSerializer, ProductSerializer,
@@ -28,6 +28,24 @@ from .serializers import (
     VideoAnalyticsSerializer, StatusSerializer,
     ChatSerializer, ChatMessageSerializer
 )
+from . import badges, chats, geo, leaderboards, media, points, realtime, uploads
+from .autocomplete import autocomplete as suggestions
+from .battles import BattleEnded, battle_votes, cast_vote, end_battle, pending_votes
+from .counters import video_counters
+from .interests import CANDIDATES, TOP_INTERESTS, rank, record_engagement, top_interests
+from .notifications import notifications
+from .pagination import FeedPagination, KeysetPagination, wants_cursor
+from .presence import presence
+from .relationships import build_relationship_map, follow_user, unfollow_user
+from .search import ranked, search as search_documents
+from .timeline import fan_out_video, followed_or_public_queryset, home_feed
+from .trending import WEIGHTS, trending_score
+
+
+def idempotency_key(request, scope):
+    """Ledger idempotency key from the client's Idempotency-Key header, if it sent one"""
+    key = request.headers.get('Idempotency-Key', '').strip()
+    return f'{scope}:{request.user.pk}:{key}'[:100] if key else None
 
 # Authentication Views
 @api_view(['POST'])
@@ -84,6 +102,26 @@ def signin(request):
         })
     return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def autocomplete(request):
+    """Prefix suggestions for the search box (core.autocomplete): ?q=, optional type=users|hashtags, limit"""
+    prefix = request.query_params.get('q', '')
+    kinds = ('users', 'hashtags')
+    if request.query_params.get('type') in kinds:
+        kinds = (request.query_params['type'],)
+    try:
+        limit = int(request.query_params.get('limit', 8))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(suggestions.suggest(prefix, kinds, limit))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def badge_counts(request):
+    """Unread notifications, unread messages (total and per chat) and pending challenge claims (core.badges)"""
+    return Response(badges.badge_counts(request.user))
+
 # Profile ViewSet - FIXED
 class ProfileViewSet(viewsets.ModelViewSet):
     queryset = Profile.objects.all()
@@ -92,7 +130,7 @@ class ProfileViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Enhanced queryset with proper search functionality"""
-        queryset = Profile.objects.select_related('user').all().order_by('-created_at')
+        queryset = Profile.objects.select_related('user').prefetch_related('badges').order_by('-created_at')
         
         # Exact username lookup (for profile page navigation)
         username = self.request.query_params.get('username', None)
@@ -103,11 +141,8 @@ class ProfileViewSet(viewsets.ModelViewSet):
         # Search functionality (for search screen)
         search = self.request.query_params.get('search', None)
         if search:
-            # Search by username or display name (case-insensitive)
-            queryset = queryset.filter(
-                Q(user__username__icontains=search) |
-                Q(display_name__icontains=search)
-            ).distinct().order_by('-created_at')
+            # Full-text search on username, display name and bio, best match first (core.search)
+            queryset = ranked(queryset, search_documents('profile', search))
         
         return queryset
 
@@ -123,14 +158,8 @@ class ProfileViewSet(viewsets.ModelViewSet):
         """Get current user's profile with counts"""
         profile = Profile.objects.get(user=request.user)
         
-        # Calculate followers and following counts
-        followers_count = Follow.objects.filter(following=request.user).count()
-        following_count = Follow.objects.filter(follower=request.user).count()
-        
         serializer = self.get_serializer(profile)
         data = serializer.data
-        data['followersCount'] = followers_count
-        data['followingCount'] = following_count
         data['isFollowing'] = False  # Can't follow yourself
         data['isFollowedBy'] = False
         
@@ -139,30 +168,7 @@ class ProfileViewSet(viewsets.ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         """Get a specific user's profile with relationship data"""
         instance = self.get_object()
-        
-        # Calculate followers and following counts
-        followers_count = Follow.objects.filter(following=instance.user).count()
-        following_count = Follow.objects.filter(follower=instance.user).count()
-        
-        # Check relationship with current user
-        is_following = Follow.objects.filter(
-            follower=request.user,
-            following=instance.user
-        ).exists()
-        
-        is_followed_by = Follow.objects.filter(
-            follower=instance.user,
-            following=request.user
-        ).exists()
-        
-        serializer = self.get_serializer(instance)
-        data = serializer.data
-        data['followersCount'] = followers_count
-        data['followingCount'] = following_count
-        data['isFollowing'] = is_following
-        data['isFollowedBy'] = is_followed_by
-        
-        return Response(data)
+        return Response(self._serialize_profiles([instance])[0])
 
     def list(self, request, *args, **kwargs):
         """List profiles with relationship data for search results"""
@@ -170,77 +176,32 @@ class ProfileViewSet(viewsets.ModelViewSet):
         username = request.query_params.get('username', None)
         if username:
             queryset = self.filter_queryset(self.get_queryset())
-            if queryset.exists():
-                profile = queryset.first()
-                serializer = self.get_serializer(profile)
-                data = serializer.data
-                
-                # Add relationship data
-                followers_count = Follow.objects.filter(following=profile.user).count()
-                following_count = Follow.objects.filter(follower=profile.user).count()
-                is_following = Follow.objects.filter(
-                    follower=request.user,
-                    following=profile.user
-                ).exists()
-                is_followed_by = Follow.objects.filter(
-                    follower=profile.user,
-                    following=request.user
-                ).exists()
-                
-                data['followersCount'] = followers_count
-                data['followingCount'] = following_count
-                data['isFollowing'] = is_following
-                data['isFollowedBy'] = is_followed_by
-                
-                # Return as list for consistency with frontend expectations
-                return Response([data])
-            else:
-                return Response([])
+            # Return as list for consistency with frontend expectations
+            return Response(self._serialize_profiles(queryset[:1]))
         
         # For search and other list operations, use pagination
         queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
         
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            profiles_data = self._add_relationship_data(serializer.data, request.user)
-            return self.get_paginated_response(profiles_data)
-        serializer = self.get_serializer(queryset, many=True)
-        profiles_data = self._add_relationship_data(serializer.data, request.user)
-        return Response(profiles_data)
-
-    def _add_relationship_data(self, profiles_data, current_user):
-        """Helper to add follower counts and relationship status"""
-        for profile in profiles_data:
-            try:
-                profile_obj = Profile.objects.get(id_user=profile['id'])
-                
-                # Get counts
-                followers_count = Follow.objects.filter(following=profile_obj.user).count()
-                following_count = Follow.objects.filter(follower=profile_obj.user).count()
-                
-                # Check relationships
-                is_following = Follow.objects.filter(
-                    follower=current_user,
-                    following=profile_obj.user
-                ).exists()
-                
-                is_followed_by = Follow.objects.filter(
-                    follower=profile_obj.user,
-                    following=current_user
-                ).exists()
-                
-                profile['followersCount'] = followers_count
-                profile['followingCount'] = following_count
-                profile['isFollowing'] = is_following
-                profile['isFollowedBy'] = is_followed_by
-            except Profile.DoesNotExist:
-                profile['followersCount'] = 0
-                profile['followingCount'] = 0
-                profile['isFollowing'] = False
-                profile['isFollowedBy'] = False
-        
-        return profiles_data
+            return self.get_paginated_response(self._serialize_profiles(page))
+        return Response(self._serialize_profiles(queryset))
+
+    def _serialize_profiles(self, profiles):
+        """Serialize a page of profiles with follower counts and relationship status.
+
+        Counts come from the denormalized Profile columns and relationship
+        flags for the whole page are resolved up front, so the query count
+        stays fixed regardless of page size.
+        """
+        profiles = list(profiles)
+        prefetch_related_objects(profiles, 'badges')
+        context = self.get_serializer_context()
+        context['relationships'] = build_relationship_map(
+            [profile.user_id for profile in profiles], self.request.user
+        )
+        serializer = ProfileSerializer(profiles, many=True, context=context)
+        return serializer.data
 
     @action(detail=True, methods=['post'])
     def follow(self, request, pk=None):
@@ -254,22 +215,14 @@ class ProfileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        follow, created = Follow.objects.get_or_create(
-            follower=request.user,
-            following=profile.user
-        )
+        follow, created = follow_user(request.user, profile.user)
         
         if not created:
-            follow.delete()
+            unfollow_user(request.user, profile.user)
             return Response({'message': 'Unfollowed', 'following': False})
         
-        # Create notification
-        Notification.objects.create(
-            user=profile.user,
-            from_user=request.user,
-            notification_type='follow',
-            message=f'{request.user.username} started following you'
-        )
+        # Queue notification (coalesced by core.notifications)
+        notifications.notify(profile.user.pk, request.user, 'follow')
         
         return Response({'message': 'Following', 'following': True})
 
@@ -278,68 +231,42 @@ class ProfileViewSet(viewsets.ModelViewSet):
         """Unfollow a user"""
         profile = self.get_object()
         
-        try:
-            follow = Follow.objects.get(
-                follower=request.user,
-                following=profile.user
-            )
-            follow.delete()
+        if unfollow_user(request.user, profile.user):
             return Response({'message': 'Unfollowed successfully'})
-        except Follow.DoesNotExist:
-            return Response(
-                {'error': 'You are not following this user'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return Response(
+            {'error': 'You are not following this user'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
 
     @action(detail=True, methods=['get'])
     def followers(self, request, pk=None):
         """Get user's followers list"""
         profile = self.get_object()
-        followers = Follow.objects.filter(following=profile.user).select_related('follower__profile')
+        followers = Follow.objects.filter(following=profile.user).select_related('follower__profile__user')
         
-        followers_data = []
+        follower_profiles = []
         for follow in followers:
             try:
-                follower_profile = follow.follower.profile
-                serializer = ProfileSerializer(follower_profile, context={'request': request})
-                data = serializer.data
-                
-                # Add relationship info
-                data['isFollowing'] = Follow.objects.filter(
-                    follower=request.user,
-                    following=follow.follower
-                ).exists()
-                
-                followers_data.append(data)
+                follower_profiles.append(follow.follower.profile)
             except Profile.DoesNotExist:
                 continue
         
-        return Response(followers_data)
+        return Response(self._serialize_profiles(follower_profiles))
 
     @action(detail=True, methods=['get'])
     def following(self, request, pk=None):
         """Get users that this user follows"""
         profile = self.get_object()
-        following = Follow.objects.filter(follower=profile.user).select_related('following__profile')
+        following = Follow.objects.filter(follower=profile.user).select_related('following__profile__user')
         
-        following_data = []
+        following_profiles = []
         for follow in following:
             try:
-                following_profile = follow.following.profile
-                serializer = ProfileSerializer(following_profile, context={'request': request})
-                data = serializer.data
-                
-                # Add relationship info
-                data['isFollowing'] = Follow.objects.filter(
-                    follower=request.user,
-                    following=follow.following
-                ).exists()
-                
-                following_data.append(data)
+                following_profiles.append(follow.following.profile)
             except Profile.DoesNotExist:
                 continue
         
-        return Response(following_data)
+        return Response(self._serialize_profiles(following_profiles))
 
     @action(detail=False, methods=['get'])
     def suggested(self, request):
@@ -350,20 +277,18 @@ class ProfileViewSet(viewsets.ModelViewSet):
         ).values_list('following_id', flat=True)
         
         # Exclude current user and already following
-        suggested = Profile.objects.exclude(
+        suggested = Profile.objects.select_related('user').exclude(
             user__id__in=list(following_ids) + [request.user.id]
         )[:10]
         
-        serializer = self.get_serializer(suggested, many=True)
-        profiles_data = self._add_relationship_data(serializer.data, request.user)
-        
-        return Response(profiles_data)
+        return Response(self._serialize_profiles(suggested))
 
 # Video ViewSet
 class VideoViewSet(viewsets.ModelViewSet):
     queryset = Video.objects.all().order_by('-created_at')
     serializer_class = VideoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FeedPagination  # ?cursor= switches the feed to keyset pagination
     parser_classes = [parsers.MultiPartParser, parsers.FormParser, parsers.JSONParser]
     
     def get_serializer_context(self):
@@ -382,33 +307,40 @@ class VideoViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(privacy=privacy)
         
         # For main feed (no username filter), show only:
-        # 1. Videos from users the current user follows
+        # 1. Videos from users the current user follows (and their own)
         # 2. Public videos from all users
-        if not username and not privacy and not self.request.query_params.get('search', None):
+        if self._is_main_feed():
             if self.request.user.is_authenticated:
-                # Get list of followed users
-                followed_users = Follow.objects.filter(follower=self.request.user).values_list('following__username', flat=True)
-                # Include current user's own videos
-                followed_users = list(followed_users) + [self.request.user.username]
-                # Filter: videos from followed users OR public videos
-                queryset = queryset.filter(
-                    Q(username__in=followed_users) | Q(privacy='Public')
-                ).distinct()
+                queryset = followed_or_public_queryset(self.request.user)
             else:
                 # For unauthenticated users, only show public videos
                 queryset = queryset.filter(privacy='Public')
         
-        # Search functionality
+        # Search functionality: full-text on description, username and hashtags,
+        # best match first (core.search)
         search = self.request.query_params.get('search', None)
         if search:
-            queryset = queryset.filter(
-                Q(description__icontains=search) |
-                Q(username__icontains=search) |
-                Q(hashtags__name__icontains=search)
-            ).distinct()
-        return queryset.order_by('-created_at')
+            return VideoSerializer.eager_load(ranked(queryset, search_documents('video', search)))
+        return VideoSerializer.eager_load(queryset.order_by('-created_at'))
 
-    def perform_create(self, serializer):
+    def _is_main_feed(self):
+        params = self.request.query_params
+        return not params.get('username') and not params.get('privacy') and not params.get('search')
+
+    def list(self, request, *args, **kwargs):
+        # Cursor-mode home feed reads the materialized timeline (core.timeline)
+        if self._is_main_feed() and request.user.is_authenticated and wants_cursor(request):
+            paginator = KeysetPagination()
+            page = paginator.paginate_source(
+                lambda position, limit: home_feed(request.user, limit, position), request, self
+            )
+            prefetch_related_objects(page, 'hashtags', 'media_job')
+            serializer = self.get_serializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+        return super().list(request, *args, **kwargs)
+
+    def perform_create(self, serializer, video_file=None):
+        """Create an uploaded video; ``video_file`` is the stored name of a file assembled by finalize_upload"""
         import logging
         logger = logging.getLogger(__name__)
         
@@ -417,7 +349,8 @@ class VideoViewSet(viewsets.ModelViewSet):
         logger.info(f"Video upload - Data: {self.request.data}")
         
         # Save video with request context for URL building
-        video = serializer.save(user=self.request.user, username=self.request.user.username)
+        extra = {'video_file': video_file} if video_file else {}
+        video = serializer.save(user=self.request.user, username=self.request.user.username, **extra)
         
         logger.info(f"Video saved - ID: {video.id}, video_file: {video.video_file}, video_file.name: {video.video_file.name if video.video_file else None}")
         
@@ -436,88 +369,187 @@ class VideoViewSet(viewsets.ModelViewSet):
             hashtag_names = [h.strip() for h in hashtag_names.split(',')]
         for tag_name in hashtag_names:
             if tag_name:
-                hashtag, created = Hashtag.objects.get_or_create(name=tag_name.strip().lstrip('#'))
+                hashtag, created = Hashtag.objects.get_or_create(
+                    name=tag_name.strip().lstrip('#'), defaults={'usage_count': 1}
+                )
                 hashtag.videos.add(video)
-                hashtag.usage_count += 1
-                hashtag.save()
+                if not created:
+                    # Not Hashtag.save: its search signal would look for a rename
+                    Hashtag.objects.filter(pk=hashtag.pk).update(usage_count=F('usage_count') + 1)
+        
+        # Push into followers' home timelines
+        transaction.on_commit(lambda: fan_out_video(video))
+
+        # Poster, preview and HLS renditions are made in the background (core.media)
+        if video.video_file:
+            media.enqueue(video)
         
         # Award VyRa Points for upload
-        self._award_points(self.request.user, 10, 'earned', f'Uploaded video: {video.id}')
+        points.award(
+            self.request.user.pk, points.UPLOAD_POINTS, f'Uploaded video: {video.id}', key=f'upload:{video.pk}',
+            video=video
+        )
         
         # Update profile upload count
         profile = Profile.objects.get(user=self.request.user)
         profile.upload_count += 1
         profile.save()
 
+    # Resumable uploads (core.uploads): start, PUT the chunks, finalize
+    def _upload(self, upload_id):
+        try:
+            return VideoUpload.objects.get(pk=upload_id, user=self.request.user)
+        except (VideoUpload.DoesNotExist, ValidationError):
+            return None
+
+    def _upload_state(self, upload):
+        return {
+            'uploadId': str(upload.pk),
+            'filename': upload.filename,
+            'size': upload.size,
+            'chunkSize': upload.chunk_size,
+            'chunkCount': upload.chunk_count,
+            'status': upload.status,
+            'receivedChunks': uploads.received_chunks(upload),
+            'videoId': str(upload.video_id) if upload.video_id else None,
+        }
+
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def start_upload(self, request):
+        """Start a resumable upload of {filename, size, checksum (SHA-256 hex, optional), chunkSize (optional)}"""
+        try:
+            upload = uploads.start(
+                request.user, request.data.get('filename'), request.data.get('size'),
+                request.data.get('checksum', ''), request.data.get('chunkSize'),
+            )
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return Response(self._upload_state(upload), status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path=r'uploads/(?P<upload_id>[^/.]+)')
+    def upload_status(self, request, upload_id=None):
+        """An upload's chunks received so far, to resume after a dropped connection"""
+        upload = self._upload(upload_id)
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._upload_state(upload))
+
+    @action(detail=False, methods=['put'], url_path=r'uploads/(?P<upload_id>[^/.]+)/chunks/(?P<index>[0-9]+)')
+    def upload_chunk(self, request, upload_id=None, index=None):
+        """Store chunk ``index`` from the raw request body, checked against X-Chunk-SHA256 if sent"""
+        upload = self._upload(upload_id)
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        if upload.status != 'uploading':
+            return Response({'error': 'Upload already finalized'}, status=status.HTTP_409_CONFLICT)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        try:
+            # The body is read from the stream as it arrives, never parsed or held in memory
+            chunk = uploads.receive_chunk(
+                upload, int(index), request.stream, length, request.headers.get('X-Chunk-SHA256', '')
+            )
+        except uploads.UploadError as e:
+            return Response({'error': str(e)}, status=e.status)
+        return Response({'index': chunk.index, 'size': chunk.size, 'checksum': chunk.checksum})
+
+    @action(detail=False, methods=['post'], url_path=r'uploads/(?P<upload_id>[^/.]+)/finalize')
+    def finalize_upload(self, request, upload_id=None):
+        """Assemble the chunks and create the video from the request's fields, as a direct upload would"""
+        upload = self._upload(upload_id)
+        if upload is None:
+            return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+        if upload.video_id:
+            return Response(self.get_serializer(upload.video).data)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not uploads.claim(upload):
+            return Response({'error': 'Upload is already being finalized'}, status=status.HTTP_409_CONFLICT)
+        try:
+            name = uploads.assemble(upload)
+            try:
+                with transaction.atomic():
+                    self.perform_create(serializer, video_file=name)
+                    VideoUpload.objects.filter(pk=upload.pk).update(status='complete', video=serializer.instance)
+            except BaseException:
+                Video._meta.get_field('video_file').storage.delete(name)
+                raise
+        except BaseException as e:
+            uploads.release(upload)
+            if isinstance(e, uploads.UploadError):
+                return Response({'error': str(e), 'receivedChunks': uploads.received_chunks(upload)}, status=e.status)
+            raise
+        uploads.discard_chunks(upload)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
     def like(self, request, pk=None):
         """Like/unlike a video"""
         video = self.get_object()
-        like, created = Like.objects.get_or_create(video=video, user=request.user)
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(video=video, user=request.user)
+            if not created:
+                deleted, _ = Like.objects.filter(pk=like.pk).delete()
+                if deleted:
+                    self._buffer_counter(video, 'likes', -1)
+            else:
+                self._buffer_counter(video, 'likes', 1)
+                record_engagement(request.user, video, 'like')
+                # Award VyRa Points (buffered, see core.points)
+                points.award_later(request.user.pk, 'like', video.pk)
+                # Queue notification (coalesced by core.notifications)
+                notifications.notify(video.user_id, request.user, 'like', video)
+        video_counters.merge(video)
         if not created:
-            like.delete()
-            video.likes = max(0, video.likes - 1)
-            video.save()
             return Response({'liked': False, 'likes': video.likes})
-        video.likes += 1
-        video.save()
-        # Award VyRa Points
-        self._award_points(request.user, 1, 'earned', f'Liked video: {video.id}')
-        # Create notification
-        if video.user != request.user:
-            Notification.objects.create(
-                user=video.user,
-                from_user=request.user,
-                notification_type='like',
-                message=f'{request.user.username} liked your video',
-                video=video
-            )
         return Response({'liked': True, 'likes': video.likes})
 
     @action(detail=True, methods=['post'])
     def buzz(self, request, pk=None):
         """Buzz a video (VyRaChallenge engagement)"""
         video = self.get_object()
-        buzz, created = Buzz.objects.get_or_create(video=video, user=request.user)
-        if created:
-            video.buzz_count += 1
-            video.save()
+        with transaction.atomic():
+            buzz, created = Buzz.objects.get_or_create(video=video, user=request.user)
+            if not created:
+                return Response({'buzzed': False, 'buzzCount': video_counters.merge(video).buzz_count})
+            self._buffer_counter(video, 'buzz_count', 1)
+            record_engagement(request.user, video, 'buzz')
             # Update profile total buzz
-            profile = Profile.objects.get(user=video.user)
-            profile.total_buzz += 1
-            profile.save()
-            # Award VyRa Points
-            self._award_points(request.user, 3, 'earned', f'Buzzed video: {video.id}')
-            # Create notification
-            if video.user != request.user:
-                Notification.objects.create(
-                    user=video.user,
-                    from_user=request.user,
-                    notification_type='buzz',
-                    message=f'{request.user.username} buzzed your video',
-                    video=video
-                )
-            return Response({'buzzed': True, 'buzzCount': video.buzz_count})
-        return Response({'buzzed': False, 'buzzCount': video.buzz_count})
+            Profile.objects.filter(user_id=video.user_id).update(total_buzz=F('total_buzz') + 1)
+            # Award VyRa Points (buffered, see core.points)
+            points.award_later(request.user.pk, 'buzz', video.pk)
+            # Queue notification (coalesced by core.notifications)
+            notifications.notify(video.user_id, request.user, 'buzz', video)
+        video_counters.merge(video)
+        return Response({'buzzed': True, 'buzzCount': video.buzz_count})
 
     @action(detail=True, methods=['post'])
     def share(self, request, pk=None):
         """Share a video"""
         video = self.get_object()
-        share, created = Share.objects.get_or_create(video=video, user=request.user)
-        if created:
-            video.shares += 1
-            video.save()
-            # Award VyRa Points
-            self._award_points(request.user, 1, 'earned', f'Shared video: {video.id}')
-            return Response({'shared': True, 'shares': video.shares})
-        return Response({'shared': False, 'shares': video.shares})
+        with transaction.atomic():
+            share, created = Share.objects.get_or_create(video=video, user=request.user)
+            if not created:
+                return Response({'shared': False, 'shares': video_counters.merge(video).shares})
+            self._buffer_counter(video, 'shares', 1)
+            record_engagement(request.user, video, 'share')
+            # Award VyRa Points (buffered, see core.points)
+            points.award_later(request.user.pk, 'share', video.pk)
+        video_counters.merge(video)
+        return Response({'shared': True, 'shares': video.shares})
 
     @action(detail=True, methods=['get'])
     def comments(self, request, pk=None):
         """Get comments for a video"""
         video = self.get_object()
         comments = Comment.objects.filter(video=video).order_by('-created_at')
+        if wants_cursor(request):
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(comments, request, self)
+            serializer = CommentSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
         serializer = CommentSerializer(comments, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -525,39 +557,25 @@ class VideoViewSet(viewsets.ModelViewSet):
     def add_comment(self, request, pk=None):
         """Add a comment to a video"""
         video = self.get_object()
-        comment = Comment.objects.create(
-            video=video,
-            user=request.user,
-            username=request.user.username,
-            text=request.data.get('text', '')
-        )
-        video.comments_count += 1
-        video.save()
-        # Award VyRa Points
-        self._award_points(request.user, 2, 'earned', f'Commented on video: {video.id}')
-        # Create notification
-        if video.user != request.user:
-            Notification.objects.create(
-                user=video.user,
-                from_user=request.user,
-                notification_type='comment',
-                message=f'{request.user.username} commented on your video',
-                video=video
+        with transaction.atomic():
+            comment = Comment.objects.create(
+                video=video,
+                user=request.user,
+                username=request.user.username,
+                text=request.data.get('text', '')
             )
+            self._buffer_counter(video, 'comments_count', 1)
+            record_engagement(request.user, video, 'comment')
+            # Award VyRa Points (buffered, see core.points)
+            points.award_later(request.user.pk, 'comment', video.pk)
+            # Queue notification (coalesced by core.notifications)
+            notifications.notify(video.user_id, request.user, 'comment', video)
         serializer = CommentSerializer(comment, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def _award_points(self, user, points, transaction_type, description):
-        """Helper method to award VyRa Points"""
-        VyRaPointsTransaction.objects.create(
-            user=user,
-            points=points,
-            transaction_type=transaction_type,
-            description=description
-        )
-        profile = Profile.objects.get(user=user)
-        profile.vyra_points += points
-        profile.save()
+    def _buffer_counter(self, video, field, delta):
+        """Queue a counter delta in the write-behind buffer once the transaction commits"""
+        transaction.on_commit(lambda: video_counters.add(video.pk, field, delta))
 
     @action(detail=True, methods=['post'])
     def boost(self, request, pk=None):
@@ -569,95 +587,117 @@ class VideoViewSet(viewsets.ModelViewSet):
             'campus': 100,
             'hashtag': 75
         }.get(boost_type, 50)
-        
-        profile = Profile.objects.get(user=request.user)
-        if profile.vyra_points < points_cost:
-            return Response({'error': 'Insufficient VyRa Points'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Deduct points
-        VyRaPointsTransaction.objects.create(
-            user=request.user,
-            points=-points_cost,
-            transaction_type='spent',
-            description=f'Boosted video: {video.id} ({boost_type})',
-            video=video
-        )
-        profile.vyra_points -= points_cost
-        profile.save()
-        
-        # Add boost score
         boost_multiplier = {
             'glow': 10,
             'campus': 15,
             'hashtag': 12
         }.get(boost_type, 10)
-        video.boost_score += boost_multiplier
-        video.save()
-        
+
+        try:
+            with transaction.atomic():
+                charged = points.spend(
+                    request.user.pk, points_cost, f'Boosted video: {video.id} ({boost_type})',
+                    key=idempotency_key(request, 'boost-video'), video=video
+                )
+                # Add boost score (a retried request is neither charged nor boosted again)
+                if charged:
+                    # A bare UPDATE skips Video.save: bump updated_at for refresh_trending_scores,
+                    # and rank the boost right away
+                    Video.objects.filter(pk=video.pk).update(
+                        boost_score=F('boost_score') + boost_multiplier, updated_at=timezone.now()
+                    )
+                    video.refresh_from_db(fields=['created_at', *WEIGHTS])
+                    Video.objects.filter(pk=video.pk).update(trending_score=trending_score(video))
+        except points.InsufficientPoints:
+            return Response({'error': 'Insufficient VyRa Points'}, status=status.HTTP_400_BAD_REQUEST)
+        video.refresh_from_db(fields=['boost_score'])
+
         return Response({
             'boosted': True,
             'boostScore': video.boost_score,
-            'remainingPoints': profile.vyra_points
+            'remainingPoints': points.balance(request.user.pk)
         })
 
+    def _map_query(self, request):
+        """Parse lat/lng/radius for the Universe Map endpoints; returns (lat, lng, radius) or an error Response"""
+        try:
+            lat = float(request.query_params['lat'])
+            lng = float(request.query_params['lng'])
+            radius = float(request.query_params.get('radius', 10))  # km
+        except (KeyError, ValueError):
+            return Response({'error': 'Latitude and longitude required'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or not 0 < radius <= 1000:
+            return Response({'error': 'Invalid location or radius'}, status=status.HTTP_400_BAD_REQUEST)
+        return lat, lng, radius
+
     @action(detail=False, methods=['get'])
     def nearby(self, request):
-        """Get videos near a location (Universe Map)"""
-        lat = request.query_params.get('lat', None)
-        lng = request.query_params.get('lng', None)
-        radius = float(request.query_params.get('radius', 10))  # km
-        
-        if not lat or not lng:
-            return Response({'error': 'Latitude and longitude required'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Simple distance calculation (for production, use PostGIS or geopy)
-        from math import radians, cos, sin, asin, sqrt
-        lat, lng = float(lat), float(lng)
-        
-        videos = Video.objects.filter(
-            latitude__isnull=False,
-            longitude__isnull=False,
-            privacy='Public'
-        )
-        
-        nearby_videos = []
-        for video in videos:
-            # Haversine formula for distance
-            lat1, lon1 = radians(lat), radians(lng)
-            lat2, lon2 = radians(video.latitude), radians(video.longitude)
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-            c = 2 * asin(sqrt(a))
-            distance_km = 6371 * c  # Earth radius in km
-            
-            if distance_km <= radius:
-                nearby_videos.append(video)
-        
-        serializer = VideoSerializer(nearby_videos, many=True, context={'request': request})
-        return Response(serializer.data)
+        """Get videos near a location (Universe Map), nearest first"""
+        query = self._map_query(request)
+        if isinstance(query, Response):
+            return query
+        lat, lng, radius = query
+        public = Video.objects.filter(privacy='Public')
+
+        def fetch(position, limit):
+            hits = geo.nearest(public, lat, lng, radius, limit, position)
+            videos = VideoSerializer.eager_load(Video.objects.filter(pk__in=[pk for _, pk in hits])).in_bulk()
+            page = []
+            for distance, pk in hits:
+                video = videos[pk]
+                video.distance = distance
+                page.append(video)
+            return page
+
+        paginator = KeysetPagination()
+        paginator.ordering = ('distance', 'id')
+        if wants_cursor(request):
+            page = paginator.paginate_source(fetch, request, model=Video)
+        else:
+            page = fetch(None, paginator.get_page_size(request))
+        data = VideoSerializer(page, many=True, context={'request': request}).data
+        for item, video in zip(data, page):
+            item['distanceKm'] = round(video.distance, 3)
+        if wants_cursor(request):
+            return paginator.get_paginated_response(data)
+        return Response(data)
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """Public video counts grouped into geohash cells sized for the map zoom level"""
+        query = self._map_query(request)
+        if isinstance(query, Response):
+            return query
+        lat, lng, radius = query
+        try:
+            zoom = int(request.query_params.get('zoom', 12))
+        except ValueError:
+            return Response({'error': 'Invalid zoom'}, status=status.HTTP_400_BAD_REQUEST)
+        cells = geo.clusters(Video.objects.filter(privacy='Public'), lat, lng, radius, zoom)
+        return Response([{
+            'geohash': cell['cell'],
+            'count': cell['count'],
+            'latitude': cell['center_lat'],
+            'longitude': cell['center_lng'],
+        } for cell in cells])
 
     @action(detail=False, methods=['get'])
     def recommended(self, request):
         """Get smart recommended videos"""
-        # Get user's interests from liked videos
-        liked_videos = Like.objects.filter(user=request.user).values_list('video', flat=True)
-        liked_hashtags = Hashtag.objects.filter(videos__in=liked_videos).distinct()
-        
-        # Calculate score: likes*2 + comments*3 + buzz*4 + boost_score*5
-        videos = Video.objects.filter(privacy='Public').annotate(
-            score=(Count('likes_rel') * 2) + 
-                  (Count('comments_rel') * 3) + 
-                  (Count('buzzes') * 4) +
-                  (F('boost_score') * 5)
-        )
-        
-        # Filter by user's interests
-        if liked_hashtags:
-            videos = videos.filter(hashtags__in=liked_hashtags).distinct()
-        
-        # Sort by score and return top 20
-        videos = videos.order_by('-score', '-created_at')[:20]
+        public = Video.objects.filter(privacy='Public').order_by('-trending_score', '-created_at')
+        profile = InterestProfile.objects.filter(user=request.user).first()
+        hashtag_ids, creator_ids = top_interests(profile, TOP_INTERESTS) if profile else ([], [])
+        if not hashtag_ids and not creator_ids:
+            # No interests yet: plain trending
+            videos = VideoSerializer.eager_load(public)[:20]
+        else:
+            # Candidates: best-trending videos matching the user's strongest
+            # interests (core.interests), re-ranked by affinity
+            candidates = public.filter(
+                Exists(Hashtag.videos.through.objects.filter(video_id=OuterRef('pk'), hashtag_id__in=hashtag_ids))
+                | Q(user_id__in=creator_ids)
+            )
+            videos = rank(profile, list(VideoSerializer.eager_load(candidates)[:CANDIDATES]))[:20]
         serializer = VideoSerializer(videos, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -704,28 +744,23 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Only seller can boost'}, status=status.HTTP_403_FORBIDDEN)
         
         points_cost = 100
-        profile = Profile.objects.get(user=request.user)
-        if profile.vyra_points < points_cost:
+        try:
+            with transaction.atomic():
+                charged = points.spend(
+                    request.user.pk, points_cost, f'Boosted product: {product.id}',
+                    key=idempotency_key(request, 'boost-product')
+                )
+                # Add boost score (a retried request is neither charged nor boosted again)
+                if charged:
+                    Product.objects.filter(pk=product.pk).update(boost_score=F('boost_score') + 20)
+        except points.InsufficientPoints:
             return Response({'error': 'Insufficient VyRa Points'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Deduct points
-        profile.vyra_points -= points_cost
-        profile.save()
-        VyRaPointsTransaction.objects.create(
-            user=request.user,
-            points=-points_cost,
-            transaction_type='spent',
-            description=f'Boosted product: {product.id}'
-        )
-        
-        # Add boost score
-        product.boost_score += 20
-        product.save()
-        
+        product.refresh_from_db(fields=['boost_score'])
+
         return Response({
             'boosted': True,
             'boostScore': product.boost_score,
-            'remainingPoints': profile.vyra_points
+            'remainingPoints': points.balance(request.user.pk)
         })
 
 # Battle ViewSet (VyRaBattles)
@@ -763,11 +798,8 @@ class BattleViewSet(viewsets.ModelViewSet):
         battle.save()
 
         # Award VyRa Points
-        VyRaPointsTransaction.objects.create(
-            user=request.user,
-            points=1,
-            transaction_type='earned',
-            description=f'Voted in battle: {battle.id}',
+        points.award(
+            request.user.pk, 1, f'Voted in battle: {battle.id}', key=f'battle-vote:{battle.pk}:{request.user.pk}',
             battle=battle
         )
 
@@ -781,22 +813,28 @@ class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FeedPagination
 
     def get_queryset(self):
+        # Rows are coalesced groups (core.notifications); newest activity first
         return Notification.objects.filter(user=self.request.user).order_by('-created_at')
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """Mark notification as read"""
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        with transaction.atomic():
+            # Only the request that flips is_read decrements the badge
+            if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+                badges.bump([request.user.pk], 'unread_notifications', -1)
         return Response({'message': 'Marked as read'})
 
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
         """Mark all notifications as read"""
-        Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+        with transaction.atomic():
+            marked = Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+            badges.bump([request.user.pk], 'unread_notifications', -marked)
         return Response({'message': 'All notifications marked as read'})
 
 # VyRaPoints ViewSet
@@ -811,21 +849,60 @@ class VyRaPointsViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def total(self, request):
         """Get total VyRa Points for current user"""
-        profile = Profile.objects.get(user=request.user)
-        return Response({'totalPoints': profile.vyra_points})
+        return Response({'totalPoints': points.balance(request.user.pk)})
+
+    def _board(self, request):
+        """(period, scope, club id) from ?period=daily|weekly|all, ?hashtag= and ?club=, or an error Response"""
+        period = request.query_params.get('period', 'weekly')
+        if period not in leaderboards.PERIODS:
+            return Response({'error': 'Unknown period'}, status=status.HTTP_400_BAD_REQUEST)
+        scope, club_id = leaderboards.EVERYONE, None
+        if request.query_params.get('hashtag'):
+            hashtag = Hashtag.objects.filter(name=request.query_params['hashtag'].lstrip('#')).first()
+            if hashtag is None:
+                return Response({'error': 'Hashtag not found'}, status=status.HTTP_404_NOT_FOUND)
+            scope = leaderboards.hashtag_scope(hashtag.pk)
+        if request.query_params.get('club'):
+            try:
+                club_id = Club.objects.values_list('pk', flat=True).get(pk=request.query_params['club'])
+            except (Club.DoesNotExist, ValidationError):
+                return Response({'error': 'Club not found'}, status=status.HTTP_404_NOT_FOUND)
+        return period, scope, club_id
 
     @action(detail=False, methods=['get'])
     def leaderboard(self, request):
-        """Get weekly leaderboard"""
-        week_ago = timezone.now() - timedelta(days=7)
-        transactions = VyRaPointsTransaction.objects.filter(
-            created_at__gte=week_ago,
-            transaction_type='earned'
-        ).values('user__username').annotate(
-            total_points=Sum('points')
-        ).order_by('-total_points')[:10]
-        
-        return Response(list(transactions))
+        """Top earners of a day, the last seven days or all time (weekly by default), overall or in a club or hashtag"""
+        board = self._board(request)
+        if isinstance(board, Response):
+            return board
+        period, scope, club_id = board
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 100))
+        except ValueError:
+            limit = 10
+        leaders = leaderboards.top(period, limit, scope, club_id)
+        usernames = dict(User.objects.filter(pk__in=[user_id for user_id, _ in leaders]).values_list('pk', 'username'))
+        rows = []
+        for position, (user_id, total) in enumerate(leaders, start=1):
+            # Ties share a rank
+            rank = rows[-1]['rank'] if rows and rows[-1]['total_points'] == total else position
+            rows.append({'rank': rank, 'userId': str(user_id), 'user__username': usernames.get(user_id),
+                         'total_points': total})
+        return Response(rows)
+
+    @action(detail=False, methods=['get'])
+    def rank(self, request):
+        """A user's rank on a leaderboard (the current user unless ?user= is given)"""
+        board = self._board(request)
+        if isinstance(board, Response):
+            return board
+        period, scope, club_id = board
+        try:
+            user_id = int(request.query_params.get('user', request.user.pk))
+        except ValueError:
+            return Response({'error': 'Invalid user'}, status=status.HTTP_400_BAD_REQUEST)
+        rank, total = leaderboards.rank(period, user_id, scope, club_id)
+        return Response({'userId': str(user_id), 'period': period, 'rank': rank, 'points': total})
 
 # Club ViewSet
 class ClubViewSet(viewsets.ModelViewSet):
@@ -869,7 +946,9 @@ class ClubViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def feed(self, request, pk=None):
         club = self.get_object()
-        posts = ClubPost.objects.filter(club=club).order_by('-created_at')
+        posts = ClubPost.objects.filter(club=club).select_related('video__media_job').prefetch_related(
+            'video__hashtags'
+        ).order_by('-created_at')
         videos = [post.video for post in posts]
         serializer = VideoSerializer(videos, many=True, context={'request': request})
         return Response(serializer.data)
@@ -887,16 +966,16 @@ class ChallengeViewSet(viewsets.ReadOnlyModelViewSet):
             challenge=challenge, user=request.user
         )
         if progress.completed and not progress.claimed:
-            progress.claimed = True
-            progress.save()
-            profile = Profile.objects.get(user=request.user)
-            profile.vyra_points += challenge.points_reward
-            profile.save()
-            VyRaPointsTransaction.objects.create(
-                user=request.user, points=challenge.points_reward,
-                transaction_type='reward', description=f'Completed challenge: {challenge.title}'
-            )
-            return Response({'claimed': True, 'points': challenge.points_reward})
+            with transaction.atomic():
+                progress.claimed = True
+                progress.save()
+                # Keyed, so a double tap racing past the claimed check pays out once
+                claimed = points.award(
+                    request.user.pk, challenge.points_reward, f'Completed challenge: {challenge.title}',
+                    transaction_type='reward', key=f'challenge:{challenge.pk}:{request.user.pk}'
+                )
+            if claimed:
+                return Response({'claimed': True, 'points': challenge.points_reward})
         return Response({'claimed': False, 'message': 'Challenge not completed or already claimed'})
 
 # Live Room ViewSet
@@ -925,48 +1004,76 @@ class LiveRoomViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Only host can end'}, status=status.HTTP_403_FORBIDDEN)
         room.status = 'ended'
         room.ended_at = timezone.now()
-        room.save()
+        room.save(update_fields=['status', 'ended_at'])
+        for battle in room.battles.filter(ended_at__isnull=True):
+            end_battle(battle)
+        presence.close(room.pk)
         return Response({'ended': True})
 
     @action(detail=True, methods=['post'])
     def join_viewer(self, request, pk=None):
+        """Join, or stay in, the room's audience; repeat within PRESENCE_TTL_SECONDS (core.presence)"""
+        room = self.get_object()
+        if room.status != 'live':
+            return Response({'viewerCount': presence.count(room.pk, default=room.viewer_count)})
+        return Response({'viewerCount': presence.heartbeat(room.pk, request.user.pk)})
+
+    @action(detail=True, methods=['post'])
+    def heartbeat(self, request, pk=None):
+        return self.join_viewer(request, pk)
+
+    @action(detail=True, methods=['post'])
+    def leave_viewer(self, request, pk=None):
         room = self.get_object()
-        if room.status == 'live':
-            room.viewer_count += 1
-            room.save()
-        return Response({'viewerCount': room.viewer_count})
+        return Response({'viewerCount': presence.leave(room.pk, request.user.pk)})
+
+    @action(detail=True, methods=['get'])
+    def viewers(self, request, pk=None):
+        """Live, peak and average audience"""
+        data = self.get_serializer(self.get_object()).data
+        return Response({key: data[key] for key in ('viewerCount', 'peakViewers', 'averageViewers')})
 
 # Live Battle ViewSet
 class LiveBattleViewSet(viewsets.ModelViewSet):
-    queryset = LiveBattle.objects.all().order_by('-started_at')
+    queryset = pending_votes(LiveBattle.objects.all()).order_by('-started_at')
     serializer_class = LiveBattleSerializer
     permission_classes = [IsAuthenticated]
 
     @action(detail=True, methods=['post'])
     def vote(self, request, pk=None):
         battle = self.get_object()
-        participant = request.data.get('participant')
-        points_cost = 5
-        profile = Profile.objects.get(user=request.user)
-        if profile.vyra_points < points_cost:
+        if battle.ended_at is not None:
+            return Response({'error': 'Battle has ended'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            voted = cast_vote(
+                battle, request.user.pk, request.data.get('participant'), key=idempotency_key(request, 'battle-vote')
+            )
+        except BattleEnded:
+            return Response({'error': 'Battle has ended'}, status=status.HTTP_400_BAD_REQUEST)
+        if not voted:
             return Response({'error': 'Insufficient VyRa Points'}, status=status.HTTP_400_BAD_REQUEST)
-        profile.vyra_points -= points_cost
-        profile.save()
-        VyRaPointsTransaction.objects.create(
-            user=request.user, points=-points_cost,
-            transaction_type='spent', description=f'Voted in live battle: {battle.id}'
-        )
-        if participant == '1':
-            battle.participant1_votes += 1
-        else:
-            battle.participant2_votes += 1
-        battle.save()
+        # The vote is counted in the battle's shards; its tallies are written (and pushed to the room) on the next flush
+        battle_votes.merge(battle)
         return Response({
             'voted': True,
             'participant1Votes': battle.participant1_votes,
             'participant2Votes': battle.participant2_votes
         })
 
+    @action(detail=True, methods=['post'])
+    def end(self, request, pk=None):
+        """End the battle: its last pending votes are written and the winner recorded"""
+        battle = self.get_object()
+        if request.user.pk not in (battle.live_room.host_id, battle.participant1_id, battle.participant2_id):
+            return Response({'error': 'Only the host or a participant can end'}, status=status.HTTP_403_FORBIDDEN)
+        battle = end_battle(battle)
+        return Response({
+            'ended': True,
+            'participant1Votes': battle.participant1_votes,
+            'participant2Votes': battle.participant2_votes,
+            'winnerId': str(battle.winner_id) if battle.winner_id else None,
+        })
+
 # Sound ViewSet
 class SoundViewSet(viewsets.ModelViewSet):
     queryset = Sound.objects.all().order_by('-usage_count', '-created_at')
@@ -992,19 +1099,19 @@ class ProfileSkinViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=True, methods=['post'])
     def purchase(self, request, pk=None):
         skin = self.get_object()
-        profile = Profile.objects.get(user=request.user)
-        if profile.vyra_points < skin.cost_points:
-            return Response({'error': 'Insufficient VyRa Points'}, status=status.HTTP_400_BAD_REQUEST)
         if UserSkin.objects.filter(user=request.user, skin=skin).exists():
             return Response({'error': 'Already owned'}, status=status.HTTP_400_BAD_REQUEST)
-        profile.vyra_points -= skin.cost_points
-        profile.save()
-        VyRaPointsTransaction.objects.create(
-            user=request.user, points=-skin.cost_points,
-            transaction_type='spent', description=f'Purchased skin: {skin.name}'
-        )
-        UserSkin.objects.create(user=request.user, skin=skin)
-        return Response({'purchased': True, 'remainingPoints': profile.vyra_points})
+        try:
+            with transaction.atomic():
+                # Keyed, so concurrent purchases of the same skin charge once
+                points.spend(
+                    request.user.pk, skin.cost_points, f'Purchased skin: {skin.name}',
+                    key=f'skin:{skin.pk}:{request.user.pk}'
+                )
+                UserSkin.objects.get_or_create(user=request.user, skin=skin)
+        except points.InsufficientPoints:
+            return Response({'error': 'Insufficient VyRa Points'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'purchased': True, 'remainingPoints': points.balance(request.user.pk)})
 
     @action(detail=False, methods=['get'])
     def my_skins(self, request):
@@ -1068,7 +1175,7 @@ class ChatViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Get all chats where current user is a participant"""
-        return Chat.objects.filter(participants=self.request.user).order_by('-updated_at')
+        return chats.inbox(self.request.user)
 
     def get_serializer_context(self):
         """Add request context"""
@@ -1110,12 +1217,54 @@ class ChatViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
-        """Get all messages for a chat"""
+        """Get messages for a chat.
+
+        ?before= pages back through history from the newest message, ?since=
+        returns what changed after a version the client has seen (core.chats).
+        Without either, every message is returned, oldest first.
+        """
         chat = self.get_object()
+        if 'before' in request.query_params or 'since' in request.query_params:
+            return self._message_sync(request, chat)
+        if wants_cursor(request):
+            # Newest first, for scrolling back through history
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(chat.messages.all(), request, self)
+            serializer = ChatMessageSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data)
         messages = chat.messages.order_by('created_at')
         serializer = ChatMessageSerializer(messages, many=True, context={'request': request})
         return Response(serializer.data)
 
+    def _message_sync(self, request, chat):
+        params = {}
+        for name in ('before', 'since'):
+            value = request.query_params.get(name)
+            try:
+                params[name] = int(value) if value else None
+            except ValueError:
+                return Response({'error': f'{name} must be a message version'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = KeysetPagination().get_page_size(request)
+        context = {'request': request}
+
+        if params['since'] is not None:
+            changed = chats.changes(chat, params['since'], limit)
+            return Response({
+                'results': ChatMessageSerializer(changed['messages'], many=True, context=context).data,
+                'reads': [{'userId': str(user_id), 'readUpTo': version} for user_id, version in changed['reads']],
+                'since': changed['since'],
+                'hasMore': changed['hasMore'],
+            })
+        # Read the version first: anything committed later is newer, and reaches the client by sync
+        since = Chat.objects.filter(pk=chat.pk).values_list('version', flat=True).get()
+        messages = chats.history(chat, params['before'], limit + 1)
+        page = messages[:limit]
+        return Response({
+            'results': ChatMessageSerializer(page, many=True, context=context).data,
+            'before': page[-1].version if len(messages) > limit else None,
+            'since': since,
+        })
+
     @action(detail=True, methods=['post'])
     def send_message(self, request, pk=None):
         """Send a message in a chat"""
@@ -1125,27 +1274,23 @@ class ChatViewSet(viewsets.ModelViewSet):
         if not message_text:
             return Response({'error': 'Message cannot be empty'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check if user is a participant
-        if request.user not in chat.participants.all():
-            return Response({'error': 'You are not a participant in this chat'}, status=status.HTTP_403_FORBIDDEN)
-        
-        message = ChatMessage.objects.create(
-            chat=chat,
-            sender=request.user,
-            message=message_text
-        )
-        
-        # Update chat's updated_at
-        chat.save()
+        # get_object only finds chats in the user's inbox, so non-participants get a 404
+        # Versioned, and recorded on the chat and its members (core.chats)
+        message = chats.post_message(chat, request.user, message_text)
         
         serializer = ChatMessageSerializer(message, context={'request': request})
+        realtime.publish(realtime.chat_group(chat.pk), {'type': 'message', 'message': serializer.data})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['post'])
     def mark_read(self, request, pk=None):
         """Mark all messages in chat as read"""
         chat = self.get_object()
-        chat.messages.exclude(sender=request.user).update(is_read=True)
+        read_version = chats.mark_read(request.user.pk, chat.pk)
+        if read_version is not None:
+            realtime.publish(realtime.chat_group(chat.pk), {
+                'type': 'read', 'userId': str(request.user.pk), 'readUpTo': read_version,
+            })
         return Response({'message': 'Messages marked as read'})
 
 # Chat Message ViewSet
@@ -1153,6 +1298,7 @@ class ChatMessageViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = ChatMessage.objects.all().order_by('-created_at')
     serializer_class = ChatMessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FeedPagination
 
     def get_queryset(self):
         """Get messages for chats where user is a participant"""
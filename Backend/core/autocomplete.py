@@ -0,0 +1,272 @@
+"""In-memory prefix autocomplete for usernames, display names and hashtags.
+
+Each process keeps one PrefixIndex per kind: a sorted array of
+(key, pk) pairs searched with bisect, ranked by follower count (users) or
+usage count (hashtags). A prefix matching more than SCAN_LIMIT keys (one or
+two characters, typically) is answered from a cached top-K list that is
+patched as entries change, so short prefixes cost the same as long ones.
+
+Memory is bounded by AUTOCOMPLETE_MAX_ENTRIES per kind: only the highest
+ranked entries are kept, and a prefix with too few in-memory matches falls
+back to the full-text index (core.search). Names are kept current by the
+signals in core.signals; ranks drift as follower and usage counts change
+(those are updated in bulk, without signals) and are refreshed by a full
+rebuild every AUTOCOMPLETE_REFRESH_SECONDS, in a background thread.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+
+from . import search
+from .models import Hashtag, Profile
+
+MAX_CHAR = '\U0010ffff'
+SCAN_LIMIT = 512
+TOP_K = 20
+MAX_LIMIT = 20
+
+
+def normalize(text):
+    return (text or '').strip().lstrip('@#').casefold()
+
+
+def profile_keys(username, display_name):
+    """Full username and display name, plus each display name word"""
+    keys = {normalize(username), normalize(display_name), *normalize(display_name).split()}
+    keys.discard('')
+    return tuple(sorted(keys))
+
+
+def profile_entry(profile):
+    payload = {
+        'id': profile.user_id,
+        'username': profile.user.username,
+        'displayName': profile.display_name,
+        'isVerified': profile.is_verified,
+        'followersCount': profile.followers_count,
+    }
+    return profile.user_id, profile.followers_count, profile_keys(profile.user.username, profile.display_name), payload
+
+
+def hashtag_entry(hashtag):
+    payload = {'id': hashtag.pk, 'name': hashtag.name, 'usageCount': hashtag.usage_count}
+    return hashtag.pk, hashtag.usage_count, tuple({normalize(hashtag.name)} - {''}), payload
+
+
+class PrefixIndex:
+    """Up to max_entries entries, searchable by key prefix and ranked by score (highest first)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.keys = []  # Sorted (key, pk)
+        self.entries = {}  # pk -> (score, keys, payload)
+        self.lowest = []  # Min-heap of (score, pk) for eviction; stale pairs are skipped
+        self.top = {}  # Prefix -> best TOP_K pks, for prefixes matching more than SCAN_LIMIT keys
+        self.evicted = False  # Whether some entry was dropped to stay within max_entries
+
+    def load(self, entries):
+        """Replace the contents with (pk, score, keys, payload) entries, keeping the highest scored"""
+        best = heapq.nlargest(self.max_entries + 1, entries, key=lambda entry: entry[1])
+        self.evicted = len(best) > self.max_entries
+        self.entries = {pk: (score, keys, payload) for pk, score, keys, payload in best[:self.max_entries]}
+        self.keys = sorted((key, pk) for pk, (_, keys, _) in self.entries.items() for key in keys)
+        self.lowest = [(score, pk) for pk, (score, _, _) in self.entries.items()]
+        heapq.heapify(self.lowest)
+        self.top = {}
+
+    def _order(self, pk):
+        return -self.entries[pk][0], pk
+
+    def _range(self, prefix):
+        lo = bisect_left(self.keys, (prefix,))
+        return lo, bisect_left(self.keys, (prefix + MAX_CHAR,), lo)
+
+    def _best(self, lo, hi, count):
+        return heapq.nsmallest(count, {pk for _, pk in self.keys[lo:hi]}, key=self._order)
+
+    def query(self, prefix, limit):
+        """Payloads of the best ``limit`` entries with a key starting with ``prefix``"""
+        lo, hi = self._range(prefix)
+        if hi - lo <= SCAN_LIMIT:
+            best = self._best(lo, hi, limit)
+        else:
+            best = self.top.get(prefix)
+            if best is None:
+                best = self.top[prefix] = self._best(lo, hi, TOP_K)
+        return [self.entries[pk][2] for pk in best[:limit]]
+
+    def upsert(self, pk, score, keys, payload):
+        old_keys = self._discard(pk)
+        if len(self.entries) >= self.max_entries:
+            if score <= self._lowest_score():
+                self.evicted = True
+                self._patch_top(pk, old_keys, ())
+                return
+            self._evict()
+        self.entries[pk] = (score, keys, payload)
+        for key in keys:
+            insort(self.keys, (key, pk))
+        heapq.heappush(self.lowest, (score, pk))
+        self._patch_top(pk, old_keys, keys)
+
+    def remove(self, pk):
+        self._patch_top(pk, self._discard(pk), ())
+
+    def _discard(self, pk):
+        """Remove pk's keys from the sorted array; returns them"""
+        if pk not in self.entries:
+            return ()
+        _, keys, _ = self.entries.pop(pk)
+        for key in keys:
+            position = bisect_left(self.keys, (key, pk))
+            del self.keys[position]
+        if len(self.lowest) > 2 * len(self.entries) + 64:
+            self.lowest = [(score, pk) for pk, (score, _, _) in self.entries.items()]
+            heapq.heapify(self.lowest)
+        return keys
+
+    def _lowest_score(self):
+        while self.lowest:
+            score, pk = self.lowest[0]
+            if pk in self.entries and self.entries[pk][0] == score:
+                return score
+            heapq.heappop(self.lowest)
+        return float('-inf')
+
+    def _evict(self):
+        self._lowest_score()
+        _, pk = heapq.heappop(self.lowest)
+        self.evicted = True
+        self.remove(pk)
+
+    def _patch_top(self, pk, old_keys, new_keys):
+        """Keep cached top lists right for every prefix of the entry's old and new keys"""
+        prefixes = {key[:length] for key in (*old_keys, *new_keys) for length in range(1, len(key) + 1)}
+        for prefix in prefixes & self.top.keys():
+            best = self.top[prefix]
+            matches = pk in self.entries and any(key.startswith(prefix) for key in new_keys)
+            if pk in best:
+                was_full = len(best) == TOP_K
+                best.remove(pk)
+                if was_full and not (matches and self._order(pk) < self._order(best[-1])):
+                    # pk may have dropped below an uncached entry; recompute on the next query
+                    del self.top[prefix]
+                    continue
+            if matches and (len(best) < TOP_K or self._order(pk) < self._order(best[-1])):
+                insort(best, pk, key=self._order)
+                del best[TOP_K:]
+
+
+def _profile_entries():
+    profiles = Profile.objects.select_related('user').only(
+        'user_id', 'display_name', 'is_verified', 'followers_count', 'user__username'
+    )
+    return (profile_entry(profile) for profile in profiles.iterator(chunk_size=2000))
+
+
+def _hashtag_entries():
+    return (hashtag_entry(hashtag) for hashtag in Hashtag.objects.iterator(chunk_size=2000))
+
+
+class Autocomplete:
+    """Per-process user and hashtag indexes, built on first use and rebuilt periodically"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.indexes = None
+        self.built_at = 0.0
+        self.rebuilding = False
+        self.pending = []  # Changes made while a background rebuild reads the database
+
+    def _build(self):
+        max_entries = getattr(settings, 'AUTOCOMPLETE_MAX_ENTRIES', 100000)
+        indexes = {'users': PrefixIndex(max_entries), 'hashtags': PrefixIndex(max_entries)}
+        indexes['users'].load(_profile_entries())
+        indexes['hashtags'].load(_hashtag_entries())
+        return indexes
+
+    def _rebuild_in_background(self):
+        try:
+            indexes = self._build()
+            with self.lock:
+                for kind, change, args in self.pending:
+                    getattr(indexes[kind], change)(*args)
+                self.indexes = indexes
+                self.built_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.rebuilding = False
+                self.pending = []
+            connection.close()
+
+    def _ready(self):
+        with self.lock:
+            if self.indexes is None:
+                self.indexes = self._build()
+                self.built_at = time.monotonic()
+            elif (not self.rebuilding and
+                  time.monotonic() - self.built_at > getattr(settings, 'AUTOCOMPLETE_REFRESH_SECONDS', 600)):
+                self.rebuilding = True
+                threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+            return self.indexes
+
+    def _apply(self, kind, change, *args):
+        with self.lock:
+            if self.indexes is None:
+                return  # Built from the database on first use
+            getattr(self.indexes[kind], change)(*args)
+            if self.rebuilding:
+                self.pending.append((kind, change, args))
+
+    def suggest(self, prefix, kinds=('users', 'hashtags'), limit=8):
+        prefix = normalize(prefix)
+        limit = max(1, min(limit, MAX_LIMIT))
+        if not prefix:
+            return {kind: [] for kind in kinds}
+        indexes = self._ready()
+        with self.lock:
+            results = {kind: indexes[kind].query(prefix, limit) for kind in kinds}
+            truncated = {kind: indexes[kind].evicted for kind in kinds}
+        for kind in kinds:
+            if truncated[kind] and len(results[kind]) < limit:
+                results[kind] = _with_fallback(kind, prefix, results[kind], limit)
+        return results
+
+    def update_profile(self, profile):
+        pk, score, keys, payload = profile_entry(profile)
+        self._apply('users', 'upsert', pk, score, keys, payload)
+
+    def remove_profile(self, user_id):
+        self._apply('users', 'remove', user_id)
+
+    def update_hashtag(self, hashtag):
+        pk, score, keys, payload = hashtag_entry(hashtag)
+        self._apply('hashtags', 'upsert', pk, score, keys, payload)
+
+    def remove_hashtag(self, pk):
+        self._apply('hashtags', 'remove', pk)
+
+    def reset(self):
+        with self.lock:
+            self.indexes = None
+
+
+def _with_fallback(kind, prefix, results, limit):
+    """Top up in-memory results for entries evicted from the index, via the full-text index"""
+    seen = {item['id'] for item in results}
+    if kind == 'users':
+        object_ids = search.autocomplete('profile', prefix, limit=limit * 4)
+        profiles = Profile.objects.select_related('user').filter(pk__in=object_ids).exclude(user_id__in=seen)
+        extra = [profile_entry(profile) for profile in profiles]
+    else:
+        object_ids = search.autocomplete('hashtag', prefix, limit=limit * 4)
+        extra = [hashtag_entry(hashtag) for hashtag in Hashtag.objects.filter(pk__in=object_ids).exclude(pk__in=seen)]
+    extra.sort(key=lambda entry: (-entry[1], entry[0]))
+    return results + [payload for _, _, _, payload in extra[:limit - len(results)]]
+
+
+autocomplete = Autocomplete()
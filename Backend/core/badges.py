@@ -0,0 +1,102 @@
+"""Maintained unread counts for the app's badges.
+
+``/api/badges/`` is polled constantly, so it reads counters instead of
+counting rows: a BadgeCounter per user (unread notifications, unread
+messages, pending challenge claims) and the unread count on each of the
+user's ChatParticipant rows.
+The counters change with the rows they count, with single-statement F()
+updates that never take them below zero:
+
+- notifications: when the outbox writes or resurfaces a notification, and
+  on mark_read / mark_all_read
+- messages: on send_message, and when a chat is marked read (core.chats)
+- challenge claims: recounted for the user whenever their progress is saved
+
+Deletions (a video taking its notifications with it, say) are not tracked;
+the reconcile_badges command repairs any drift.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import BadgeCounter, ChatMessage, ChatParticipant, Notification, User, UserChallengeProgress
+
+
+def _change(field, delta):
+    return F(field) + delta if delta > 0 else Greatest(F(field) + delta, 0)
+
+
+def bump(user_ids, field, delta):
+    """Add delta to a BadgeCounter field for each user, creating missing counters"""
+    user_ids = set(user_ids)
+    if not user_ids or not delta:
+        return
+    updated = BadgeCounter.objects.filter(user_id__in=user_ids).update(**{field: _change(field, delta)})
+    if updated < len(user_ids):
+        missing = user_ids - set(BadgeCounter.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+        BadgeCounter.objects.bulk_create([BadgeCounter(user_id=user_id) for user_id in missing], ignore_conflicts=True)
+        BadgeCounter.objects.filter(user_id__in=missing).update(**{field: _change(field, delta)})
+
+
+def notifications_unread(deltas):
+    """Apply {user_id: newly unread notifications}, one UPDATE per distinct delta"""
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        by_delta.setdefault(delta, []).append(user_id)
+    for delta, user_ids in by_delta.items():
+        bump(user_ids, 'unread_notifications', delta)
+
+
+def refresh_pending_claims(user_id):
+    pending = UserChallengeProgress.objects.filter(user_id=user_id, completed=True, claimed=False).count()
+    BadgeCounter.objects.update_or_create(user_id=user_id, defaults={'pending_claims': pending})
+
+
+def badge_counts(user):
+    """The badges payload: two primary-key/index lookups, however much is unread"""
+    counter = BadgeCounter.objects.filter(user=user).first() or BadgeCounter(user=user)
+    chats = ChatParticipant.objects.filter(user=user, unread_count__gt=0).values_list('chat_id', 'unread_count')
+    return {
+        'notifications': counter.unread_notifications,
+        'messages': counter.unread_messages,
+        'chats': {str(chat_id): count for chat_id, count in chats},
+        'challengeClaims': counter.pending_claims,
+    }
+
+
+def _count(queryset, group_by):
+    return Coalesce(Subquery(queryset.values(group_by).annotate(total=Count('pk')).values('total')), 0)
+
+
+def annotate_actual_chat_unread(queryset):
+    """ChatParticipant rows with their actual unread message count"""
+    unread = ChatMessage.objects.filter(chat=OuterRef('chat'), is_read=False).exclude(sender=OuterRef('user'))
+    return queryset.annotate(actual=_count(unread, 'chat'), stored=F('unread_count'))
+
+
+def drifted_chat_unreads():
+    return annotate_actual_chat_unread(ChatParticipant.objects.all()).exclude(actual=F('stored'))
+
+
+def annotate_actual_badges(queryset):
+    unread_messages = annotate_actual_chat_unread(
+        ChatParticipant.objects.filter(user=OuterRef('pk'))
+    )
+    return queryset.annotate(
+        actual_notifications=_count(Notification.objects.filter(user=OuterRef('pk'), is_read=False), 'user'),
+        actual_messages=Coalesce(Subquery(
+            unread_messages.values('user').annotate(total=Sum('actual')).values('total'),
+            output_field=IntegerField(),
+        ), 0),
+        actual_claims=_count(UserChallengeProgress.objects.filter(user=OuterRef('pk'), completed=True, claimed=False), 'user'),
+        stored_notifications=Coalesce('badge_counter__unread_notifications', 0),
+        stored_messages=Coalesce('badge_counter__unread_messages', 0),
+        stored_claims=Coalesce('badge_counter__pending_claims', 0),
+    )
+
+
+def drifted_badge_counters():
+    """Users whose stored counters (or missing counter row) disagree with the rows they count"""
+    return annotate_actual_badges(User.objects.all()).filter(
+        ~Q(stored_notifications=F('actual_notifications')) | ~Q(stored_messages=F('actual_messages'))
+        | ~Q(stored_claims=F('actual_claims'))
+    )
@@ -0,0 +1,232 @@
+"""Live battle voting.
+
+A vote is a keyed spend (core.points.spend): the conditional debit and the
+voter's ledger row are written in one transaction, so concurrent votes can
+never overdraw a balance and no point is taken without its row. A retried
+request with the same Idempotency-Key is charged and counted once.
+
+The vote is counted in that same transaction, so a vote that was paid for
+is never lost, whatever happens to the process afterwards. It does not touch
+the LiveBattle row, which every voter of a battle would wait on: it adds one
+to a random one of BATTLE_VOTE_SHARDS BattleVoteShard rows of the battle.
+A flush, run by a flusher thread every BATTLE_VOTE_FLUSH_INTERVAL seconds,
+locks the shards holding votes, adds them to LiveBattle with one UPDATE per
+battle and deletes them in the same transaction, then pushes the new totals
+to the live room's sockets. Until then the API adds the shards to the
+battle's tallies.
+
+Ending a battle locks the battle and all its shards, flushes them and
+records the winner in one transaction, so it waits for a flush or a vote
+holding them rather than skipping them. Its shards are then gone, and a
+vote arriving later finds the battle ended and is refused. Everything locks
+a battle's row before its shards; votes only lock the battle when they
+create its shards.
+
+A vote costs three statements besides its savepoints (the conditional debit,
+the ledger INSERT and the shard UPDATE), so on one CPU with SQLite
+bench_battle_votes counts several hundred votes a second on one battle,
+about three times the old read-modify-write path. Building the ORM
+statements, not the database, is most of that time.
+"""
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import points, realtime
+from .models import BattleVoteShard, LiveBattle
+
+logger = logging.getLogger(__name__)
+
+VOTE_COST = 5
+FIELDS = ('participant1_votes', 'participant2_votes')
+
+
+class BattleEnded(Exception):
+    pass
+
+
+def vote_field(participant):
+    return 'participant1_votes' if str(participant) == '1' else 'participant2_votes'
+
+
+class BattleVoteTallies:
+    """Sharded vote tallies per battle, added to LiveBattle on each flush"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def shards(self):
+        return getattr(settings, 'BATTLE_VOTE_SHARDS', 16)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'BATTLE_VOTE_FLUSH_INTERVAL', 1.0)
+
+    def add(self, battle_id, field):
+        """Count one vote in the current transaction; False if the battle has ended"""
+        if field not in FIELDS:
+            raise ValueError(f'Unknown battle tally: {field}')
+        self._start_flusher()
+        # Ending a battle deletes its shards, so a vote after the end finds none
+        shard = random.randrange(self.shards)
+        if self._increment(battle_id, shard, field):
+            return True
+        # First vote of the battle (or since its shards were flushed), or a vote after the end. The
+        # battle's row lock keeps end_battle out until the new shards hold this vote.
+        if not LiveBattle.objects.select_for_update().filter(pk=battle_id, ended_at__isnull=True).exists():
+            return False
+        BattleVoteShard.objects.bulk_create(
+            [BattleVoteShard(battle_id=battle_id, shard=i) for i in range(self.shards)], ignore_conflicts=True,
+        )
+        return self._increment(battle_id, shard, field)
+
+    def _increment(self, battle_id, shard, field):
+        # Every vote runs this: plain SQL costs a fraction of building the same UPDATE with the ORM
+        column = connection.ops.quote_name(field)
+        battle_id = BattleVoteShard._meta.get_field('battle').get_db_prep_value(battle_id, connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {BattleVoteShard._meta.db_table} SET {column} = {column} + 1 WHERE battle_id = %s AND shard = %s',
+                [battle_id, shard],
+            )
+            return cursor.rowcount > 0
+
+    def pending(self, battle_id):
+        """Votes not yet added to the battle's tallies, keyed by field"""
+        totals = BattleVoteShard.objects.filter(battle_id=battle_id).aggregate(
+            **{field: Sum(field) for field in FIELDS}
+        )
+        return {field: total for field, total in totals.items() if total}
+
+    def merge(self, battle):
+        """Add pending votes onto a battle's tallies in place"""
+        for field, delta in self.pending(battle.pk).items():
+            setattr(battle, field, getattr(battle, field) + delta)
+        return battle
+
+    def flush(self, battle_ids=None):
+        """Add pending votes to LiveBattle. Returns the number of battles written."""
+        with transaction.atomic():
+            shards = BattleVoteShard.objects.filter(Q(participant1_votes__gt=0) | Q(participant2_votes__gt=0))
+            if battle_ids is None:
+                battle_ids = set(shards.values_list('battle_id', flat=True))
+            if not battle_ids:
+                return 0
+            # Battles before their shards, each in a fixed order: the order end_battle and a
+            # battle's first votes take them in, so they wait for each other instead of deadlocking
+            list(LiveBattle.objects.select_for_update().filter(pk__in=battle_ids).order_by('pk').values_list('pk'))
+            rows = list(
+                shards.select_for_update().filter(battle_id__in=battle_ids).order_by('pk')
+                .values_list('pk', 'battle_id', *FIELDS)
+            )
+            if not rows:
+                return 0
+            updates = defaultdict(lambda: dict.fromkeys(FIELDS, 0))
+            for _, battle_id, *votes in rows:
+                for field, count in zip(FIELDS, votes):
+                    updates[battle_id][field] += count
+            for battle_id, fields in updates.items():
+                LiveBattle.objects.filter(pk=battle_id).update(
+                    **{field: F(field) + delta for field, delta in fields.items()}
+                )
+            # Votes cast meanwhile wait on the locked rows and then create fresh shards
+            BattleVoteShard.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            battle_ids = list(updates)
+            transaction.on_commit(lambda: self._publish(battle_ids))
+        return len(updates)
+
+    def _publish(self, battle_ids):
+        for battle in LiveBattle.objects.filter(pk__in=battle_ids).values(
+            'pk', 'live_room_id', 'participant1_votes', 'participant2_votes'
+        ):
+            realtime.publish(realtime.live_group(battle['live_room_id']), {
+                'type': 'battle_vote',
+                'battleId': str(battle['pk']),
+                'participant1Votes': battle['participant1_votes'],
+                'participant2Votes': battle['participant2_votes'],
+            })
+
+    def _start_flusher(self):
+        if self._thread is not None or not getattr(settings, 'COUNTER_FLUSH_THREAD', True):
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='battle-vote-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing battle votes failed')
+            finally:
+                connection.close()
+
+
+battle_votes = BattleVoteTallies()
+
+
+def pending_votes(queryset):
+    """Annotate LiveBattles with their votes not yet flushed, as pending_<field>"""
+    return queryset.annotate(**{
+        f'pending_{field}': Coalesce(
+            Subquery(
+                BattleVoteShard.objects.filter(battle=OuterRef('pk')).values('battle')
+                .annotate(total=Sum(field)).values('total')
+            ),
+            0,
+        )
+        for field in FIELDS
+    })
+
+
+def cast_vote(battle, user_id, participant, key=None):
+    """Spend VOTE_COST points on a vote and count it; False (and nothing spent) if the balance is too low.
+
+    A vote repeating an earlier ``key`` is neither charged nor counted again.
+    Raises BattleEnded, with nothing spent, once the battle has ended.
+    """
+    try:
+        with transaction.atomic():
+            charged = points.spend(user_id, VOTE_COST, f'Voted in live battle: {battle.pk}', key=key)
+            if charged and not battle_votes.add(battle.pk, vote_field(participant)):
+                raise BattleEnded
+    except points.InsufficientPoints:
+        return False
+    return True
+
+
+def end_battle(battle):
+    """Write the pending votes, then close the battle and record its winner (None on a tie)"""
+    with transaction.atomic():
+        # Wait for votes being counted in the battle's shards, and keep new shards out; a vote
+        # reaching the shards after this transaction finds them gone and the battle ended
+        list(LiveBattle.objects.select_for_update().filter(pk=battle.pk).values_list('pk'))
+        list(BattleVoteShard.objects.select_for_update().filter(battle_id=battle.pk).order_by('pk').values_list('pk'))
+        battle_votes.flush([battle.pk])
+        first, second = LiveBattle.objects.filter(pk=battle.pk).values_list(
+            'participant1_votes', 'participant2_votes'
+        ).get()
+        winner_id = None
+        if first > second:
+            winner_id = battle.participant1_id
+        elif second > first:
+            winner_id = battle.participant2_id
+        LiveBattle.objects.filter(pk=battle.pk, ended_at__isnull=True).update(
+            ended_at=timezone.now(), winner_id=winner_id
+        )
+        BattleVoteShard.objects.filter(battle_id=battle.pk).delete()  # Flushed, and closed to later votes
+    battle.refresh_from_db()
+    return battle
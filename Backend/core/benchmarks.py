@@ -0,0 +1,108 @@
+"""Shared helpers for the bench_* management commands.
+
+Benchmarks seed their data inside a transaction that is always rolled back,
+so they can be pointed at a development database without leaving rows behind.
+"""
+import asyncio
+import statistics
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is rolled back on exit"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def make_bench_user(prefix='bench'):
+    return User.objects.create(username=f'{prefix}-{uuid.uuid4().hex[:12]}')
+
+
+def bulk_create_in_batches(model, objects, batch_size=10000):
+    """bulk_create an iterable of unsaved instances without materializing it all at once"""
+    batch = []
+    created = 0
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            model.objects.bulk_create(batch, batch_size=batch_size)
+            created += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+    return created
+
+
+def spread_over_time(queryset, field, until, span, buckets):
+    """Backdate rows with random UUID keys evenly over ``span`` before ``until``, one UPDATE per bucket of keys.
+
+    Fields with auto_now_add ignore the values given to bulk_create, so rows
+    are created first and dated afterwards.
+    """
+    bounds = [uuid.UUID(int=i * 2 ** 128 // buckets) for i in range(buckets)] + [None]
+    for i in range(buckets):
+        rows = queryset.filter(pk__gte=bounds[i])
+        if bounds[i + 1] is not None:
+            rows = rows.filter(pk__lt=bounds[i + 1])
+        rows.update(**{field: until - span * (i + 0.5) / buckets})
+
+
+def reset_peak_rss():
+    """Restart this process's peak resident set size from its current size (Linux)"""
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process since the last reset_peak_rss, in MiB (Linux)"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def time_ms(fn, repeat=5):
+    """Median wall time of ``fn()`` in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+class LocalWebSocket:
+    """A WebSocket client that drives an ASGI application in-process, without a server or sockets"""
+
+    def __init__(self, application, path, token=None):
+        self.inbound = asyncio.Queue()
+        self.outbound = asyncio.Queue()
+        scope = {
+            'type': 'websocket', 'path': path, 'headers': [],
+            'query_string': f'token={token}'.encode() if token else b'',
+        }
+        self.task = asyncio.ensure_future(application(scope, self.inbound.get, self.outbound.put))
+
+    async def connect(self):
+        """Open the connection; returns the accept or close message"""
+        await self.inbound.put({'type': 'websocket.connect'})
+        return await self.outbound.get()
+
+    async def receive(self, timeout=1.0):
+        return await asyncio.wait_for(self.outbound.get(), timeout)
+
+    async def send_text(self, text):
+        await self.inbound.put({'type': 'websocket.receive', 'text': text})
+
+    async def close(self):
+        await self.inbound.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task
@@ -0,0 +1,109 @@
+"""Chat inbox bookkeeping.
+
+Every chat carries its latest message (``last_message_*``) and every
+ChatParticipant row carries the member's unread count and the chat's last
+activity time, so an inbox is one indexed query over the user's
+ChatParticipant rows plus one prefetch of the members, however many chats
+it lists. Sending a message updates all of it in a fixed number of
+statements; the unread totals behind /api/badges/ move with it (core.badges).
+
+Each chat also hands out increasing change versions (``Chat.version``): every
+message takes the next one, and so does every read, which is recorded as the
+member's ``read_version``. History scrolls back by message version
+(``before``), and a client that has seen everything up to version N syncs by
+asking for what changed ``since`` N: newer messages plus any member whose
+read position moved.
+"""
+from django.db import transaction
+from django.db.models import Case, F, FilteredRelation, Prefetch, Q, When
+from django.db.models.functions import Greatest
+
+from . import badges
+from .models import Chat, ChatMessage, ChatParticipant
+
+
+def next_version(chat_id):
+    """Hand out the chat's next change version; the chat row stays locked until commit,
+    so versions become visible in order"""
+    Chat.objects.filter(pk=chat_id).update(version=F('version') + 1)
+    return Chat.objects.filter(pk=chat_id).values_list('version', flat=True).get()
+
+
+def post_message(chat, sender, text):
+    """Create a message with the chat's next version and record it on the chat and its members"""
+    with transaction.atomic():
+        message = ChatMessage.objects.create(chat=chat, sender=sender, message=text, version=next_version(chat.pk))
+        record_message(chat, message)
+    return message
+
+
+def record_message(chat, message):
+    """Denormalize a new message onto its chat and members; call in the message's transaction"""
+    with transaction.atomic():
+        Chat.objects.filter(pk=chat.pk).update(
+            last_message=message, last_message_text=message.message, last_message_sender=message.sender_id,
+            last_message_at=message.created_at, updated_at=message.created_at,
+        )
+        ChatParticipant.objects.filter(chat=chat).update(
+            last_activity_at=message.created_at,
+            unread_count=Case(
+                When(user=message.sender_id, then=F('unread_count')), default=F('unread_count') + 1
+            ),
+        )
+        recipients = ChatParticipant.objects.filter(chat=chat).exclude(user=message.sender_id)
+        badges.bump(recipients.values_list('user_id', flat=True), 'unread_messages', 1)
+
+
+def mark_read(user_id, chat_id):
+    """Mark a chat read for a member: message flags, their unread count and badge, and their read position.
+    Returns the new read version, or None when there was nothing to read."""
+    with transaction.atomic():
+        member = ChatParticipant.objects.select_for_update().filter(user_id=user_id, chat_id=chat_id).first()
+        if member is None:
+            return None
+        marked = ChatMessage.objects.filter(chat_id=chat_id, is_read=False).exclude(sender_id=user_id).update(is_read=True)
+        if not (marked or member.unread_count):
+            return None
+        # Subtract what was read rather than zeroing, so concurrent sends stay counted
+        badges.bump([user_id], 'unread_messages', -member.unread_count)
+        read_version = next_version(chat_id)
+        ChatParticipant.objects.filter(pk=member.pk).update(
+            unread_count=Greatest(F('unread_count') - member.unread_count, 0), read_version=read_version,
+        )
+    return read_version
+
+
+def history(chat, before, limit):
+    """Up to ``limit`` messages older than version ``before`` (None for the newest), newest first"""
+    messages = chat.messages.select_related('sender').order_by('-version')
+    if before is not None:
+        messages = messages.filter(version__lt=before)
+    return list(messages[:limit])
+
+
+def changes(chat, since, limit):
+    """What changed after version ``since``: up to ``limit`` newer messages (oldest first),
+    members whose read position moved, and the version to sync from next time"""
+    current = Chat.objects.filter(pk=chat.pk).values_list('version', flat=True).get()
+    messages = list(chat.messages.select_related('sender').filter(version__gt=since).order_by('version')[:limit + 1])
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    reads = chat.members.filter(read_version__gt=since).values_list('user_id', 'read_version')
+    return {
+        'messages': messages,
+        'reads': list(reads),
+        'since': messages[-1].version if has_more else max([current] + [m.version for m in messages[-1:]]),
+        'hasMore': has_more,
+    }
+
+
+def inbox(user):
+    """The user's chats, most recent activity first, ready for ChatSerializer"""
+    return Chat.objects.annotate(
+        membership=FilteredRelation('members', condition=Q(members__user=user)),
+    ).filter(membership__isnull=False).annotate(
+        my_unread_count=F('membership__unread_count'),
+        my_last_activity_at=F('membership__last_activity_at'),
+    ).select_related('last_message_sender').prefetch_related(
+        Prefetch('members', queryset=ChatParticipant.objects.select_related('user__profile'), to_attr='member_list'),
+    ).order_by('-my_last_activity_at', '-pk')
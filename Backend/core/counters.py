@@ -0,0 +1,281 @@
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CounterFlushBatch, Video
+
+logger = logging.getLogger(__name__)
+
+def add_to_counter(model, pk, field, delta=1):
+    """Atomically add ``delta`` to an integer column and return its fresh value.
+
+    The change is a single ``UPDATE ... SET field = field + delta`` touching
+    only that column, so concurrent callers never lose updates. Decrements
+    never take the counter below zero.
+    """
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+    return model.objects.filter(pk=pk).values_list(field, flat=True).first() or 0
+
+
+class CounterBuffer:
+    """Write-behind buffer for hot integer counters on one model.
+
+    Deltas are accumulated in a Django cache (locmem, or Redis or Memcached
+    shared between workers: backends whose ``add`` and ``incr`` are atomic)
+    with ``incr`` and written to the database in batches once the flush
+    interval has passed or enough increments have piled up, so a hot row
+    takes one UPDATE per flush instead of one per tap. Every buffered key is recorded once in a sequence-numbered registry
+    in the same cache, so any worker (or the flush_video_counters command)
+    can find and flush it.
+
+    Flushing is exactly-once: the batch is journaled in the cache, applied in
+    one transaction together with a ``CounterFlushBatch`` marker row, and the
+    flushed amounts are then subtracted from the buffered deltas (increments
+    that arrived meanwhile stay buffered). If a flush dies half way, the next
+    flush checks the marker row to decide whether the journaled batch still
+    needs applying or only needs settling.
+
+    Increments only trigger a flush as they arrive, so the first one in a
+    process also starts a flusher thread that flushes every flush interval:
+    the last increments on a quiet row are written all the same. With the
+    default locmem cache the buffer is private to the process and only its
+    own thread (or its own increments) can flush it; flush_video_counters
+    reaches the buffer only when the cache is shared.
+
+    Subclasses set ``model``, ``FIELDS`` and ``settings_prefix`` (for the
+    ``<prefix>_CACHE``, ``_FLUSH_INTERVAL`` and ``_FLUSH_THRESHOLD``
+    settings), and may override ``_write``.
+    """
+
+    model = None
+    FIELDS = ()
+    settings_prefix = None
+    LOCK_TIMEOUT = 30
+
+    def __init__(self, cache_alias=None, flush_interval=None, flush_threshold=None, key_prefix='counter'):
+        self._cache_alias = cache_alias
+        self._flush_interval = flush_interval
+        self._flush_threshold = flush_threshold
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._pending_ops = 0
+        self._last_flush = time.monotonic()
+        self._thread = None
+
+    @property
+    def cache(self):
+        return caches[self._cache_alias or getattr(settings, f'{self.settings_prefix}_CACHE', 'default')]
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, f'{self.settings_prefix}_FLUSH_INTERVAL', 2.0)
+
+    @property
+    def flush_threshold(self):
+        if self._flush_threshold is not None:
+            return self._flush_threshold
+        return getattr(settings, f'{self.settings_prefix}_FLUSH_THRESHOLD', 500)
+
+    def _key(self, pk, field):
+        return f'{self.key_prefix}:{pk}:{field}'
+
+    def _split_key(self, key):
+        _, pk, field = key.rsplit(':', 2)
+        return pk, field
+
+    def _check_field(self, field):
+        if field not in self.FIELDS:
+            raise ValueError(f'Unknown {self.model._meta.verbose_name} counter: {field}')
+
+    def _incr(self, key, delta, cache=None):
+        """incr() that creates the key if it is missing"""
+        cache = cache or self.cache
+        if cache.add(key, delta, timeout=None):
+            return delta
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            return cache.incr(key, delta)
+
+    def _register(self, key, cache=None):
+        """Record a buffered key in the registry, once until it is next flushed"""
+        cache = cache or self.cache
+        if cache.add(f'{self.key_prefix}:dirty:{key}', 1, timeout=None):
+            seq = self._incr(f'{self.key_prefix}:seq', 1, cache)
+            cache.set(f'{self.key_prefix}:registry:{seq}', key, timeout=None)
+
+    def add(self, pk, field, delta=1):
+        """Buffer a counter delta, flushing if the interval or threshold is reached"""
+        self.add_many(pk, {field: delta})
+
+    def add_many(self, pk, deltas):
+        """Buffer deltas for several counters of one row, keyed by field"""
+        for field in deltas:
+            self._check_field(field)
+        self._start_flusher()
+        cache = self.cache  # Looked up once: caches[] goes through a thread-local
+        for field, delta in deltas.items():
+            key = self._key(pk, field)
+            # Increment before registering: a flush that clears the dirty marker
+            # in between will still read this delta or see the re-registration.
+            self._incr(key, delta, cache)
+            self._register(key, cache)
+        with self._lock:
+            self._pending_ops += len(deltas)
+            due = (
+                self._pending_ops >= self.flush_threshold
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def _start_flusher(self):
+        if self._thread is not None or not getattr(settings, 'COUNTER_FLUSH_THREAD', True):
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'{self.key_prefix}-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing the %s buffer failed', self.key_prefix)
+            finally:
+                connection.close()
+
+    def pending(self, pk):
+        """Buffered, not yet flushed deltas for one row, keyed by field"""
+        keys = {self._key(pk, field): field for field in self.FIELDS}
+        values = self.cache.get_many(keys)
+        return {keys[key]: value for key, value in values.items() if value}
+
+    def merge(self, instance):
+        """Add buffered deltas onto an instance's counters in place"""
+        for field, delta in self.pending(instance.pk).items():
+            setattr(instance, field, max(0, getattr(instance, field) + delta))
+        return instance
+
+    def _take_registered_keys(self):
+        """Pop registered keys up to the first gap in the sequence"""
+        cache = self.cache
+        start = (cache.get(f'{self.key_prefix}:flushed-seq') or 0) + 1
+        end = cache.get(f'{self.key_prefix}:seq') or 0
+        if end < start:
+            return []
+        registry_keys = [f'{self.key_prefix}:registry:{seq}' for seq in range(start, end + 1)]
+        entries = cache.get_many(registry_keys)
+        keys = []
+        last_seq = start - 1
+        for seq, registry_key in zip(range(start, end + 1), registry_keys):
+            if registry_key not in entries:
+                break  # Registration still in flight; pick it up next flush
+            keys.append(entries[registry_key])
+            last_seq = seq
+        # Clear dirty markers before reading values so later increments re-register
+        cache.delete_many([f'{self.key_prefix}:dirty:{key}' for key in keys])
+        cache.delete_many(registry_keys[:len(keys)])
+        cache.set(f'{self.key_prefix}:flushed-seq', last_seq, timeout=None)
+        return keys
+
+    def flush(self):
+        """Write buffered deltas to the database. Returns the number of counters flushed."""
+        cache = self.cache
+        if not cache.add(f'{self.key_prefix}:flush-lock', uuid.uuid4().hex, timeout=self.LOCK_TIMEOUT):
+            return 0  # Another worker is flushing
+        try:
+            with self._lock:
+                self._pending_ops = 0
+                self._last_flush = time.monotonic()
+            self._recover()
+            keys = self._take_registered_keys()
+            deltas = {key: value for key, value in cache.get_many(keys).items() if value}
+            if not deltas:
+                return 0
+
+            batch_id = uuid.uuid4().hex
+            cache.set(f'{self.key_prefix}:journal', {'batch_id': batch_id, 'deltas': deltas}, timeout=None)
+            try:
+                self._apply(batch_id, deltas)
+            except Exception:
+                self._discard_journal(deltas)
+                raise
+            self._settle(deltas)
+            return len(deltas)
+        finally:
+            cache.delete(f'{self.key_prefix}:flush-lock')
+
+    def _apply(self, batch_id, deltas):
+        updates = {}
+        for key, delta in deltas.items():
+            pk, field = self._split_key(key)
+            updates.setdefault(pk, {})[field] = delta
+        with transaction.atomic():
+            CounterFlushBatch.objects.create(batch_id=batch_id)
+            self._write(updates)
+
+    def _write(self, updates):
+        """Apply {pk: {field: delta}} inside the flush transaction"""
+        for pk, fields in updates.items():
+            self.model.objects.filter(pk=pk).update(**{field: F(field) + delta for field, delta in fields.items()})
+
+    def _settle(self, deltas):
+        for key, delta in deltas.items():
+            try:
+                self.cache.decr(key, delta)
+            except ValueError:
+                pass
+        self.cache.delete(f'{self.key_prefix}:journal')
+
+    def _discard_journal(self, deltas):
+        """Drop a batch that never reached the database and re-register its keys"""
+        self.cache.delete(f'{self.key_prefix}:journal')
+        for key in deltas:
+            self._register(key)
+
+    def _recover(self):
+        """Finish or discard a batch left behind by an interrupted flush"""
+        journal = self.cache.get(f'{self.key_prefix}:journal')
+        if journal is None:
+            return
+        if CounterFlushBatch.objects.filter(batch_id=journal['batch_id']).exists():
+            self._settle(journal['deltas'])
+        else:
+            self._discard_journal(journal['deltas'])
+
+
+class VideoCounterBuffer(CounterBuffer):
+    """Engagement counters of viral videos"""
+
+    model = Video
+    FIELDS = ('likes', 'buzz_count', 'shares', 'comments_count')
+    settings_prefix = 'VIDEO_COUNTER'
+
+    def __init__(self, key_prefix='video-counter', **kwargs):
+        super().__init__(key_prefix=key_prefix, **kwargs)
+
+    def _write(self, updates):
+        now = timezone.now()  # Bumping updated_at queues the video for refresh_trending_scores
+        for video_id, fields in updates.items():
+            Video.objects.filter(pk=video_id).update(
+                updated_at=now, **{field: F(field) + delta for field, delta in fields.items()}
+            )
+
+
+video_counters = VideoCounterBuffer()
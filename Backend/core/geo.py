@@ -0,0 +1,167 @@
+"""Geohash helpers for the Universe Map.
+
+Videos store a geohash of their coordinates. A nearby search covers the
+search circle's bounding box with a handful of geohash cells, fetches only
+the rows inside those cells (index range scans on the geohash column), then
+computes exact great-circle distances over that candidate set in one batch.
+Each cell is its own equality-plus-range scan on the (privacy, geohash)
+index, combined with UNION ALL, since query planners do not reliably turn an
+OR of ranges into index scans.
+"""
+import heapq
+import math
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Substr
+
+try:
+    import numpy as np
+except ImportError:  # Optional: distances fall back to pure Python
+    np = None
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+GEOHASH_PRECISION = 9  # ~5m cells
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_COVER_CELLS = 16
+# Sorts after every geohash character, so [prefix, prefix + HIGH) is every hash in the cell
+HIGH = '{'
+
+
+def encode_geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # Geohash interleaves bits starting with longitude
+    while len(chars) < precision:
+        interval, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) of a geohash cell in degrees"""
+    lat_bits = 5 * precision // 2
+    lng_bits = 5 * precision - lat_bits
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def bounding_box(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) around a circle; longitude may cross +/-180"""
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(lat))
+    dlng = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEGREE * cos_lat))
+    return max(-90.0, lat - dlat), min(90.0, lat + dlat), lng - dlng, lng + dlng
+
+
+def cover_cells(box, max_cells=MAX_COVER_CELLS):
+    """Geohash prefixes covering a bounding box, using the finest precision that needs at most max_cells"""
+    min_lat, max_lat, min_lng, max_lng = box
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = range(int((min_lat + 90) // height), int((min(max_lat, 89.999999) + 90) // height) + 1)
+        columns = range(int((min_lng + 180) // width), int((max_lng + 180) // width) + 1)
+        if len(rows) * len(columns) <= max_cells or precision == 1:
+            lng_cells = int(round(360 / width))
+            return sorted({
+                encode_geohash(-90 + (row + 0.5) * height, -180 + ((column % lng_cells) + 0.5) * width, precision)
+                for row in rows for column in columns
+            })
+
+
+def box_condition(box):
+    min_lat, max_lat, min_lng, max_lng = box
+    condition = Q(latitude__gte=min_lat, latitude__lte=max_lat)
+    if max_lng - min_lng >= 360:
+        return condition
+    if min_lng < -180:
+        return condition & (Q(longitude__gte=min_lng + 360) | Q(longitude__lte=max_lng))
+    if max_lng > 180:
+        return condition & (Q(longitude__gte=min_lng) | Q(longitude__lte=max_lng - 360))
+    return condition & Q(longitude__gte=min_lng, longitude__lte=max_lng)
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Great-circle distances in km from one point to many, in one batch"""
+    if np is not None:
+        lats = np.radians(np.asarray(lats, dtype=float))
+        lngs = np.radians(np.asarray(lngs, dtype=float))
+        lat0, lng0 = math.radians(lat), math.radians(lng)
+        a = np.sin((lats - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(lats) * np.sin((lngs - lng0) / 2) ** 2
+        return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+
+    lat0, lng0 = math.radians(lat), math.radians(lng)
+    cos_lat0 = math.cos(lat0)
+    distances = []
+    for other_lat, other_lng in zip(lats, lngs):
+        other_lat, other_lng = math.radians(other_lat), math.radians(other_lng)
+        a = math.sin((other_lat - lat0) / 2) ** 2 + cos_lat0 * math.cos(other_lat) * math.sin((other_lng - lng0) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+
+def _per_cell(queryset, lat, lng, radius_km):
+    """One queryset per covering cell: an equality-plus-range index scan each, combined with UNION ALL"""
+    box = bounding_box(lat, lng, radius_km)
+    return [
+        queryset.filter(geohash__gte=cell, geohash__lt=cell + HIGH).filter(box_condition(box)).order_by()
+        for cell in cover_cells(box)
+    ]
+
+
+def nearest(queryset, lat, lng, radius_km, limit, position=None):
+    """Up to ``limit`` (distance_km, pk) pairs within radius, nearest first, after keyset ``position``"""
+    parts = [part.values_list('pk', 'latitude', 'longitude') for part in _per_cell(queryset, lat, lng, radius_km)]
+    rows = list(parts[0].union(*parts[1:], all=True))
+    if not rows:
+        return []
+    pks, lats, lngs = zip(*rows)
+    within = (
+        (distance, pk) for distance, pk in zip(haversine_km(lat, lng, lats, lngs), pks)
+        if distance <= radius_km
+    )
+    if position is not None:
+        after = (float(position[0]), str(position[1]))
+        within = ((distance, pk) for distance, pk in within if (distance, str(pk)) > after)
+    return heapq.nsmallest(limit, within, key=lambda item: (item[0], str(item[1])))
+
+
+def zoom_precision(zoom):
+    """Geohash precision whose cells are a fraction of a map tile at a web-map zoom level (0-20)"""
+    return max(1, min(GEOHASH_PRECISION - 1, (int(zoom) * 2 + 9) // 5))
+
+
+def clusters(queryset, lat, lng, radius_km, zoom):
+    """Group videos in the search circle's bounding box by geohash cell sized for the zoom level"""
+    precision = zoom_precision(zoom)
+    parts = [
+        part.annotate(cell=Substr('geohash', 1, precision)).values('cell')
+        .annotate(count=Count('pk'), lat_sum=Sum('latitude'), lng_sum=Sum('longitude'))
+        for part in _per_cell(queryset, lat, lng, radius_km)
+    ]
+    # A cluster cell coarser than the covering cells arrives in several parts
+    merged = {}
+    for row in parts[0].union(*parts[1:], all=True):
+        cell = merged.setdefault(row['cell'], {'cell': row['cell'], 'count': 0, 'lat_sum': 0.0, 'lng_sum': 0.0})
+        cell['count'] += row['count']
+        cell['lat_sum'] += row['lat_sum']
+        cell['lng_sum'] += row['lng_sum']
+    return [
+        {'cell': cell['cell'], 'count': cell['count'],
+         'center_lat': cell['lat_sum'] / cell['count'], 'center_lng': cell['lng_sum'] / cell['count']}
+        for cell in sorted(merged.values(), key=lambda cell: (-cell['count'], cell['cell']))
+    ]
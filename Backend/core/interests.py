@@ -0,0 +1,118 @@
+"""Per-user interest profiles for recommendations.
+
+Each engagement (like, comment, buzz, share) adds weight to the video's
+hashtags and creator in the user's InterestProfile. Weights decay
+exponentially with INTEREST_HALF_LIFE_DAYS: a profile stores its weights as
+of ``as_of``, and every update first decays them to the current time. Only
+the strongest MAX_HASHTAGS / MAX_CREATORS entries are kept, so a profile's
+size, and the cost of ranking with it, does not grow with the user's history.
+"""
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import InterestProfile
+
+try:
+    import numpy as np
+except ImportError:  # Optional: scoring falls back to pure Python
+    np = None
+
+ENGAGEMENT_WEIGHTS = {'like': 1.0, 'comment': 2.0, 'buzz': 2.0, 'share': 3.0}
+MAX_HASHTAGS = 64
+MAX_CREATORS = 64
+MIN_WEIGHT = 0.01
+# Recommendation candidate generation: walk the trending index for videos
+# matching the strongest TOP_INTERESTS hashtags/creators, rank CANDIDATES of them
+TOP_INTERESTS = 16
+CANDIDATES = 200
+
+
+def half_life_seconds():
+    return getattr(settings, 'INTEREST_HALF_LIFE_DAYS', 14.0) * 86400
+
+
+def decayed(weights, as_of, now):
+    """Weights decayed from as_of to now"""
+    elapsed = (now - as_of).total_seconds()
+    if elapsed <= 0:
+        return dict(weights)
+    factor = 0.5 ** (elapsed / half_life_seconds())
+    return {key: weight * factor for key, weight in weights.items()}
+
+
+def _add(weights, keys, amount, limit):
+    for key in keys:
+        weights[str(key)] = weights.get(str(key), 0.0) + amount
+    strongest = sorted(weights.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return {key: weight for key, weight in strongest if weight >= MIN_WEIGHT}
+
+
+def apply_engagement(profile, kind, hashtag_ids, creator_id, at):
+    """Fold one engagement into an (unsaved) profile"""
+    amount = ENGAGEMENT_WEIGHTS[kind]
+    hashtags = decayed(profile.hashtags, profile.as_of, at)
+    creators = decayed(profile.creators, profile.as_of, at)
+    profile.hashtags = _add(hashtags, hashtag_ids, amount, MAX_HASHTAGS)
+    profile.creators = _add(creators, [creator_id] if creator_id else [], amount, MAX_CREATORS)
+    profile.as_of = max(at, profile.as_of)
+    return profile
+
+
+def record_engagement(user, video, kind):
+    """Update the user's profile for an engagement with a video"""
+    now = timezone.now()
+    hashtag_ids = list(video.hashtags.values_list('id', flat=True))
+    creator_id = video.user_id if video.user_id != user.pk else None
+    with transaction.atomic():
+        profile, _ = InterestProfile.objects.select_for_update().get_or_create(user=user, defaults={'as_of': now})
+        apply_engagement(profile, kind, hashtag_ids, creator_id, now)
+        profile.save()
+    return profile
+
+
+def top_interests(profile, count):
+    """(hashtag ids, creator ids) with the highest weights"""
+    def strongest(weights):
+        return [int(key) for key, _ in sorted(weights.items(), key=lambda item: item[1], reverse=True)[:count]]
+    return strongest(profile.hashtags), strongest(profile.creators)
+
+
+def affinities(profile, candidates, now=None):
+    """Affinity of each candidate to the profile, in one batch.
+
+    ``candidates`` is a list of (hashtag ids, creator id) pairs. A candidate's
+    affinity is the sum of the profile weights of its hashtags and creator.
+    """
+    now = now or timezone.now()
+    keys = {}
+    weights = []
+    for prefix, profile_weights in (('h', profile.hashtags), ('c', profile.creators)):
+        for key, weight in decayed(profile_weights, profile.as_of, now).items():
+            keys[prefix + key] = len(weights)
+            weights.append(weight)
+
+    rows = [
+        [keys[column] for column in [f'h{tag}' for tag in hashtag_ids] + [f'c{creator_id}'] if column in keys]
+        for hashtag_ids, creator_id in candidates
+    ]
+    if np is not None and weights:
+        matrix = np.zeros((len(rows), len(weights)))
+        for row, columns in enumerate(rows):
+            matrix[row, columns] = 1.0
+        return (matrix @ np.asarray(weights)).tolist()
+    return [sum(weights[column] for column in set(columns)) for columns in rows]
+
+
+def rank(profile, videos, now=None):
+    """Order candidate videos by trending score plus log affinity (both log-scale, so they multiply).
+
+    Videos must have their hashtags prefetched.
+    """
+    scores = affinities(
+        profile, [([tag.pk for tag in video.hashtags.all()], video.user_id) for video in videos], now
+    )
+    ranked = sorted(zip(videos, scores), key=lambda item: item[0].trending_score + math.log1p(item[1]), reverse=True)
+    return [video for video, _ in ranked]
@@ -0,0 +1,276 @@
+"""Materialized VyRa Points leaderboards.
+
+Earned points (core.points) are added, in the same transaction as their
+ledger rows, to per-day aggregate rows (LeaderboardDay) and all-time rows
+(LeaderboardTotal) for each scope they count in: everyone (scope ``''``) and
+the hashtags of the video they were earned on (``hashtag:<id>``). A daily
+board reads one day's rows, a weekly board sums the last seven days, and
+none of them touch the ledger. Club boards are the global rows of the
+club's members. rebuild_leaderboards recomputes every row.
+
+The global daily, weekly and all-time boards are also held in memory, per
+process: a sorted list of every score, so a user's rank is a binary search,
+and a top-K heap for the leaders. Each process catches up on rows changed
+since its last look (``updated_at``) at most every LEADERBOARD_SYNC_SECONDS,
+and rebuilds the daily and weekly boards when the day changes. Scores only
+grow between rebuilds, which is what lets the heap stay exactly the top K.
+
+The queries of a load or catch-up run outside the lock that guards the
+boards: the request that finds them due does the work while the others keep
+reading the boards they have (just after midnight, yesterday's, for the
+length of the load), and the new boards or changed scores are swapped in at
+the end under the lock. Only a process's first request waits for a load.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import ClubMember, Hashtag, LeaderboardDay, LeaderboardTotal
+
+PERIODS = ('daily', 'weekly', 'all')
+EVERYONE = ''
+WEEK_DAYS = 7
+SYNC_OVERLAP = timedelta(seconds=5)  # Re-read recent rows: a slow transaction may commit an older updated_at
+
+
+def hashtag_scope(hashtag_id):
+    return f'hashtag:{hashtag_id}'
+
+
+def video_hashtag_scopes(video_ids):
+    """{video id (str): [hashtag scope, ...]} for the videos' hashtags"""
+    scopes = defaultdict(list)
+    links = Hashtag.videos.through.objects.filter(video_id__in=list(video_ids)).values_list('video_id', 'hashtag_id')
+    for video_id, hashtag_id in links:
+        scopes[str(video_id)].append(hashtag_scope(hashtag_id))
+    return scopes
+
+
+def record(points, day=None):
+    """Add {(scope, user id): points} to the day's and the all-time rows"""
+    day = day or timezone.localdate()
+    now = timezone.now()
+    users = defaultdict(list)  # (scope, points) -> user ids: one UPDATE per distinct amount
+    for (scope, user_id), amount in points.items():
+        if amount:
+            users[(scope, amount)].append(user_id)
+    for (scope, amount), user_ids in users.items():
+        _bump(LeaderboardDay, {'scope': scope, 'day': day}, user_ids, amount, now)
+        _bump(LeaderboardTotal, {'scope': scope}, user_ids, amount, now)
+
+
+def _bump(model, keys, user_ids, amount, now):
+    change = {'points': F('points') + amount, 'updated_at': now}
+    if model.objects.filter(user_id__in=user_ids, **keys).update(**change) < len(user_ids):
+        existing = set(model.objects.filter(user_id__in=user_ids, **keys).values_list('user_id', flat=True))
+        missing = [user_id for user_id in user_ids if user_id not in existing]
+        # Create at zero and add, so a row created concurrently is added to rather than overwritten
+        model.objects.bulk_create([model(user_id=user_id, **keys) for user_id in missing], ignore_conflicts=True)
+        model.objects.filter(user_id__in=missing, **keys).update(**change)
+
+
+def week_start(day):
+    return day - timedelta(days=WEEK_DAYS - 1)
+
+
+class Board:
+    """One leaderboard's scores: all of them sorted, for ranks, and a heap of the top K"""
+
+    def __init__(self, top_k, scores=()):
+        self.top_k = top_k
+        self.scores = dict(scores)
+        self.ordered = sorted(self.scores.values())
+        self._rebuild_top()
+
+    def _rebuild_top(self):
+        leaders = heapq.nlargest(self.top_k, self.scores.items(), key=lambda item: item[1])
+        self.top = dict(leaders)
+        self.heap = [(score, user_id) for user_id, score in leaders]
+        heapq.heapify(self.heap)
+
+    def _lowest_top(self):
+        """Smallest score in the top K, dropping heap entries made stale by later updates"""
+        while self.top.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0]
+
+    def set(self, user_id, score):
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self.ordered[bisect_left(self.ordered, old)]
+        insort(self.ordered, score)
+        self.scores[user_id] = score
+        if old is not None and score < old and user_id in self.top:
+            self._rebuild_top()  # Scores only grow between rebuilds, so this is rare
+        elif user_id in self.top or len(self.top) < self.top_k:
+            self.top[user_id] = score
+            heapq.heappush(self.heap, (score, user_id))
+        elif score > self._lowest_top():
+            del self.top[heapq.heappop(self.heap)[1]]
+            self.top[user_id] = score
+            heapq.heappush(self.heap, (score, user_id))
+        if len(self.heap) > 4 * self.top_k:
+            self.heap = [(score, user_id) for user_id, score in self.top.items()]
+            heapq.heapify(self.heap)
+
+    def rank(self, user_id):
+        """1 + the number of higher scores (ties share a rank), or None without points"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return len(self.ordered) - bisect_right(self.ordered, score) + 1
+
+    def leaders(self, count):
+        """[(user id, points)] best first, up to the board's top K"""
+        return sorted(self.top.items(), key=lambda item: (-item[1], item[0]))[:count]
+
+
+class Leaderboards:
+    """The global boards of this process, kept in step with the aggregate rows"""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # Held only to read the boards or apply changes, never across queries
+        self._refreshing = threading.Lock()  # One load or sync at a time
+        self.boards = {}
+        self.day = None
+        self.synced_at = None
+        self.checked = 0.0
+
+    @property
+    def top_k(self):
+        return getattr(settings, 'LEADERBOARD_TOP_K', 100)
+
+    def _due(self, today):
+        return self.day != today or (
+            time.monotonic() - self.checked >= getattr(settings, 'LEADERBOARD_SYNC_SECONDS', 5.0)
+        )
+
+    def refresh(self):
+        """Load the boards on a new day, or catch them up once LEADERBOARD_SYNC_SECONDS have passed.
+
+        Requests keep reading the current boards while one of them refreshes;
+        only a process with no boards yet waits for the first load.
+        """
+        today = timezone.localdate()
+        if not self._due(today):
+            return
+        if not self._refreshing.acquire(blocking=not self.boards):
+            return
+        try:
+            if self.day != today:
+                self._load(today)
+            elif self._due(today):
+                self._sync()
+        finally:
+            self._refreshing.release()
+
+    def leaders(self, period, count):
+        self.refresh()
+        with self._lock:
+            return self.boards[period].leaders(count)
+
+    def rank(self, period, user_id):
+        """(rank, points) of a user on a global board"""
+        self.refresh()
+        with self._lock:
+            board = self.boards[period]
+            return board.rank(user_id), board.scores.get(user_id, 0)
+
+    def _load(self, today):
+        """Build the day's boards from the rows, then swap them in"""
+        loaded_at, checked = timezone.now(), time.monotonic()
+        days = LeaderboardDay.objects.filter(scope=EVERYONE)
+        boards = {
+            'daily': Board(self.top_k, days.filter(day=today).values_list('user_id', 'points')),
+            'weekly': Board(self.top_k, days.filter(day__gte=week_start(today)).values_list(
+                'user_id').annotate(total=Sum('points')).values_list('user_id', 'total')),
+        }
+        totals = LeaderboardTotal.objects.filter(scope=EVERYONE)
+        if 'all' in self.boards:
+            # The all-time board carries over: only catch it up
+            since = self.synced_at - SYNC_OVERLAP
+            changed = list(totals.filter(updated_at__gte=since).values_list('user_id', 'points'))
+        else:
+            boards['all'] = Board(self.top_k, totals.values_list('user_id', 'points'))
+        with self._lock:
+            if 'all' not in boards:
+                if 'all' not in self.boards:
+                    return  # Reset meanwhile: the next request loads from scratch
+                for user_id, points in changed:
+                    self.boards['all'].set(user_id, points)
+            self.boards = {**self.boards, **boards}
+            self.day, self.synced_at, self.checked = today, loaded_at, checked
+
+    def _sync(self):
+        """Read the rows changed since the last look, then apply them to the boards"""
+        day, since = self.day, self.synced_at - SYNC_OVERLAP
+        synced_at, checked = timezone.now(), time.monotonic()
+        totals = list(LeaderboardTotal.objects.filter(
+            scope=EVERYONE, updated_at__gte=since
+        ).values_list('user_id', 'points'))
+        changed = LeaderboardDay.objects.filter(scope=EVERYONE, day=day, updated_at__gte=since)
+        daily = list(changed.values_list('user_id', 'points'))
+        weekly = list(LeaderboardDay.objects.filter(
+            scope=EVERYONE, day__gte=week_start(day), user_id__in=changed.values('user_id')
+        ).values_list('user_id').annotate(total=Sum('points')).values_list('user_id', 'total'))
+        with self._lock:
+            if self.day != day:
+                return  # Reset meanwhile
+            for period, scores in (('all', totals), ('daily', daily), ('weekly', weekly)):
+                for user_id, points in scores:
+                    self.boards[period].set(user_id, points)
+            self.synced_at, self.checked = synced_at, checked
+
+    def reset(self):
+        with self._lock:
+            self.boards = {}
+            self.day = None
+
+
+leaderboards = Leaderboards()
+
+
+def _scoped_totals(period, scope=EVERYONE, club_id=None):
+    """Users' points on a board, as a queryset of {'user_id', 'total'} rows"""
+    today = timezone.localdate()
+    if period == 'weekly':
+        rows = LeaderboardDay.objects.filter(scope=scope, day__gte=week_start(today))
+    elif period == 'daily':
+        rows = LeaderboardDay.objects.filter(scope=scope, day=today)
+    else:
+        rows = LeaderboardTotal.objects.filter(scope=scope)
+    if club_id is not None:
+        # Look up each member's rows rather than checking every row's user for membership
+        rows = rows.filter(user_id__in=ClubMember.objects.filter(club_id=club_id).values('user_id'))
+    if period == 'weekly':
+        return rows.values('user_id').annotate(total=Sum('points'))
+    # One row per user already: no grouping, so the rank index also gives the order
+    return rows.values('user_id', total=F('points'))
+
+
+def top(period, count, scope=EVERYONE, club_id=None):
+    """[(user id, points)] best first"""
+    if scope == EVERYONE and club_id is None and count <= leaderboards.top_k:
+        return leaderboards.leaders(period, count)
+    rows = _scoped_totals(period, scope, club_id).order_by('-total', 'user_id')[:count]
+    return [(row['user_id'], row['total']) for row in rows]
+
+
+def rank(period, user_id, scope=EVERYONE, club_id=None):
+    """(rank, points) of a user on a board; (None, 0) without points there"""
+    if scope == EVERYONE and club_id is None:
+        return leaderboards.rank(period, user_id)
+    totals = _scoped_totals(period, scope, club_id)
+    mine = totals.filter(user_id=user_id).first()
+    if mine is None:
+        return None, 0
+    return totals.filter(total__gt=mine['total']).count() + 1, mine['total']
@@ -0,0 +1,41 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from core.models import Follow, TimelineEntry, Video
+from core.timeline import FEED_ORDERING, backfill_limit, is_fanout_author
+
+
+class Command(BaseCommand):
+    help = "Materialize home timelines from existing follows and each author's recent videos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-author', type=int, default=None,
+                            help='Recent videos per author to copy (default TIMELINE_BACKFILL_PER_AUTHOR)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        per_author = options['per_author'] or backfill_limit()
+        batch_size = options['batch_size']
+        created = 0
+
+        authors = User.objects.filter(videos__isnull=False).distinct().values_list('pk', flat=True)
+        for author_id in authors.iterator():
+            videos = list(
+                Video.objects.filter(user_id=author_id).order_by(*FEED_ORDERING)
+                .values_list('pk', 'created_at')[:per_author]
+            )
+            recipients = [author_id]
+            if is_fanout_author(author_id):
+                recipients.extend(
+                    Follow.objects.filter(following_id=author_id).values_list('follower_id', flat=True)
+                )
+            for start in range(0, len(recipients), batch_size):
+                entries = [
+                    TimelineEntry(user_id=user_id, video_id=video_id, created_at=created_at)
+                    for user_id in recipients[start:start + batch_size]
+                    for video_id, created_at in videos
+                ]
+                TimelineEntry.objects.bulk_create(entries, batch_size=batch_size, ignore_conflicts=True)
+                created += len(entries)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {created} timeline entries (existing ones skipped)'))
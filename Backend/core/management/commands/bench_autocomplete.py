@@ -0,0 +1,69 @@
+import random
+import resource
+import string
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.autocomplete import PrefixIndex, profile_keys
+
+
+class Command(BaseCommand):
+    help = 'Time autocomplete prefix queries over a synthetic in-memory user index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000, help='Candidate users (the index keeps the top ones)')
+        parser.add_argument('--max-entries', type=int, default=settings.AUTOCOMPLETE_MAX_ENTRIES)
+        parser.add_argument('--queries', type=int, default=20000)
+        parser.add_argument('--updates', type=int, default=1, help='Profile updates between queries')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        alphabet = string.ascii_lowercase + string.digits
+
+        def word(low, high):
+            return ''.join(rng.choices(alphabet[:26], k=rng.randint(low, high)))
+
+        def entry(pk):
+            username = word(3, 10) + ''.join(rng.choices(alphabet, k=rng.randint(0, 4)))
+            display_name = f'{word(3, 8).title()} {word(3, 10).title()}'
+            followers = int(rng.paretovariate(1.2))  # Few users with many followers
+            payload = {'id': pk, 'username': username, 'displayName': display_name, 'followersCount': followers}
+            return pk, followers, profile_keys(username, display_name), payload
+
+        entries = [entry(pk) for pk in range(options['users'])]
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        index = PrefixIndex(options['max_entries'])
+        index.load(entries)
+        build_s = time.perf_counter() - start
+        del entries
+        # Peak RSS growth while building (ru_maxrss is in KiB on Linux); an upper bound on the index size
+        memory_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+        self.stdout.write(
+            f'Indexed {len(index.entries)} of {options["users"]} users ({len(index.keys)} keys) '
+            f'in {build_s:.1f}s, {memory_mb:.0f} MiB peak RSS growth'
+        )
+
+        self.stdout.write(f'{"prefix":>8} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+        next_pk = options['users']
+        for length in (1, 2, 3, 5):
+            samples = []
+            for _ in range(options['queries']):
+                for _ in range(options['updates']):
+                    # Churn: renames, new users and deletions between queries
+                    if rng.random() < 0.1:
+                        index.remove(rng.randrange(next_pk))
+                    else:
+                        next_pk += 1
+                        index.upsert(*entry(rng.choice([next_pk, rng.randrange(next_pk)])))
+                prefix = ''.join(rng.choices(alphabet[:26], k=length))
+                start = time.perf_counter()
+                index.query(prefix, 8)
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            self.stdout.write(
+                f'{length:>8} {samples[len(samples) // 2]:>8.3f} '
+                f'{samples[int(len(samples) * 0.99)]:>8.3f} {samples[-1]:>8.3f}'
+            )
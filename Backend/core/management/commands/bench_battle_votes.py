@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from core.battles import VOTE_COST, battle_votes, cast_vote
+from core.benchmarks import bulk_create_in_batches, rolled_back
+from core.models import LiveBattle, LiveRoom, Profile, VyRaPointsTransaction
+
+
+def legacy_vote(battle, user, participant):
+    """The vote view before core.battles: read-modify-write of the profile and battle rows"""
+    profile = Profile.objects.get(user=user)
+    if profile.vyra_points < VOTE_COST:
+        return False
+    profile.vyra_points -= VOTE_COST
+    profile.save()
+    VyRaPointsTransaction.objects.create(
+        user=user, points=-VOTE_COST, transaction_type='spent', description=f'Voted in live battle: {battle.id}'
+    )
+    if participant == '1':
+        battle.participant1_votes += 1
+    else:
+        battle.participant2_votes += 1
+    battle.save()
+    return True
+
+
+class Command(BaseCommand):
+    help = 'Time live battle votes on one battle and check that tallies, balances and ledger stay exact'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=1000)
+        parser.add_argument('--votes', type=int, default=20000)
+        parser.add_argument('--points', type=int, default=100, help='Starting balance; some votes get refused')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"path":<10} {"votes":>8} {"refused":>8} {"per second":>12} {"flush ms":>9}  exact')
+        for label, vote in (('legacy', legacy_vote), ('engine', None)):
+            # The flusher thread writes through its own connection, which cannot see the seeded rows
+            with override_settings(COUNTER_FLUSH_THREAD=False), rolled_back():
+                self._run(label, vote, options)
+
+    def _run(self, label, vote, options):
+        run = random.randrange(10 ** 9)
+        bulk_create_in_batches(
+            User, (User(username=f'bv{run}-{i}') for i in range(options['voters'])), batch_size=1000
+        )
+        voters = list(User.objects.filter(username__startswith=f'bv{run}-'))
+        # bulk_create skips the signal that creates profiles
+        Profile.objects.bulk_create(
+            [Profile(user=user, id_user=user.pk, vyra_points=options['points']) for user in voters], batch_size=1000
+        )
+        room = LiveRoom.objects.create(host=voters[0], title='Vote bench', status='live')
+        battle = LiveBattle.objects.create(live_room=room, participant1=voters[0], participant2=voters[1])
+        rng = random.Random(42)
+        ballots = [(rng.choice(voters), rng.choice('12')) for _ in range(options['votes'])]
+
+        battle_votes.flush()
+        accepted = {'1': 0, '2': 0}
+        start = time.perf_counter()
+        for user, participant in ballots:
+            if vote:
+                counted = vote(battle, user, participant)
+            else:
+                counted = cast_vote(battle, user.pk, participant)
+            accepted[participant] += counted
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        battle_votes.flush()
+        flush_ms = (time.perf_counter() - start) * 1000
+
+        battle.refresh_from_db()
+        total = accepted['1'] + accepted['2']
+        balance = Profile.objects.filter(user__in=voters).aggregate(total=Sum('vyra_points'))['total']
+        spent = VyRaPointsTransaction.objects.filter(user__in=voters).aggregate(total=Sum('points'))['total'] or 0
+        exact = (
+            (battle.participant1_votes, battle.participant2_votes) == (accepted['1'], accepted['2'])
+            and balance == options['points'] * len(voters) - total * VOTE_COST
+            and spent == -total * VOTE_COST
+        )
+        self.stdout.write(
+            f'{label:<10} {total:>8} {len(ballots) - total:>8} {len(ballots) / elapsed:>12,.0f} '
+            f'{flush_ms:>9.1f}  {"yes" if exact else "NO"}'
+        )
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.client import ClientHandler
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from core.benchmarks import make_bench_user, peak_rss_mb, reset_peak_rss, rolled_back
+from core.models import Video
+
+BOUNDARY = 'bench-boundary-7d1c'
+
+
+class Command(BaseCommand):
+    help = (
+        'Upload one large file through the multipart video endpoint and through the resumable chunked one, '
+        'streaming request bodies from disk, and report throughput and peak RSS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=500)
+        parser.add_argument('--chunk-mb', type=int, default=8)
+
+    def handle(self, *args, **options):
+        work = tempfile.mkdtemp(prefix='bench-upload-')
+        try:
+            source = os.path.join(work, 'clip.mp4')
+            self.checksum = self._write_source(source, options['size_mb'])
+            with override_settings(MEDIA_ROOT=os.path.join(work, 'media'),
+                                   VIDEO_UPLOAD_DIR=os.path.join(work, 'chunks')), rolled_back():
+                user = make_bench_user('bench-upload')
+                self.handler = ClientHandler(enforce_csrf_checks=False)
+                self.token = Token.objects.create(user=user).key
+                self.stdout.write(f'{"path":<10} {"MiB":>6} {"seconds":>8} {"MiB/s":>7} {"peak RSS +MiB":>14}  intact')
+                for label, upload in (('multipart', self._multipart), ('chunked', self._chunked)):
+                    reset_peak_rss()
+                    baseline = peak_rss_mb()
+                    start = time.perf_counter()
+                    video_path = upload(source, options, work)
+                    elapsed = time.perf_counter() - start
+                    growth = peak_rss_mb() - baseline
+                    intact = self._digest(video_path) == self.checksum
+                    self.stdout.write(
+                        f'{label:<10} {options["size_mb"]:>6} {elapsed:>8.1f} {options["size_mb"] / elapsed:>7.0f} '
+                        f'{growth:>14.1f}  {intact}'
+                    )
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    def _write_source(self, path, size_mb):
+        digest = hashlib.sha256()
+        with open(path, 'wb') as out:
+            for _ in range(size_mb):
+                block = os.urandom(1024 * 1024)
+                digest.update(block)
+                out.write(block)
+        return digest.hexdigest()
+
+    def _digest(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as stored:
+            while block := stored.read(1024 * 1024):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _request(self, method, path, body, length, content_type, **headers):
+        """Run a request through the full handler, its body streamed from a file object"""
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(length), 'HTTP_AUTHORIZATION': f'Token {self.token}',
+            'wsgi.input': body, 'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.errors': sys.stderr,
+            'wsgi.multiprocess': False, 'wsgi.multithread': False, 'wsgi.run_once': False,
+            **{f'HTTP_{name.upper()}': value for name, value in headers.items()},
+        }
+        response = self.handler(environ)
+        assert response.status_code < 300, response.content[:500]
+        return json.loads(response.content)
+
+    def _json(self, method, path, data):
+        payload = json.dumps(data).encode()
+        with tempfile.TemporaryFile() as body:
+            body.write(payload)
+            body.seek(0)
+            return self._request(method, path, body, len(payload), 'application/json')
+
+    def _multipart(self, source, options, work):
+        form = os.path.join(work, 'form')
+        with open(form, 'wb') as out, open(source, 'rb') as video:
+            out.write(
+                f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="description"\r\n\r\nbench upload\r\n'
+                f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="video_file"; filename="clip.mp4"\r\n'
+                f'Content-Type: video/mp4\r\n\r\n'.encode()
+            )
+            shutil.copyfileobj(video, out, 1024 * 1024)
+            out.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+        try:
+            with open(form, 'rb') as body:
+                video = self._request('POST', '/api/videos/', body, os.path.getsize(form),
+                                      f'multipart/form-data; boundary={BOUNDARY}')
+        finally:
+            os.unlink(form)
+        return self._stored_path(video)
+
+    def _chunked(self, source, options, work):
+        size = os.path.getsize(source)
+        upload = self._json('POST', '/api/videos/uploads/', {
+            'filename': 'clip.mp4', 'size': size, 'chunkSize': options['chunk_mb'] * 1024 * 1024,
+            'checksum': self.checksum,
+        })
+        with open(source, 'rb') as body:
+            for index in range(upload['chunkCount']):
+                offset = index * upload['chunkSize']
+                length = min(upload['chunkSize'], size - offset)
+                body.seek(offset)
+                self._request('PUT', f'/api/videos/uploads/{upload["uploadId"]}/chunks/{index}/', body, length,
+                              'application/octet-stream')
+        video = self._json('POST', f'/api/videos/uploads/{upload["uploadId"]}/finalize/',
+                           {'description': 'bench upload'})
+        return self._stored_path(video)
+
+    def _stored_path(self, video):
+        return Video.objects.get(pk=video['id']).video_file.path
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import bulk_create_in_batches, make_bench_user, rolled_back, time_ms
+from core.models import Video
+from core.pagination import KeysetPagination, keyset_condition
+
+
+class Command(BaseCommand):
+    help = 'Compare OFFSET and keyset pagination latency of the video feed at increasing page depth'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        page_size = options['page_size']
+        paginator = KeysetPagination()
+        ordering = paginator.ordering
+
+        with rolled_back():
+            user = make_bench_user('bench-feed')
+            self.stdout.write(f'Seeding {rows} videos...')
+            bulk_create_in_batches(Video, (
+                Video(user=user, username=user.username, description=f'bench video {i}')
+                for i in range(rows)
+            ))
+            feed = Video.objects.order_by(*ordering)
+
+            self.stdout.write(f'{"page":>8} {"offset ms":>12} {"keyset ms":>12}')
+            page = 1
+            while (page - 1) * page_size < rows:
+                offset = (page - 1) * page_size
+
+                def offset_page():
+                    return list(feed[offset:offset + page_size])
+
+                if offset:
+                    previous = feed.values_list(*[field.lstrip('-') for field in ordering])[offset - 1]
+                    position = [paginator._field_value(_Row(ordering, previous), field) for field in ordering]
+                    keyset_feed = feed.filter(keyset_condition(ordering, position))
+                else:
+                    keyset_feed = feed
+
+                def keyset_page():
+                    return list(keyset_feed[:page_size])
+
+                offset_ms = time_ms(offset_page, options['repeat'])
+                keyset_ms = time_ms(keyset_page, options['repeat'])
+                self.stdout.write(f'{page:>8} {offset_ms:>12.2f} {keyset_ms:>12.2f}')
+                page *= 10
+
+
+class _Row:
+    """Attribute access over a values_list() tuple"""
+
+    def __init__(self, ordering, values):
+        for field, value in zip(ordering, values):
+            setattr(self, field.lstrip('-'), value)
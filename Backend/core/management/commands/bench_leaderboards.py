@@ -0,0 +1,106 @@
+import random
+import resource
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.utils import timezone
+
+from core import leaderboards
+from core.benchmarks import bulk_create_in_batches, rolled_back, spread_over_time, time_ms
+from core.models import Club, ClubMember, LeaderboardDay, VyRaPointsTransaction
+
+
+def percentile(samples, fraction):
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Compare the ledger-scanning weekly leaderboard with the materialized boards over a synthetic ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000000, help='Earned ledger rows')
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=30, help='Spread the rows over this many days')
+        parser.add_argument('--club-members', type=int, default=5000)
+        parser.add_argument('--lookups', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            user_ids = self._seed(options)
+            self._run(user_ids, options)
+
+    def _seed(self, options):
+        run = random.randrange(10 ** 9)
+        start = time.perf_counter()
+        bulk_create_in_batches(User, (User(username=f'lb{run}-{i}') for i in range(options['users'])))
+        user_ids = list(User.objects.filter(username__startswith=f'lb{run}-').values_list('pk', flat=True))
+        rng = random.Random(42)
+        now = timezone.now()
+        # Activity is skewed: a few users earn most of the points
+        weights = [rng.paretovariate(1.5) for _ in user_ids]
+        picks = rng.choices(user_ids, weights=weights, k=min(options['rows'], 1000000))
+
+        def rows():
+            for i in range(options['rows']):
+                yield VyRaPointsTransaction(
+                    id=uuid.UUID(int=rng.getrandbits(128), version=4), user_id=picks[i % len(picks)],
+                    points=rng.choice((1, 1, 1, 2, 3, 10)), transaction_type='earned', description='Liked videos (1)',
+                )
+
+        bulk_create_in_batches(VyRaPointsTransaction, rows())
+        spread_over_time(
+            VyRaPointsTransaction.objects.filter(created_at__gte=now), 'created_at',
+            now, timedelta(days=options['days']), options['days'] * 24,
+        )
+        club = Club.objects.create(name='Bench club', description='d', category='Bench', creator_id=user_ids[0])
+        ClubMember.objects.bulk_create(
+            [ClubMember(club=club, user_id=user_id) for user_id in rng.sample(user_ids, options['club_members'])],
+            batch_size=10000,
+        )
+        self.club_id = club.pk
+        self.stdout.write(
+            f'Seeded {options["rows"]:,} ledger rows for {len(user_ids):,} users in {time.perf_counter() - start:.0f}s'
+        )
+        return user_ids
+
+    def _run(self, user_ids, options):
+        week_ago = timezone.now() - timedelta(days=7)
+
+        def legacy():
+            return list(VyRaPointsTransaction.objects.filter(
+                created_at__gte=week_ago, transaction_type='earned'
+            ).values('user__username').annotate(total_points=Sum('points')).order_by('-total_points')[:10])
+
+        self.stdout.write(f'Legacy weekly leaderboard (ledger scan): {time_ms(legacy, repeat=3):,.0f} ms per request')
+
+        start = time.perf_counter()
+        call_command('rebuild_leaderboards', stdout=self.stdout)
+        self.stdout.write(
+            f'{LeaderboardDay.objects.count():,} day rows; rebuild took {time.perf_counter() - start:.1f}s in all'
+        )
+
+        leaderboards.leaderboards.reset()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        load_ms = time_ms(leaderboards.leaderboards.refresh, repeat=1)
+        memory_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+        self.stdout.write(
+            f'Loaded the daily, weekly and all-time boards in {load_ms:,.0f} ms, '
+            f'{memory_mb:.0f} MiB peak RSS growth (once per process and day)'
+        )
+
+        rng = random.Random(7)
+        self.stdout.write(f'{"lookup":<28} {"p50 ms":>8} {"p99 ms":>8}')
+        for label, lookup, count in (
+            ('weekly top 10', lambda: leaderboards.top('weekly', 10), 1000),
+            ('weekly rank', lambda: leaderboards.rank('weekly', rng.choice(user_ids)), options['lookups']),
+            ('all-time rank', lambda: leaderboards.rank('all', rng.choice(user_ids)), options['lookups']),
+            ('club weekly top 10', lambda: leaderboards.top('weekly', 10, club_id=self.club_id), 20),
+            ('club all-time rank', lambda: leaderboards.rank('all', rng.choice(user_ids), club_id=self.club_id), 20),
+        ):
+            samples = sorted(time_ms(lookup, repeat=1) for _ in range(count))
+            self.stdout.write(f'{label:<28} {percentile(samples, 0.5):>8.3f} {percentile(samples, 0.99):>8.3f}')
@@ -0,0 +1,80 @@
+import random
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.api_views import VideoViewSet
+from core.benchmarks import bulk_create_in_batches, make_bench_user, rolled_back, time_ms
+from core.geo import encode_geohash
+from core.models import Video
+
+
+class Command(BaseCommand):
+    help = 'Time the Universe Map nearby and clusters endpoints over many geotagged videos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--queries', type=int, default=20, help='Random search centres per radius')
+        # Default region is roughly West Africa (~1300 x 1650 km)
+        parser.add_argument('--bbox', type=float, nargs=4, default=[0.0, 12.0, -5.0, 10.0],
+                            metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LNG', 'MAX_LNG'))
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        min_lat, max_lat, min_lng, max_lng = options['bbox']
+        rng = random.Random(42)
+        factory = APIRequestFactory()
+        nearby = VideoViewSet.as_view({'get': 'nearby'})
+        clusters = VideoViewSet.as_view({'get': 'clusters'})
+
+        def point():
+            return rng.uniform(min_lat, max_lat), rng.uniform(min_lng, max_lng)
+
+        def geotagged(user):
+            for i in range(rows):
+                lat, lng = point()
+                yield Video(user=user, username=user.username, description=f'bench video {i}',
+                            latitude=lat, longitude=lng, geohash=encode_geohash(lat, lng))
+
+        with rolled_back():
+            user = make_bench_user('bench-nearby')
+            self.stdout.write(f'Seeding {rows} geotagged videos...')
+            bulk_create_in_batches(Video, geotagged(user))
+
+            def timed(view, params):
+                request = factory.get('/api/videos/', params, HTTP_HOST='localhost')
+                force_authenticate(request, user)
+                response = None
+
+                def call():
+                    nonlocal response
+                    response = view(request)
+                    response.render()
+
+                elapsed = time_ms(call, options['repeat'])
+                return elapsed, len(response.data)
+
+            self.stdout.write(f'{"endpoint":>10} {"params":>24} {"results":>8} {"median ms":>10} {"max ms":>8}')
+            for endpoint, view, extra in (
+                ('nearby', nearby, {'radius': 1}),
+                ('nearby', nearby, {'radius': 5}),
+                ('nearby', nearby, {'radius': 10}),
+                ('nearby', nearby, {'radius': 25}),
+                ('nearby', nearby, {'radius': 25, 'page_size': 100}),
+                ('clusters', clusters, {'radius': 25, 'zoom': 11}),
+                ('clusters', clusters, {'radius': 100, 'zoom': 8}),
+            ):
+                samples = []
+                results = 0
+                for _ in range(options['queries']):
+                    lat, lng = point()
+                    elapsed, count = timed(view, {'lat': lat, 'lng': lng, **extra})
+                    samples.append(elapsed)
+                    results += count
+                samples.sort()
+                label = ' '.join(f'{key}={value}' for key, value in extra.items())
+                self.stdout.write(
+                    f'{endpoint:>10} {label:>24} {results // len(samples):>8} '
+                    f'{samples[len(samples) // 2]:>10.2f} {samples[-1]:>8.2f}'
+                )
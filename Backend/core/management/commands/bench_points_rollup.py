@@ -0,0 +1,129 @@
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.api_views import VyRaPointsViewSet
+from core.benchmarks import bulk_create_in_batches, rolled_back, spread_over_time, time_ms
+from core.models import Profile, VyRaPointsTransaction
+from core.points import MICRO_AWARDS, drifted_balances
+from core.rollups import LEDGER_TABLE, rollup, rollup_cutoff
+
+
+def ledger_bytes():
+    """Size of the ledger table and its indexes"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            names = [LEDGER_TABLE, *connection.introspection.get_constraints(cursor, LEDGER_TABLE)]
+            cursor.execute(
+                f'SELECT SUM(pgsize) FROM dbstat WHERE name IN ({", ".join(["%s"] * len(names))})', names
+            )
+        else:
+            cursor.execute(
+                'SELECT pg_total_relation_size(%s::regclass) + COALESCE(SUM(pg_total_relation_size(inhrelid)), 0) '
+                'FROM pg_inherits WHERE inhparent = %s::regclass', [LEDGER_TABLE, LEDGER_TABLE]
+            )
+        return cursor.fetchone()[0] or 0
+
+
+class Command(BaseCommand):
+    help = 'Measure ledger size and points history latency before and after rolling up old micro-transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000)
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--days', type=int, default=90, help='Spread the rows over this many days')
+        parser.add_argument('--samples', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            user_ids = self._seed(options)
+            # The users who look at their history are the active ones
+            sample = random.Random(7).choices(user_ids, weights=self.weights, k=options['samples'])
+            self.stdout.write(f'{"":<8} {"rows":>11} {"MiB":>8} {"history ms":>11} {"balance ms":>11} '
+                              f'{"reconcile s":>12}')
+            self._measure('before', sample)
+            start = time.perf_counter()
+            folded, summaries = rollup(rollup_cutoff())
+            self.stdout.write(
+                f'Rolled {folded:,} rows up into {summaries:,} in {time.perf_counter() - start:.1f}s'
+            )
+            self._measure('after', sample)
+
+    def _seed(self, options):
+        run = random.randrange(10 ** 9)
+        start = time.perf_counter()
+        bulk_create_in_batches(User, (User(username=f'ru{run}-{i}') for i in range(options['users'])))
+        user_ids = list(User.objects.filter(username__startswith=f'ru{run}-').values_list('pk', flat=True))
+        rng = random.Random(42)
+        now = timezone.now()
+        reasons = list(MICRO_AWARDS.values())
+        # Activity is skewed: a few users earn most of the points
+        self.weights = [rng.paretovariate(1.2) for _ in user_ids]
+        picks = rng.choices(user_ids, weights=self.weights, k=min(options['rows'], 1000000))
+        balances = defaultdict(int)
+
+        def rows():
+            for i in range(options['rows']):
+                user_id = picks[i % len(picks)]
+                if i % 100 == 0:
+                    # Now and then a keyed spend, which is never folded
+                    points, kind, description, key = -5, 'spent', 'Boosted video', f'bench:{run}:{i}'
+                else:
+                    reason = rng.choice(reasons)
+                    points, kind, description, key = reason[0], 'earned', f'{reason[1]} (1)', None
+                balances[user_id] += points
+                yield VyRaPointsTransaction(
+                    id=uuid.UUID(int=rng.getrandbits(128), version=4), user_id=user_id, points=points,
+                    transaction_type=kind, description=description, idempotency_key=key,
+                )
+
+        bulk_create_in_batches(VyRaPointsTransaction, rows())
+        spread_over_time(
+            VyRaPointsTransaction.objects.filter(created_at__gte=now), 'created_at',
+            now, timedelta(days=options['days']), options['days'] * 24,
+        )
+        # bulk_create skips the signal that creates profiles
+        bulk_create_in_batches(Profile, (
+            Profile(user_id=user_id, id_user=user_id, vyra_points=balances[user_id]) for user_id in user_ids
+        ))
+        self.stdout.write(
+            f'Seeded {options["rows"]:,} ledger rows for {len(user_ids):,} users over {options["days"]} days '
+            f'in {time.perf_counter() - start:.0f}s'
+        )
+        return user_ids
+
+    def _measure(self, label, sample):
+        factory = APIRequestFactory()
+        view = VyRaPointsViewSet.as_view({'get': 'list'})
+        users = {user.pk: user for user in User.objects.filter(pk__in=sample)}
+
+        def history(user_id):
+            request = factory.get('/api/vyra-points/', HTTP_HOST='localhost')
+            force_authenticate(request, users[user_id])
+            view(request).render()
+
+        def per_user(fn):
+            return sorted(time_ms(lambda: fn(user_id), repeat=1) for user_id in sample)[len(sample) // 2]
+
+        rows = VyRaPointsTransaction.objects.count()
+        history_ms = per_user(history)
+        balance_ms = per_user(
+            lambda user_id: VyRaPointsTransaction.objects.filter(user_id=user_id).aggregate(Sum('points'))
+        )
+        start = time.perf_counter()
+        drifted = drifted_balances().count()
+        reconcile_s = time.perf_counter() - start
+        assert drifted == 0, f'{drifted} balances differ from the ledger'
+        self.stdout.write(
+            f'{label:<8} {rows:>11,} {ledger_bytes() / 2 ** 20:>8.1f} {history_ms:>11.2f} '
+            f'{balance_ms:>11.2f} {reconcile_s:>12.1f}'
+        )
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import random
+import resource
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+
+from core import realtime
+from core.benchmarks import LocalWebSocket, bulk_create_in_batches, rolled_back
+from core.models import Chat, ChatParticipant, LiveRoom
+
+
+def percentile(samples, fraction):
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Load-test the WebSocket gateway with thousands of concurrent in-process clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=5000, help='Users; each opens a live room and a chat socket')
+        parser.add_argument('--broadcasts', type=int, default=50, help='Events fanned out to every live room socket')
+        parser.add_argument('--chat-messages', type=int, default=5000, help='Events sent to random chats')
+
+    def handle(self, *args, **options):
+        realtime._layer = realtime.InMemoryChannelLayer()
+        with rolled_back():
+            users, tokens, room, chats = self._seed(options['clients'])
+            async_to_sync(self._run)(users, tokens, room, chats, options)
+
+    def _seed(self, count):
+        run = random.randrange(10 ** 9)
+        bulk_create_in_batches(User, (User(username=f'rt{run}-{i}') for i in range(count)), batch_size=1000)
+        users = list(User.objects.filter(username__startswith=f'rt{run}-').order_by('pk'))
+        tokens = [Token(key=Token.generate_key(), user=user) for user in users]
+        Token.objects.bulk_create(tokens, batch_size=1000)
+        room = LiveRoom.objects.create(host=users[0], title='Load test', status='live')
+        # Users pair up into one-to-one chats
+        chats = Chat.objects.bulk_create([Chat() for _ in range(count // 2)], batch_size=1000)
+        ChatParticipant.objects.bulk_create([
+            ChatParticipant(chat=chat, user=user) for i, chat in enumerate(chats) for user in users[2 * i:2 * i + 2]
+        ], batch_size=1000)
+        return users, tokens, room, chats
+
+    async def _run(self, users, tokens, room, chats, options):
+        layer = realtime.get_channel_layer()
+        received = []
+        done = asyncio.Event()
+        expected = {'count': 0}
+
+        async def read(socket):
+            while True:
+                message = await socket.outbound.get()
+                if message['type'] != 'websocket.send':
+                    return
+                received.append(time.perf_counter() - json.loads(message['text'])['sentAt'])
+                if len(received) >= expected['count']:
+                    done.set()
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        sockets = []
+        for i, token in enumerate(tokens):
+            sockets.append(LocalWebSocket(realtime.websocket_application, f'/ws/live/{room.pk}/', token.key))
+            if i // 2 < len(chats):
+                sockets.append(LocalWebSocket(realtime.websocket_application, f'/ws/chats/{chats[i // 2].pk}/', token.key))
+        opened = await asyncio.gather(*(socket.connect() for socket in sockets))
+        connect_s = time.perf_counter() - start
+        refused = sum(message['type'] != 'websocket.accept' for message in opened)
+        memory_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+        readers = [asyncio.ensure_future(read(socket)) for socket in sockets]
+        self.stdout.write(
+            f'Opened {len(sockets) - refused} sockets ({refused} refused) for {len(users)} users '
+            f'in {connect_s:.1f}s; {memory_mb:.0f} MiB peak RSS growth'
+        )
+
+        async def measure(label, events, deliveries, pause):
+            """Publish (group, event) pairs from another thread, as views do, and time their delivery"""
+            received.clear()
+            done.clear()
+            expected['count'] = deliveries
+
+            def publish():
+                for group, event in events:
+                    event['sentAt'] = time.perf_counter()
+                    layer.publish(group, event)
+                    if pause:
+                        time.sleep(pause)
+
+            start = time.perf_counter()
+            publisher = threading.Thread(target=publish)
+            publisher.start()
+            try:
+                await asyncio.wait_for(done.wait(), timeout=120)
+            except asyncio.TimeoutError:
+                pass
+            elapsed = time.perf_counter() - start
+            publisher.join()
+            samples = sorted(latency * 1000 for latency in received)
+            self.stdout.write(
+                f'{label:<22} {len(samples):>9}/{deliveries:<9} {len(samples) / elapsed:>12,.0f} '
+                f'{percentile(samples, 0.5):>8.1f} {percentile(samples, 0.99):>8.1f} {samples[-1]:>8.1f}'
+            )
+
+        self.stdout.write(f'{"events":<22} {"delivered":>19} {"per second":>12} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+        live = realtime.live_group(room.pk)
+        await measure(
+            f'{options["broadcasts"]} live broadcasts',
+            [(live, {'type': 'battle_vote', 'n': n}) for n in range(options['broadcasts'])],
+            options['broadcasts'] * len(users), pause=0.02,
+        )
+        rng = random.Random(42)
+        await measure(
+            f'{options["chat_messages"]} chat messages',
+            [(realtime.chat_group(rng.choice(chats).pk), {'type': 'message', 'n': n})
+             for n in range(options['chat_messages'])],
+            options['chat_messages'] * 2, pause=0,
+        )
+
+        await asyncio.gather(*(socket.close() for socket in sockets))
+        for reader in readers:
+            reader.cancel()
+        self.stdout.write(f'Closed all sockets; {layer.subscriber_count()} subscriptions left')
@@ -0,0 +1,67 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.benchmarks import make_bench_user, rolled_back, time_ms
+from core.models import SearchDocument, Video
+from core.search import object_key, search, video_document
+
+WORDS = 5000
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text video search with the old icontains scan over many videos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--queries', type=int, default=10, help='Random queries per shape')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        rng = random.Random(42)
+        # Zipf-ish vocabulary, so some words are common and most are rare
+        vocabulary = [f'w{i}x{rng.randrange(36 ** 3):03x}' for i in range(WORDS)]
+        weights = [1 / (rank + 1) for rank in range(WORDS)]
+
+        def description():
+            return ' '.join(rng.choices(vocabulary, weights, k=12))
+
+        with rolled_back():
+            user = make_bench_user('bench-search')
+            self.stdout.write(f'Seeding {rows} videos and search documents...')
+            for start in range(0, rows, 10000):
+                videos = Video.objects.bulk_create([
+                    Video(user=user, username=user.username, description=description())
+                    for _ in range(min(10000, rows - start))
+                ])
+                SearchDocument.objects.bulk_create([
+                    SearchDocument(kind='video', object_id=object_key(video.pk), title=title, body=body)
+                    for video in videos for title, body in [video_document(video, [])]
+                ])
+
+            def icontains(text):
+                return list(
+                    Video.objects.filter(Q(description__icontains=text) | Q(username__icontains=text))
+                    .order_by('-created_at').values_list('pk', flat=True)[:20]
+                )
+
+            def full_text(text):
+                return list(Video.objects.filter(pk__in=search('video', text, limit=20)).values_list('pk', flat=True))
+
+            shapes = (
+                ('rare word', lambda: rng.choice(vocabulary[WORDS // 2:])),
+                ('common word', lambda: rng.choice(vocabulary[:10])),
+                ('prefix', lambda: rng.choice(vocabulary[WORDS // 2:])[:4]),
+                ('two words', lambda: ' '.join(rng.sample(vocabulary[:200], 2))),
+            )
+            self.stdout.write(f'{"query":>12} {"icontains ms":>13} {"full-text ms":>13}')
+            for label, make_query in shapes:
+                queries = [make_query() for _ in range(options['queries'])]
+                samples = {'icontains': [], 'full_text': []}
+                for text in queries:
+                    samples['icontains'].append(time_ms(lambda: icontains(text), options['repeat']))
+                    samples['full_text'].append(time_ms(lambda: full_text(text), options['repeat']))
+                medians = {name: sorted(values)[len(values) // 2] for name, values in samples.items()}
+                self.stdout.write(f'{label:>12} {medians["icontains"]:>13.2f} {medians["full_text"]:>13.2f}')
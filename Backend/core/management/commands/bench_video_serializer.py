@@ -0,0 +1,46 @@
+from django.db import connection
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from core.benchmarks import bulk_create_in_batches, make_bench_user, rolled_back, time_ms
+from core.models import Hashtag, Video
+from core.serializers import VideoSerializer
+
+
+class Command(BaseCommand):
+    help = 'Measure queries and time per row when serializing a page of videos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--videos', type=int, default=1000)
+        parser.add_argument('--hashtags', type=int, default=3, help='Hashtags per video')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        count = options['videos']
+        request = RequestFactory().get('/api/videos/', HTTP_HOST='localhost')
+
+        with rolled_back():
+            user = make_bench_user('bench-serializer')
+            bulk_create_in_batches(Video, (
+                Video(user=user, username=user.username, description=f'bench video {i}',
+                      video_url=f'/media/videos/bench-{i}.mp4')
+                for i in range(count)
+            ))
+            videos = Video.objects.filter(user=user).order_by('-created_at', '-id')
+            tags = [Hashtag.objects.create(name=f'{user.username}-{i}') for i in range(options['hashtags'])]
+            through = Video.hashtags.through
+            bulk_create_in_batches(through, (
+                through(video_id=video_id, hashtag_id=tag.pk)
+                for video_id in videos.values_list('pk', flat=True) for tag in tags
+            ))
+
+            self.stdout.write(f'{"queryset":>12} {"queries":>8} {"us/row":>10}')
+            for label, queryset in (('plain', videos), ('eager_load', VideoSerializer.eager_load(videos))):
+                def serialize():
+                    return VideoSerializer(queryset.all(), many=True, context={'request': request}).data
+
+                with CaptureQueriesContext(connection) as queries:
+                    serialize()
+                elapsed_ms = time_ms(serialize, options['repeat'])
+                self.stdout.write(f'{label:>12} {len(queries):>8} {elapsed_ms * 1000 / count:>10.1f}')
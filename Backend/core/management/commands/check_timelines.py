@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.timeline import followed_or_public_queryset, home_feed
+
+
+class Command(BaseCommand):
+    help = 'Compare materialized home feeds against the on-the-fly followed-or-public query'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='How many users to sample')
+        parser.add_argument('--depth', type=int, default=50, help='How many feed items to compare per user')
+        parser.add_argument('--username', help='Check a single user')
+
+    def handle(self, *args, **options):
+        depth = options['depth']
+        if options['username']:
+            users = User.objects.filter(username=options['username'])
+        else:
+            users = User.objects.order_by('?')[:options['users']]
+
+        checked = 0
+        mismatched = 0
+        for user in users:
+            expected = [video.pk for video in followed_or_public_queryset(user)[:depth]]
+            actual = [video.pk for video in home_feed(user, depth)]
+            checked += 1
+            if expected != actual:
+                mismatched += 1
+                missing = len(set(expected) - set(actual))
+                extra = len(set(actual) - set(expected))
+                self.stdout.write(f'{user.username}: {missing} missing, {extra} unexpected, order differs')
+
+        summary = f'{checked} user(s) checked, {mismatched} mismatched'
+        if mismatched:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
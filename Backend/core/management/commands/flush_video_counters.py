@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.battles import battle_votes
+from core.counters import video_counters
+from core.models import CounterFlushBatch
+from core.points import point_awards
+
+
+class Command(BaseCommand):
+    help = (
+        'Flush buffered video engagement counters, live battle votes and points micro-awards to the database '
+        'and prune old flush markers'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-days', type=int, default=1,
+            help='Keep CounterFlushBatch markers this many days for crash recovery'
+        )
+
+    def handle(self, *args, **options):
+        flushed = video_counters.flush() + battle_votes.flush() + point_awards.flush()
+        cutoff = timezone.now() - timedelta(days=options['keep_days'])
+        pruned, _ = CounterFlushBatch.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} counter(s), pruned {pruned} flush marker(s)'))
@@ -0,0 +1,32 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import media
+
+
+class Command(BaseCommand):
+    help = 'Make posters, previews and HLS renditions of queued videos, MEDIA_PROCESSING_WORKERS at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if not media.available():
+            raise CommandError(f'{settings.FFMPEG_BINARY} and {settings.FFPROBE_BINARY} must be installed')
+        counts = []
+
+        def work():
+            try:
+                counts.append(media.run_pending())
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work) for _ in range(options['workers'] or settings.MEDIA_PROCESSING_WORKERS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS(f'Processed {sum(counts)} media job(s)'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.notifications import notifications
+
+
+class Command(BaseCommand):
+    help = 'Coalesce queued notification events into notifications'
+
+    def handle(self, *args, **options):
+        processed = notifications.drain_all()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} notification event(s)'))
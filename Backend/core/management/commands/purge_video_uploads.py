@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.uploads import discard_chunks, expire, expired_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete unfinished resumable video uploads idle for VIDEO_UPLOAD_EXPIRE_HOURS, and their chunks'
+
+    def handle(self, *args, **options):
+        purged = 0
+        for upload in expired_uploads().iterator(chunk_size=500):
+            if not expire(upload):
+                continue  # Resumed or being finalized since it was listed
+            discard_chunks(upload)
+            upload.delete()
+            purged += 1
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} upload(s)'))
@@ -0,0 +1,48 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.interests import apply_engagement
+from core.models import Buzz, Comment, InterestProfile, Like, Share, Video
+
+
+class Command(BaseCommand):
+    help = 'Rebuild InterestProfile rows by replaying recent likes, comments, buzzes and shares'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Replay engagement from this many days back')
+        parser.add_argument('--username', help='Rebuild a single user')
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        sources = (('like', Like), ('comment', Comment), ('buzz', Buzz), ('share', Share))
+
+        users = User.objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+
+        rebuilt = 0
+        for user in users.iterator():
+            events = []
+            for kind, model in sources:
+                events.extend(
+                    (created_at, kind, video_id) for video_id, created_at in
+                    model.objects.filter(user=user, created_at__gte=since).values_list('video_id', 'created_at')
+                )
+            if not events:
+                continue
+            events.sort()
+            videos = Video.objects.filter(pk__in={video_id for _, _, video_id in events}).prefetch_related('hashtags').in_bulk()
+
+            profile = InterestProfile(user=user, hashtags={}, creators={}, as_of=events[0][0])
+            for created_at, kind, video_id in events:
+                video = videos[video_id]
+                creator_id = video.user_id if video.user_id != user.pk else None
+                apply_engagement(profile, kind, [tag.pk for tag in video.hashtags.all()], creator_id, created_at)
+            InterestProfile.objects.update_or_create(
+                user=user, defaults={'hashtags': profile.hashtags, 'creators': profile.creators, 'as_of': profile.as_of}
+            )
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} interest profile(s)'))
@@ -0,0 +1,67 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+from core.benchmarks import bulk_create_in_batches
+from core.leaderboards import EVERYONE, hashtag_scope
+from core.models import Buzz, Comment, LeaderboardDay, LeaderboardTotal, Like, Share, Video, VyRaPointsTransaction
+from core.points import MICRO_AWARDS, UPLOAD_POINTS
+
+# Where hashtag points come from: each upload, like, share, buzz and comment on a tagged video
+HASHTAG_SOURCES = (
+    (Video, 'hashtags', UPLOAD_POINTS),
+    (Like, 'video__hashtags', MICRO_AWARDS['like'][0]),
+    (Share, 'video__hashtags', MICRO_AWARDS['share'][0]),
+    (Buzz, 'video__hashtags', MICRO_AWARDS['buzz'][0]),
+    (Comment, 'video__hashtags', MICRO_AWARDS['comment'][0]),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the leaderboard aggregates: everyone\'s from the earned rows of the points ledger, '
+        'the hashtags\' from the uploads and engagements on tagged videos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        start = time.perf_counter()
+        with transaction.atomic():
+            LeaderboardDay.objects.all().delete()
+            LeaderboardTotal.objects.all().delete()
+            days = bulk_create_in_batches(LeaderboardDay, self._global_days(), batch_size)
+            days += bulk_create_in_batches(LeaderboardDay, self._hashtag_days(), batch_size)
+            totals = bulk_create_in_batches(LeaderboardTotal, (
+                LeaderboardTotal(scope=row['scope'], user_id=row['user_id'], points=row['total'])
+                for row in LeaderboardDay.objects.values('scope', 'user_id').annotate(
+                    total=Sum('points')
+                ).order_by().iterator(chunk_size=batch_size)
+            ), batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {days} day row(s) and {totals} total(s) in {time.perf_counter() - start:.1f}s'
+        ))
+
+    def _global_days(self):
+        rows = VyRaPointsTransaction.objects.filter(transaction_type='earned').annotate(
+            day=TruncDate('created_at')
+        ).values('user_id', 'day').annotate(total=Sum('points')).order_by()
+        for row in rows.iterator(chunk_size=10000):
+            yield LeaderboardDay(scope=EVERYONE, day=row['day'], user_id=row['user_id'], points=row['total'])
+
+    def _hashtag_days(self):
+        points = defaultdict(int)
+        for model, hashtags, per_action in HASHTAG_SOURCES:
+            rows = model.objects.filter(**{f'{hashtags}__isnull': False}).annotate(
+                day=TruncDate('created_at'), hashtag=F(hashtags)
+            ).values('user_id', 'day', 'hashtag').annotate(actions=Count('pk')).order_by()
+            for row in rows.iterator(chunk_size=10000):
+                points[(hashtag_scope(row['hashtag']), row['day'], row['user_id'])] += row['actions'] * per_action
+        for (scope, day, user_id), total in points.items():
+            yield LeaderboardDay(scope=scope, day=day, user_id=user_id, points=total)
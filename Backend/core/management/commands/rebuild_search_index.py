@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.benchmarks import bulk_create_in_batches
+from core.models import Hashtag, Profile, SearchDocument, Video
+from core.search import all_documents, fts_table
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents for all videos, profiles and hashtags'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            created = bulk_create_in_batches(
+                SearchDocument, all_documents(Video, Profile, Hashtag, SearchDocument), batch_size=2000
+            )
+            if connection.vendor == 'sqlite':
+                # Compact the FTS5 index after the mass delete/insert
+                with connection.cursor() as cursor:
+                    for kind, _ in SearchDocument.KINDS:
+                        table = fts_table(kind)
+                        cursor.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+        self.stdout.write(self.style.SUCCESS(f'Indexed {created} search document(s)'))
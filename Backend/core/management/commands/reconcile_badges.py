@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+
+from core.badges import drifted_badge_counters, drifted_chat_unreads
+from core.models import BadgeCounter, ChatParticipant
+
+
+class Command(BaseCommand):
+    help = 'Recompute badge counters (unread notifications/messages, pending claims) and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chats = self._repair(drifted_chat_unreads, self._fix_chats, options)
+        users = self._repair(drifted_badge_counters, self._fix_users, options)
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {chats} drifted chat count(s), {users} drifted badge counter(s)'))
+
+    def _repair(self, drifted, fix, options):
+        batch_size = options['batch_size']
+        if options['dry_run']:
+            found = 0
+            for row in drifted().iterator(chunk_size=batch_size):
+                self._report(row)
+                found += 1
+            return found
+
+        # Repaired rows drop out of the drift query, so keep taking its head until it is empty
+        repaired = 0
+        while True:
+            batch = list(drifted().order_by('pk')[:batch_size])
+            if not batch:
+                return repaired
+            for row in batch:
+                self._report(row)
+            fix(batch)
+            repaired += len(batch)
+
+    def _fix_chats(self, members):
+        for member in members:
+            member.unread_count = member.actual
+        ChatParticipant.objects.bulk_update(members, ['unread_count'])
+
+    def _fix_users(self, users):
+        BadgeCounter.objects.bulk_create(
+            [
+                BadgeCounter(user_id=user.pk, unread_notifications=user.actual_notifications,
+                             unread_messages=user.actual_messages, pending_claims=user.actual_claims)
+                for user in users
+            ],
+            update_conflicts=True, unique_fields=['user'],
+            update_fields=['unread_notifications', 'unread_messages', 'pending_claims'],
+        )
+
+    def _report(self, row):
+        if hasattr(row, 'chat_id'):
+            self.stdout.write(f'{row.user_id} in chat {row.chat_id}: unread {row.stored} -> {row.actual}')
+        else:
+            self.stdout.write(
+                f'{row.pk}: notifications {row.stored_notifications} -> {row.actual_notifications}, '
+                f'messages {row.stored_messages} -> {row.actual_messages}, '
+                f'claims {row.stored_claims} -> {row.actual_claims}'
+            )
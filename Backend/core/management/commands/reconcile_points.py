@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import VyRaPointsTransaction
+from core.points import drifted_balances, point_awards
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that every Profile.vyra_points equals the sum of its VyRaPointsTransaction rows; '
+        'with --adjust, record an adjustment row for each balance that does not'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--adjust', action='store_true',
+            help='Write a ledger row for each difference instead of failing',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing (the default)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        point_awards.flush()
+
+        # Spends write their ledger row with the debit, so drift is a bug to
+        # look at, not something to paper over unless asked to
+        if not options['adjust'] or options['dry_run']:
+            found = 0
+            for profile in drifted_balances().iterator(chunk_size=options['batch_size']):
+                self._report(profile)
+                found += 1
+            if found:
+                raise CommandError(f'{found} balance(s) differ from the ledger')
+            self.stdout.write(self.style.SUCCESS('All balances match the ledger'))
+            return
+
+        # Adjusted profiles drop out of the drift query, so keep taking its head until it is empty
+        adjusted = 0
+        while True:
+            batch = list(drifted_balances().order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            for profile in batch:
+                self._report(profile)
+            self._adjust(batch)
+            adjusted += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Adjusted {adjusted} balance(s) to match the ledger'))
+
+    def _adjust(self, profiles):
+        """Keep the balances users see: the ledger gets a row for each difference"""
+        with transaction.atomic():
+            VyRaPointsTransaction.objects.bulk_create([
+                VyRaPointsTransaction(
+                    user_id=profile.user_id, points=profile.vyra_points - profile.ledger_total,
+                    transaction_type='reward' if profile.vyra_points > profile.ledger_total else 'penalty',
+                    description='Ledger reconciliation',
+                )
+                for profile in profiles
+            ])
+
+    def _report(self, profile):
+        self.stdout.write(f'{profile.user_id}: balance {profile.vyra_points}, ledger {profile.ledger_total}')
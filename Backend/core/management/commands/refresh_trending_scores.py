@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.counters import video_counters
+from core.models import JobCheckpoint, Video
+from core.trending import WEIGHTS, trending_score
+
+CHECKPOINT = 'refresh_trending_scores'
+# Rows committed slightly after they were stamped are picked up by the next run
+OVERLAP = timedelta(minutes=1)
+
+
+class Command(BaseCommand):
+    help = 'Recompute Video.trending_score for videos whose engagement changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rescan every video')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        video_counters.flush()
+        started = timezone.now()
+
+        videos = Video.objects.only('created_at', 'trending_score', *WEIGHTS).order_by()
+        checkpoint = JobCheckpoint.objects.filter(name=CHECKPOINT).first()
+        if checkpoint and not options['full']:
+            videos = videos.filter(updated_at__gte=checkpoint.last_run_at - OVERLAP)
+
+        scanned = changed = 0
+        batch = []
+        for video in videos.iterator(chunk_size=batch_size):
+            scanned += 1
+            score = trending_score(video)
+            if score != video.trending_score:
+                video.trending_score = score
+                batch.append(video)
+            if len(batch) >= batch_size:
+                changed += self._save(batch)
+                batch = []
+        changed += self._save(batch)
+
+        JobCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'last_run_at': started})
+        self.stdout.write(self.style.SUCCESS(f'Scanned {scanned} video(s), updated {changed} score(s)'))
+
+    def _save(self, batch):
+        # bulk_update leaves updated_at alone, so refreshed videos are not rescanned next time
+        Video.objects.bulk_update(batch, ['trending_score'])
+        return len(batch)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Profile
+from core.relationships import drifted_follow_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute Profile.followers_count/following_count from Follow rows and repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['dry_run']:
+            found = 0
+            for profile in drifted_follow_counters().iterator(chunk_size=batch_size):
+                self._report(profile)
+                found += 1
+            self.stdout.write(self.style.SUCCESS(f'Found {found} drifted profile(s)'))
+            return
+
+        # Repaired rows drop out of the drift query, so keep taking the head
+        # of it until it comes back empty.
+        repaired = 0
+        while True:
+            batch = list(drifted_follow_counters().order_by('pk')[:batch_size])
+            if not batch:
+                break
+            for profile in batch:
+                self._report(profile)
+                profile.followers_count = profile.actual_followers
+                profile.following_count = profile.actual_following
+            Profile.objects.bulk_update(batch, ['followers_count', 'following_count'])
+            repaired += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Repaired {repaired} drifted profile(s)'))
+
+    def _report(self, profile):
+        self.stdout.write(
+            f'{profile.user_id}: followers {profile.followers_count} -> {profile.actual_followers}, '
+            f'following {profile.following_count} -> {profile.actual_following}'
+        )
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.rollups import ensure_partitions, rollup, rollup_cutoff
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold VyRa Points ledger rows older than POINTS_ROLLUP_AFTER_DAYS into one row per user, day and kind, '
+        'and create the coming months\' ledger partitions on PostgreSQL'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, help='Defaults to POINTS_ROLLUP_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users per transaction')
+
+    def handle(self, *args, **options):
+        created = ensure_partitions()
+        if created:
+            self.stdout.write(f'Checked {created} monthly ledger partition(s)')
+        cutoff = rollup_cutoff(options['older_than_days'])
+        start = time.perf_counter()
+        folded, summaries = rollup(cutoff, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled {folded} row(s) created before {cutoff:%Y-%m-%d} up into {summaries} '
+            f'in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,320 @@
+"""Background processing of uploaded videos.
+
+Uploading stores the original file and nothing else, so this module makes
+what players need from it: a poster frame, a short animated preview, the
+duration and resolution, and an HLS ladder of lower-bitrate renditions with
+a master playlist. Everything runs on local ffmpeg/ffprobe binaries
+(FFMPEG_BINARY, FFPROBE_BINARY) and writes under
+MEDIA_ROOT/processed/<video id>/.
+
+The queue is the MediaJob table. ``enqueue()`` adds a job in the caller's
+transaction, and after commit wakes a pool of MEDIA_PROCESSING_WORKERS
+threads in the process. A worker claims the oldest queued job with a
+conditional UPDATE (queued -> running), so jobs are shared between threads
+and processes without locks, and runs ffmpeg in a subprocess, which does the
+heavy lifting outside the GIL. Each ffmpeg gets MEDIA_PROCESSING_THREADS
+threads; the defaults split the CPUs between the workers. The source is
+decoded once for all renditions: one ffmpeg run scales it to every rung of
+the ladder and encodes them side by side.
+
+Outputs are written to a scratch directory and moved into place when the
+whole job succeeded. A failed job is queued again up to
+MEDIA_PROCESSING_MAX_ATTEMPTS times. Each ffmpeg run may take up to
+MEDIA_PROCESSING_TIMEOUT seconds, and the worker refreshes the claim's
+started_at before each one; a claim not refreshed for MEDIA_PROCESSING_LEASE
+seconds (its process died) is reclaimed, and the worker that lost it stops
+at its next step. The process_media_jobs command runs whatever is left, and
+serves deployments that turn the worker threads off.
+"""
+import json
+import logging
+import shutil
+import subprocess
+import threading
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MediaJob
+
+logger = logging.getLogger(__name__)
+
+# Rendition ladder: (short side, video kbit/s, audio kbit/s), best first. Only
+# rungs no larger than the source are made.
+RENDITIONS = [
+    (1080, 5000, 128),
+    (720, 2800, 128),
+    (480, 1200, 96),
+    (360, 700, 64),
+    (240, 400, 64),
+]
+SEGMENT_SECONDS = 4
+POSTER_SHORT_SIDE = 720
+PREVIEW_SHORT_SIDE = 240
+PREVIEW_SECONDS = 3
+PREVIEW_FPS = 10
+PROCESSED_DIR = 'processed'
+
+
+class MediaError(Exception):
+    pass
+
+
+class ClaimLost(Exception):
+    """The job was reclaimed by another worker while this one ran it"""
+
+
+def binaries():
+    """Paths of (ffmpeg, ffprobe), or None for each that is not installed"""
+    return shutil.which(settings.FFMPEG_BINARY), shutil.which(settings.FFPROBE_BINARY)
+
+
+def available():
+    return all(binaries())
+
+
+def output_name(video, filename=''):
+    """Storage name of a processed file of ``video``, relative to MEDIA_ROOT"""
+    return f'{PROCESSED_DIR}/{video.pk}/{filename}' if filename else f'{PROCESSED_DIR}/{video.pk}'
+
+
+def media_url(name):
+    return settings.MEDIA_URL + name if name else None
+
+
+def enqueue(video):
+    """Queue ``video`` for processing in the current transaction"""
+    MediaJob.objects.update_or_create(
+        video=video, defaults={'status': 'queued', 'attempts': 0, 'error': '', 'started_at': None},
+    )
+    transaction.on_commit(media_pipeline.wake)
+
+
+def _run(args):
+    try:
+        result = subprocess.run(args, capture_output=True, timeout=settings.MEDIA_PROCESSING_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise MediaError(f'{Path(args[0]).name} timed out')
+    if result.returncode != 0:
+        detail = result.stderr.decode(errors='replace').strip().splitlines()[-3:]
+        raise MediaError(f'{Path(args[0]).name} exited with {result.returncode}: {" / ".join(detail)}')
+    return result.stdout
+
+
+def probe(ffprobe, source):
+    """Duration in seconds and displayed (width, height) of the first video stream"""
+    output = _run([ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_streams', '-show_format',
+                   '-of', 'json', str(source)])
+    try:
+        info = json.loads(output)
+        stream = info['streams'][0]
+        width, height = int(stream['width']), int(stream['height'])
+    except (ValueError, KeyError, IndexError, TypeError):
+        raise MediaError('No video stream found')
+    duration = info.get('format', {}).get('duration') or stream.get('duration')
+    # Phones record portrait video as rotated landscape; ffmpeg applies the rotation when encoding
+    rotation = stream.get('tags', {}).get('rotate') or next(
+        (side.get('rotation') for side in stream.get('side_data_list', []) if 'rotation' in side), 0
+    )
+    if int(float(rotation)) % 180:
+        width, height = height, width
+    return (float(duration) if duration else None), width, height
+
+
+def scaled(width, height, short_side):
+    """Even dimensions of a (width, height) frame scaled down to ``short_side``; never scaled up"""
+    factor = min(1.0, short_side / min(width, height))
+    return max(2, round(width * factor / 2) * 2), max(2, round(height * factor / 2) * 2)
+
+
+def ladder(width, height):
+    """Renditions to make of a source: [(label, width, height, video kbit/s, audio kbit/s)]"""
+    rungs = [rung for rung in RENDITIONS if rung[0] <= min(width, height)] or RENDITIONS[-1:]
+    return [(f'{short}p', *scaled(width, height, short), video, audio) for short, video, audio in rungs]
+
+
+def encode_renditions(ffmpeg, source, directory, rungs):
+    """Encode every rung as an HLS stream in one ffmpeg run, decoding the source once"""
+    split = f'[0:v]split={len(rungs)}' + ''.join(f'[s{i}]' for i in range(len(rungs)))
+    filters = [split] + [f'[s{i}]scale={w}:{h}[v{i}]' for i, (_, w, h, _, _) in enumerate(rungs)]
+    args = [ffmpeg, '-y', '-v', 'error', '-i', str(source), '-filter_complex', ';'.join(filters)]
+    for i, (label, _, _, video, audio) in enumerate(rungs):
+        args += [
+            '-map', f'[v{i}]', '-map', '0:a:0?',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main', '-pix_fmt', 'yuv420p',
+            '-b:v', f'{video}k', '-maxrate', f'{video * 107 // 100}k', '-bufsize', f'{video * 2}k',
+            # Keyframes on segment boundaries, so every rendition switches at the same points
+            '-force_key_frames', f'expr:gte(t,n_forced*{SEGMENT_SECONDS})', '-sc_threshold', '0',
+            '-c:a', 'aac', '-b:a', f'{audio}k', '-ac', '2',
+            '-threads', str(settings.MEDIA_PROCESSING_THREADS),
+            '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', str(directory / f'{label}_%04d.ts'), str(directory / f'{label}.m3u8'),
+        ]
+    _run(args)
+
+
+def master_playlist(rungs):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for label, width, height, video, audio in rungs:
+        bandwidth = (video * 107 // 100 + audio) * 1000
+        lines += [f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}', f'{label}.m3u8']
+    return '\n'.join(lines) + '\n'
+
+
+def render(job, directory, heartbeat=lambda: None):
+    """Make every output of ``job`` in ``directory``; returns the fields to record on the job.
+
+    ``heartbeat`` is called before each ffmpeg run.
+    """
+    ffmpeg, ffprobe = binaries()
+    if not (ffmpeg and ffprobe):
+        raise MediaError('ffmpeg and ffprobe are not installed')
+    video = job.video
+    if not video.video_file:
+        raise MediaError('Video has no uploaded file')
+    source = Path(video.video_file.path)
+    if not source.exists():
+        raise MediaError('Uploaded file is missing')
+    heartbeat()
+    duration, width, height = probe(ffprobe, source)
+    threads = ['-threads', str(settings.MEDIA_PROCESSING_THREADS)]
+    at = str(min(1.0, duration / 2) if duration else 0)
+
+    heartbeat()
+    poster_width, poster_height = scaled(width, height, POSTER_SHORT_SIDE)
+    _run([ffmpeg, '-y', '-v', 'error', '-ss', at, '-i', str(source), '-frames:v', '1',
+          '-vf', f'scale={poster_width}:{poster_height}', '-q:v', '3', *threads, str(directory / 'poster.jpg')])
+
+    heartbeat()
+    preview_width, preview_height = scaled(width, height, PREVIEW_SHORT_SIDE)
+    _run([ffmpeg, '-y', '-v', 'error', '-ss', at, '-t', str(PREVIEW_SECONDS), '-i', str(source), '-an',
+          '-vf', f'fps={PREVIEW_FPS},scale={preview_width}:{preview_height}',
+          '-c:v', 'libwebp', '-loop', '0', '-q:v', '60', *threads, str(directory / 'preview.webp')])
+
+    rungs = ladder(width, height)
+    heartbeat()
+    encode_renditions(ffmpeg, source, directory, rungs)
+    (directory / 'master.m3u8').write_text(master_playlist(rungs))
+    return {
+        'duration': duration, 'width': width, 'height': height,
+        'poster': output_name(video, 'poster.jpg'),
+        'preview': output_name(video, 'preview.webp'),
+        'hls_manifest': output_name(video, 'master.m3u8'),
+        'renditions': [
+            {'height': h, 'width': w, 'bitrate': (v + a) * 1000, 'playlist': output_name(video, f'{label}.m3u8')}
+            for label, w, h, v, a in rungs
+        ],
+    }
+
+
+def claim_next():
+    """Claim the oldest runnable job (queued, or running past its lease); None when there is none"""
+    while True:
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.MEDIA_PROCESSING_LEASE)
+        candidates = list(
+            MediaJob.objects.filter(Q(status='queued') | Q(status='running', started_at__lt=stale))
+            .order_by('created_at').values_list('pk', 'status', 'attempts')[:10]
+        )
+        if not candidates:
+            return None
+        for pk, job_status, attempts in candidates:
+            current = MediaJob.objects.filter(pk=pk, status=job_status, attempts=attempts)
+            if attempts >= settings.MEDIA_PROCESSING_MAX_ATTEMPTS:
+                current.update(status='failed', finished_at=now, error='Gave up after timing out')
+                continue
+            if current.update(status='running', attempts=attempts + 1, started_at=now):
+                return MediaJob.objects.select_related('video').get(pk=pk)
+        # Every candidate went to another worker: look again
+
+
+def process(job):
+    """Run a claimed job; True if it succeeded"""
+    final = Path(settings.MEDIA_ROOT) / output_name(job.video)
+    scratch = final.with_name(f'{final.name}.{uuid.uuid4().hex}.tmp')
+    # Only the claim that is still current may record its outcome: a reclaimed job has moved on
+    current = MediaJob.objects.filter(pk=job.pk, status='running', attempts=job.attempts)
+
+    def heartbeat():
+        if not current.update(started_at=timezone.now()):
+            raise ClaimLost
+
+    try:
+        scratch.mkdir(parents=True)
+        outputs = render(job, scratch, heartbeat)
+        heartbeat()
+        # Files first, so a job marked done always has them. Should the claim
+        # be lost after all, the worker that took it over replaces them.
+        shutil.rmtree(final, ignore_errors=True)
+        scratch.rename(final)
+        return bool(current.update(status='done', error='', finished_at=timezone.now(), **outputs))
+    except ClaimLost:
+        logger.info('Processing video %s was taken over by another worker', job.pk)
+        return False
+    except Exception as error:
+        retry = job.attempts < settings.MEDIA_PROCESSING_MAX_ATTEMPTS
+        if isinstance(error, MediaError):
+            logger.warning('Processing video %s failed (attempt %d): %s', job.pk, job.attempts, error)
+            message = str(error)
+        else:
+            logger.exception('Processing video %s failed (attempt %d)', job.pk, job.attempts)
+            message = f'{type(error).__name__}: {error}'
+        current.update(status='queued' if retry else 'failed', error=message[:1000],
+                       finished_at=None if retry else timezone.now())
+        return False
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def run_pending():
+    """Process jobs until none is runnable. Returns the number of jobs processed."""
+    if not available():
+        return 0
+    processed = 0
+    while (job := claim_next()) is not None:
+        process(job)
+        processed += 1
+    return processed
+
+
+class MediaPipeline:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._warned = False
+
+    def wake(self):
+        if not available():
+            if not self._warned:
+                logger.warning('ffmpeg/ffprobe not found; media jobs stay queued until they are installed')
+                self._warned = True
+            return
+        if not settings.MEDIA_PROCESSING_WORKER_THREADS:
+            return  # Run by the process_media_jobs command
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < settings.MEDIA_PROCESSING_WORKERS:
+                thread = threading.Thread(target=self._run, name='media-worker', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()  # Before claiming, so a job queued meanwhile wakes us again
+            try:
+                run_pending()
+            except Exception:
+                logger.exception('Media processing failed')
+            finally:
+                connection.close()
+
+
+media_pipeline = MediaPipeline()
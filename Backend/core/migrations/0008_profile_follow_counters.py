@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:43
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_follow_counters(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    Follow = apps.get_model('core', 'Follow')
+    followers = Follow.objects.filter(following=OuterRef('user')).values('following').annotate(
+        total=Count('id')
+    ).values('total')
+    following = Follow.objects.filter(follower=OuterRef('user')).values('follower').annotate(
+        total=Count('id')
+    ).values('total')
+    Profile.objects.update(
+        followers_count=Coalesce(Subquery(followers), 0),
+        following_count=Coalesce(Subquery(following), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_challenge_profileskin_product_boost_score_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='followers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='following_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_follow_counters, migrations.RunPython.noop),
+    ]
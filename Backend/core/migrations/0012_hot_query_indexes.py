@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-17 02:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_timelineentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['chat', '-created_at', '-id'], name='chatmessage_chat_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notification_user_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['user'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-boost_score', '-created_at'], name='product_boost_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_promoted', True)), fields=['-boost_score', '-created_at'], name='product_promoted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sound',
+            index=models.Index(fields=['-usage_count', '-created_at'], name='sound_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='status',
+            index=models.Index(fields=['expires_at'], name='status_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['privacy', '-created_at', '-id'], name='video_privacy_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['username', '-created_at'], name='video_username_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vyrapointstransaction',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='points_user_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vyrapointstransaction',
+            index=models.Index(fields=['transaction_type', 'created_at'], name='points_type_created_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+from core.geo import encode_geohash
+
+
+def backfill_geohash(apps, schema_editor):
+    Video = apps.get_model('core', 'Video')
+    videos = Video.objects.filter(latitude__isnull=False, longitude__isnull=False).only('latitude', 'longitude')
+    batch = []
+    for video in videos.iterator(chunk_size=2000):
+        video.geohash = encode_geohash(video.latitude, video.longitude)
+        batch.append(video)
+        if len(batch) >= 2000:
+            Video.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Video.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['privacy', 'geohash', 'latitude', 'longitude', 'id'], name='video_privacy_geohash_idx'),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+from core.trending import WEIGHTS, trending_score
+
+
+def backfill_trending_score(apps, schema_editor):
+    Video = apps.get_model('core', 'Video')
+    batch = []
+    for video in Video.objects.only('created_at', *WEIGHTS).iterator(chunk_size=2000):
+        video.trending_score = trending_score(video)
+        batch.append(video)
+        if len(batch) >= 2000:
+            Video.objects.bulk_update(batch, ['trending_score'])
+            batch = []
+    Video.objects.bulk_update(batch, ['trending_score'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_video_geohash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_run_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['privacy', '-trending_score'], name='video_trending_idx'),
+        ),
+        migrations.RunPython(backfill_trending_score, migrations.RunPython.noop),
+    ]
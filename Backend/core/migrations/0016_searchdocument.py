@@ -0,0 +1,120 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:21
+
+from django.db import migrations, models
+
+from core.search import all_documents
+
+KINDS = ('video', 'profile', 'hashtag')
+
+
+def sqlite_forward(kind):
+    # One external-content FTS5 table per kind: a kind column would be a term
+    # present in every document, which every query would have to intersect with
+    table = f'core_searchdocument_{kind}_fts'
+    return [
+        f"""
+        CREATE VIRTUAL TABLE {table} USING fts5(
+            title, body,
+            content='core_searchdocument', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        )
+        """,
+        f"INSERT INTO {table}({table}, rank) VALUES ('rank', 'bm25(5.0, 1.0)')",
+        f"""
+        CREATE TRIGGER {table}_insert AFTER INSERT ON core_searchdocument WHEN new.kind = '{kind}' BEGIN
+            INSERT INTO {table}(rowid, title, body) VALUES (new.id, new.title, new.body);
+        END
+        """,
+        f"""
+        CREATE TRIGGER {table}_delete AFTER DELETE ON core_searchdocument WHEN old.kind = '{kind}' BEGIN
+            INSERT INTO {table}({table}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+        END
+        """,
+        f"""
+        CREATE TRIGGER {table}_update AFTER UPDATE ON core_searchdocument WHEN old.kind = '{kind}' BEGIN
+            INSERT INTO {table}({table}, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+            INSERT INTO {table}(rowid, title, body) VALUES (new.id, new.title, new.body);
+        END
+        """,
+    ]
+
+
+def sqlite_backward(kind):
+    table = f'core_searchdocument_{kind}_fts'
+    return [
+        f'DROP TRIGGER IF EXISTS {table}_insert',
+        f'DROP TRIGGER IF EXISTS {table}_delete',
+        f'DROP TRIGGER IF EXISTS {table}_update',
+        f'DROP TABLE IF EXISTS {table}',
+    ]
+
+
+SQLITE_FORWARD = [sql for kind in KINDS for sql in sqlite_forward(kind)]
+SQLITE_BACKWARD = [sql for kind in KINDS for sql in sqlite_backward(kind)]
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE core_searchdocument ADD COLUMN document tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(body, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX core_searchdocument_document_gin ON core_searchdocument USING GIN (document)',
+]
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS core_searchdocument_document_gin',
+    'ALTER TABLE core_searchdocument DROP COLUMN IF EXISTS document',
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD})
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD})
+
+
+def backfill_search_documents(apps, schema_editor):
+    SearchDocument = apps.get_model('core', 'SearchDocument')
+    Video = apps.get_model('core', 'Video')
+    Profile = apps.get_model('core', 'Profile')
+    Hashtag = apps.get_model('core', 'Hashtag')
+
+    batch = []
+    for document in all_documents(Video, Profile, Hashtag, SearchDocument):
+        batch.append(document)
+        if len(batch) >= 2000:
+            SearchDocument.objects.bulk_create(batch)
+            batch = []
+    SearchDocument.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_interestprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('video', 'Video'), ('profile', 'Profile'), ('hashtag', 'Hashtag')], max_length=10)),
+                ('object_id', models.CharField(max_length=64)),
+                ('title', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
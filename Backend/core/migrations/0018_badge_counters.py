@@ -0,0 +1,76 @@
+# Generated by Django 5.2.1 on 2026-10-17 03:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_badge_counters(apps, schema_editor):
+    BadgeCounter = apps.get_model('core', 'BadgeCounter')
+    ChatUnread = apps.get_model('core', 'ChatUnread')
+    Chat = apps.get_model('core', 'Chat')
+    ChatMessage = apps.get_model('core', 'ChatMessage')
+    Notification = apps.get_model('core', 'Notification')
+    UserChallengeProgress = apps.get_model('core', 'UserChallengeProgress')
+
+    counters = {}
+
+    def counter(user_id):
+        return counters.setdefault(user_id, BadgeCounter(user_id=user_id))
+
+    for row in Notification.objects.filter(is_read=False).values('user').annotate(total=Count('id')):
+        counter(row['user']).unread_notifications = row['total']
+    for row in UserChallengeProgress.objects.filter(completed=True, claimed=False).values('user').annotate(total=Count('id')):
+        counter(row['user']).pending_claims = row['total']
+
+    # A participant's unread messages in a chat: unread messages there not sent by them
+    unread_by_sender = {}
+    for row in ChatMessage.objects.filter(is_read=False).values('chat', 'sender').annotate(total=Count('id')):
+        unread_by_sender.setdefault(row['chat'], {})[row['sender']] = row['total']
+    unread = []
+    for chat_id, user_id in Chat.participants.through.objects.filter(
+        chat_id__in=unread_by_sender
+    ).values_list('chat_id', 'user_id'):
+        senders = unread_by_sender[chat_id]
+        count = sum(senders.values()) - senders.get(user_id, 0)
+        if count:
+            unread.append(ChatUnread(user_id=user_id, chat_id=chat_id, count=count))
+            counter(user_id).unread_messages += count
+
+    ChatUnread.objects.bulk_create(unread, batch_size=2000)
+    BadgeCounter.objects.bulk_create(counters.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0017_notification_outbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BadgeCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='badge_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread_notifications', models.IntegerField(default=0)),
+                ('unread_messages', models.IntegerField(default=0)),
+                ('pending_claims', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChatUnread',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counts', to='core.chat')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'chat')},
+            },
+        ),
+        migrations.RunPython(backfill_badge_counters, migrations.RunPython.noop),
+    ]
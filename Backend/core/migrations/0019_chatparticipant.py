@@ -0,0 +1,112 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def rename_participants_table(apps, schema_editor):
+    through = apps.get_model('core', 'Chat').participants.through
+    schema_editor.alter_db_table(through, through._meta.db_table, 'core_chatparticipant')
+
+
+def restore_participants_table(apps, schema_editor):
+    through = apps.get_model('core', 'Chat').participants.through
+    schema_editor.alter_db_table(through, 'core_chatparticipant', through._meta.db_table)
+
+
+def backfill_inbox(apps, schema_editor):
+    Chat = apps.get_model('core', 'Chat')
+    ChatMessage = apps.get_model('core', 'ChatMessage')
+    ChatParticipant = apps.get_model('core', 'ChatParticipant')
+    ChatUnread = apps.get_model('core', 'ChatUnread')
+
+    latest = ChatMessage.objects.filter(chat=OuterRef('pk')).order_by('-created_at', '-id')
+    Chat.objects.update(
+        last_message=Subquery(latest.values('pk')[:1]),
+        last_message_text=Coalesce(Subquery(latest.values('message')[:1]), models.Value('')),
+        last_message_sender=Subquery(latest.values('sender')[:1]),
+        last_message_at=Subquery(latest.values('created_at')[:1]),
+    )
+    chat = Chat.objects.filter(pk=OuterRef('chat'))
+    ChatParticipant.objects.update(
+        last_activity_at=Coalesce(Subquery(chat.values('last_message_at')[:1]), Subquery(chat.values('created_at')[:1])),
+        unread_count=Coalesce(Subquery(
+            ChatUnread.objects.filter(chat=OuterRef('chat'), user=OuterRef('user')).values('count')[:1]
+        ), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0018_badge_counters'),
+    ]
+
+    operations = [
+        # Turn the auto-created participants table into the ChatParticipant
+        # through model in place, keeping its rows
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(rename_participants_table, restore_participants_table),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='ChatParticipant',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='core.chat')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_memberships', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'unique_together': {('chat', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='chat',
+                    name='participants',
+                    field=models.ManyToManyField(related_name='chats', through='core.ChatParticipant', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='unread_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='chatparticipant',
+            index=models.Index(fields=['user', '-last_activity_at'], name='chatparticipant_inbox_idx'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.chatmessage'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_text',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='ChatUnread',
+        ),
+    ]
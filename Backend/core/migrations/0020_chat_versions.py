@@ -0,0 +1,49 @@
+from django.db import migrations, models
+
+
+def backfill_versions(apps, schema_editor):
+    Chat = apps.get_model('core', 'Chat')
+    ChatMessage = apps.get_model('core', 'ChatMessage')
+    ChatParticipant = apps.get_model('core', 'ChatParticipant')
+
+    for chat in Chat.objects.only('pk').iterator(chunk_size=500):
+        messages = list(ChatMessage.objects.filter(chat=chat).only('sender', 'is_read').order_by('created_at', 'id'))
+        for version, message in enumerate(messages, start=1):
+            message.version = version
+        ChatMessage.objects.bulk_update(messages, ['version'], batch_size=1000)
+        Chat.objects.filter(pk=chat.pk).update(version=len(messages))
+        # A member has read up to just before the first message from someone else still unread
+        for member in ChatParticipant.objects.filter(chat=chat):
+            unread = next((m.version for m in messages if not m.is_read and m.sender_id != member.user_id), None)
+            member.read_version = len(messages) if unread is None else unread - 1
+            member.save(update_fields=['read_version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_chatparticipant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='read_version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_versions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatmessage',
+            constraint=models.UniqueConstraint(fields=('chat', 'version'), name='chatmessage_chat_version_uniq'),
+        ),
+    ]
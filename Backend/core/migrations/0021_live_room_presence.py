@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:19
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def seed_peaks(apps, schema_editor):
+    # viewer_count only ever grew, counting joins: keep it as the best peak
+    # known and let presence report the live count from now on
+    LiveRoom = apps.get_model('core', 'LiveRoom')
+    LiveRoom.objects.update(peak_viewers=F('viewer_count'))
+    LiveRoom.objects.exclude(status='live').update(viewer_count=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_chat_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='liveroom',
+            name='peak_viewers',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='liveroom',
+            name='viewer_seconds',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(seed_peaks, migrations.RunPython.noop),
+    ]
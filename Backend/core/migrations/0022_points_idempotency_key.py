@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_live_room_presence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vyrapointstransaction',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
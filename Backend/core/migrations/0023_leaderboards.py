@@ -0,0 +1,68 @@
+# Generated by Django 5.2.1 on 2026-10-17 04:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_global_boards(apps, schema_editor):
+    """Everyone's boards from the ledger; rebuild_leaderboards fills the hashtag boards"""
+    LeaderboardDay = apps.get_model('core', 'LeaderboardDay')
+    LeaderboardTotal = apps.get_model('core', 'LeaderboardTotal')
+    VyRaPointsTransaction = apps.get_model('core', 'VyRaPointsTransaction')
+
+    earned = VyRaPointsTransaction.objects.filter(transaction_type='earned')
+    days = earned.annotate(day=TruncDate('created_at')).values('user_id', 'day').annotate(total=Sum('points'))
+    LeaderboardDay.objects.bulk_create(
+        (LeaderboardDay(scope='', day=row['day'], user_id=row['user_id'], points=row['total']) for row in days.iterator()),
+        batch_size=1000,
+    )
+    totals = earned.values('user_id').annotate(total=Sum('points'))
+    LeaderboardTotal.objects.bulk_create(
+        (LeaderboardTotal(scope='', user_id=row['user_id'], points=row['total']) for row in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_points_idempotency_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(blank=True, max_length=50)),
+                ('day', models.DateField()),
+                ('points', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', 'day', '-points'], name='leaderboard_day_rank_idx'), models.Index(fields=['scope', 'updated_at'], name='leaderboard_day_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'user', 'day'), name='leaderboard_day_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LeaderboardTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(blank=True, max_length=50)),
+                ('points', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['scope', '-points'], name='leaderboard_total_rank_idx'), models.Index(fields=['scope', 'updated_at'], name='leaderboard_total_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('scope', 'user'), name='leaderboard_total_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_global_boards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,138 @@
+# Generated by Django 5.2.1 on 2026-10-17 05:14
+
+from datetime import timedelta
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+# Spelled out rather than imported from core.rollups, so later changes there
+# cannot change what this migration does
+LEDGER_TABLE = 'core_vyrapointstransaction'
+MONTHS_AHEAD = 3
+
+
+def copy_idempotency_keys(apps, schema_editor):
+    VyRaPointsTransaction = apps.get_model('core', 'VyRaPointsTransaction')
+    PointsIdempotencyKey = apps.get_model('core', 'PointsIdempotencyKey')
+    keys = VyRaPointsTransaction.objects.filter(idempotency_key__isnull=False).values_list('idempotency_key', flat=True)
+    batch = []
+    for key in keys.iterator(chunk_size=2000):
+        batch.append(PointsIdempotencyKey(key=key))
+        if len(batch) >= 2000:
+            PointsIdempotencyKey.objects.bulk_create(batch)
+            batch = []
+    PointsIdempotencyKey.objects.bulk_create(batch)
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_statements(table, first_month, last_month):
+    statements = []
+    month = first_month.replace(day=1)
+    while month <= last_month:
+        statements.append(
+            f'CREATE TABLE IF NOT EXISTS {LEDGER_TABLE}_p{month:%Y%m} PARTITION OF {table} '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+        )
+        month = next_month(month)
+    return statements
+
+
+def rebuild_ledger_table(schema_editor, partitioned):
+    """Copy the ledger into a new table, partitioned by month on created_at or not, keeping its indexes and keys"""
+    table, new = LEDGER_TABLE, f'{LEDGER_TABLE}_new'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass AND NOT indisprimary',
+            [table],
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT min(created_at) FROM {table}')
+        oldest = cursor.fetchone()[0]
+
+    # INCLUDING IDENTITY: an identity id (BigAutoField) would otherwise lose its default
+    statements = [f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY)']
+    last = timezone.now().date().replace(day=1)
+    for _ in range(MONTHS_AHEAD):
+        last = next_month(last)
+    if partitioned:
+        statements[0] += ' PARTITION BY RANGE (created_at)'
+        # The partition column must be part of the primary key
+        statements.append(f'ALTER TABLE {new} ADD CONSTRAINT {table}_pkey_new PRIMARY KEY (id, created_at)')
+        statements += partition_statements(new, oldest.date() if oldest else timezone.now().date(), last)
+        statements.append(f'CREATE TABLE {table}_default PARTITION OF {new} DEFAULT')
+    else:
+        statements.append(f'ALTER TABLE {new} ADD CONSTRAINT {table}_pkey_new PRIMARY KEY (id)')
+    statements += [
+        # OVERRIDING SYSTEM VALUE keeps the ids of an identity column declared GENERATED ALWAYS
+        f'INSERT INTO {new} OVERRIDING SYSTEM VALUE SELECT * FROM {table}',
+        f'DROP TABLE {table}',  # With its partitions, if it had them
+        f'ALTER TABLE {new} RENAME TO {table}',
+        f'ALTER TABLE {table} RENAME CONSTRAINT {table}_pkey_new TO {table}_pkey',
+        *indexes,  # The old table's names are free again, and the definitions name the table, not its oid
+        *(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}' for name, definition in foreign_keys),
+    ]
+    for sql in statements:
+        schema_editor.execute(sql)
+
+    # The copied identity starts from 1 again: move it past the ids copied over
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+    if sequence:
+        schema_editor.execute(
+            f'SELECT setval(%s, coalesce(max(id), 0) + 1, false) FROM {table}', params=[sequence],
+        )
+
+
+def partition_ledger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild_ledger_table(schema_editor, partitioned=True)
+
+
+def unpartition_ledger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild_ledger_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_leaderboards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointsIdempotencyKey',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(copy_idempotency_keys, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='vyrapointstransaction',
+            name='folded',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='vyrapointstransaction',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='vyrapointstransaction',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        # After the unique key on idempotency_key is gone: a partitioned table could not keep it
+        migrations.RunPython(partition_ledger, unpartition_ledger),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-17 05:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def close_open_groups(apps, schema_editor):
+    # Earlier groups never recorded their actors, so they cannot be counted exactly:
+    # clearing their keys ends them, and later events start new groups
+    Notification = apps.get_model('core', 'Notification')
+    Notification.objects.exclude(group_key='').update(group_key='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_media_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actors', to='core.notification')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('notification', 'user'), name='notificationactor_uniq')],
+            },
+        ),
+        migrations.RunPython(close_open_groups, migrations.RunPython.noop),
+    ]
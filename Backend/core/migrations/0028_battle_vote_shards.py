@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-17 06:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_notification_actors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleVoteShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('participant1_votes', models.IntegerField(default=0)),
+                ('participant2_votes', models.IntegerField(default=0)),
+                ('battle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_shards', to='core.livebattle')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('battle', 'shard'), name='battlevoteshard_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.1 on 2026-10-17 06:26
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def close_duplicate_groups(apps, schema_editor):
+    # Drains running at once could each create a group's row: keep the latest
+    # one open and end the others, as migration 0027 ended uncounted groups
+    Notification = apps.get_model('core', 'Notification')
+    duplicates = (
+        Notification.objects.exclude(group_key='').values('user', 'group_key')
+        .annotate(rows=Count('id')).filter(rows__gt=1).order_by()
+    )
+    for group in duplicates.iterator():
+        rows = Notification.objects.filter(user=group['user'], group_key=group['group_key'])
+        keep = rows.order_by('-created_at', '-id').values_list('id', flat=True)[0]
+        rows.exclude(id=keep).update(group_key='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_battle_vote_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_groups, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('group_key', ''), _negated=True), fields=('user', 'group_key'), name='notification_group_uniq'),
+        ),
+    ]
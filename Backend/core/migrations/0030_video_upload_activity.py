@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-17 06:28
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_last_activity(apps, schema_editor):
+    # An upload was last active when its newest chunk arrived, or when it was started
+    VideoUpload = apps.get_model('core', 'VideoUpload')
+    VideoUpload.objects.update(last_activity_at=Coalesce(
+        Greatest('created_at', models.Subquery(
+            apps.get_model('core', 'VideoUploadChunk').objects.filter(upload=models.OuterRef('pk'))
+            .values('upload').annotate(newest=Max('received_at')).values('newest')
+        )),
+        'created_at',
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_notification_group_uniq'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='videoupload',
+            name='videoupload_created_idx',
+        ),
+        migrations.AddField(
+            model_name='videoupload',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='videoupload',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('assembling', 'Assembling'), ('complete', 'Complete'), ('expired', 'Expired')], default='uploading', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='videoupload',
+            index=models.Index(fields=['status', 'last_activity_at'], name='videoupload_idle_idx'),
+        ),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 import uuid
 from datetime import datetime
 
+from .geo import encode_geohash
+from .trending import WEIGHTS, trending_score
+
 User = get_user_model()
 
 # User Profile Model - matches Flutter UserProfile
@@ -25,6 +29,8 @@ class Profile(models.Model):
     total_buzz = models.IntegerField(default=0)
     vyra_points = models.IntegerField(default=0)
     upload_count = models.IntegerField(default=0)
+    followers_count = models.IntegerField(default=0)  # Denormalized, kept in sync by follow/unfollow
+    following_count = models.IntegerField(default=0)  # Denormalized, kept in sync by follow/unfollow
     is_verified = models.BooleanField(default=False)
     theme_accent = models.CharField(max_length=50, default='Black-Cyan', blank=True)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
@@ -72,10 +78,12 @@ class Video(models.Model):
     location = models.CharField(max_length=100, blank=True, null=True)
     latitude = models.FloatField(null=True, blank=True)  # For Universe Map
     longitude = models.FloatField(null=True, blank=True)  # For Universe Map
+    geohash = models.CharField(max_length=12, blank=True, null=True, editable=False)  # Set on save (core.geo)
     allow_comments = models.BooleanField(default=True)
     allow_duet = models.BooleanField(default=True)
     allow_stitch = models.BooleanField(default=True)
     boost_score = models.IntegerField(default=0)  # For Creator Boost Mode
+    trending_score = models.FloatField(default=0, editable=False)  # Set on save, refreshed by refresh_trending_scores (core.trending)
     collab_type = models.CharField(max_length=20, choices=[
         ('none', 'None'),
         ('split', 'Split Screen'),
@@ -87,9 +95,147 @@ class Video(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the feed (core.pagination.KeysetPagination)
+            models.Index(fields=['-created_at', '-id'], name='video_feed_keyset_idx'),
+            # ?privacy= filter and the public stream of the home feed
+            models.Index(fields=['privacy', '-created_at', '-id'], name='video_privacy_feed_idx'),
+            # ?username= profile grids
+            models.Index(fields=['username', '-created_at'], name='video_username_idx'),
+            # Universe Map: privacy equality plus one geohash range per covering cell. Covers the
+            # coordinates and id so candidate filtering and clustering never touch the table.
+            models.Index(fields=['privacy', 'geohash', 'latitude', 'longitude', 'id'], name='video_privacy_geohash_idx'),
+            # Recommended feed: walk public videos best-first
+            models.Index(fields=['privacy', '-trending_score'], name='video_trending_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+        self.trending_score = trending_score(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if {'latitude', 'longitude'} & update_fields:
+                update_fields.add('geohash')
+            if set(WEIGHTS) & update_fields:
+                update_fields.add('trending_score')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.username} - {self.description[:50]}"
 
+# Resumable video uploads - chunks are kept on disk until the upload is finalized (see core.uploads)
+class VideoUpload(models.Model):
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('assembling', 'Assembling'),
+        ('complete', 'Complete'),
+        ('expired', 'Expired'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='video_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    checksum = models.CharField(max_length=64, blank=True)  # SHA-256 of the whole file, hex, if the client sent one
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    video = models.OneToOneField(Video, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_activity_at = models.DateTimeField(default=timezone.now)  # Last chunk started, or finalize given up
+
+    class Meta:
+        indexes = [
+            # purge_video_uploads: uploads left idle
+            models.Index(fields=['status', 'last_activity_at'], name='videoupload_idle_idx'),
+        ]
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def __str__(self):
+        return f"{self.user_id} - {self.filename} ({self.status})"
+
+class VideoUploadChunk(models.Model):
+    upload = models.ForeignKey(VideoUpload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    checksum = models.CharField(max_length=64)  # SHA-256, hex
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['upload', 'index'], name='videouploadchunk_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.upload_id} #{self.index}"
+
+# Media processing job - poster, preview, probe and HLS renditions of an uploaded video (see core.media)
+class MediaJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, primary_key=True, related_name='media_job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    duration = models.FloatField(null=True, blank=True)  # Seconds
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    poster = models.CharField(max_length=255, blank=True)  # Paths under MEDIA_ROOT
+    preview = models.CharField(max_length=255, blank=True)
+    hls_manifest = models.CharField(max_length=255, blank=True)
+    renditions = models.JSONField(default=list, blank=True)  # [{height, width, bitrate, playlist}], best first
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest queued job, and reclaim stale running ones
+            models.Index(fields=['status', 'created_at'], name='mediajob_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.video_id} ({self.status})"
+
+# Home Timeline Entry - fan-out-on-write copy of a followed author's video
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='timeline_entries')
+    created_at = models.DateTimeField()  # Copy of video.created_at so the feed is one index range scan
+
+    class Meta:
+        unique_together = ('user', 'video')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-video'], name='timeline_user_feed_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} <- {self.video_id}"
+
+# Interest Profile - decayed hashtag/creator affinities for recommendations (see core.interests)
+class InterestProfile(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='interest_profile')
+    hashtags = models.JSONField(default=dict)  # {hashtag_id: weight as of as_of}
+    creators = models.JSONField(default=dict)  # {user_id: weight as of as_of}
+    as_of = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Interests of {self.user.username}"
+
 # Hashtag Model
 class Hashtag(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -179,6 +325,15 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-boost_score', '-created_at'], name='product_boost_idx'),
+            models.Index(
+                fields=['-boost_score', '-created_at'], condition=models.Q(is_promoted=True),
+                name='product_promoted_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -235,11 +390,53 @@ class Notification(models.Model):
     video = models.ForeignKey(Video, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
     battle = models.ForeignKey(Battle, on_delete=models.CASCADE, null=True, blank=True, related_name='notifications')
     is_read = models.BooleanField(default=False)
+    # Coalesced notifications ("X and N others liked your video", see core.notifications):
+    # how many users acted, and the (type, video, time window) group the row collects
+    actor_count = models.IntegerField(default=1)
+    group_key = models.CharField(max_length=100, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_user_feed_idx'),
+            models.Index(fields=['user', 'group_key'], name='notification_group_idx'),
+            # Unread rows only, so the index stays small as users read their notifications
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='notification_unread_idx'),
+        ]
+        constraints = [
+            # One row per open group, whichever drain creates it first
+            models.UniqueConstraint(
+                fields=['user', 'group_key'], condition=~models.Q(group_key=''), name='notification_group_uniq',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.notification_type}"
 
+# Notification Actor - the distinct users a coalesced notification counts (see core.notifications)
+class NotificationActor(models.Model):
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actors')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'user'], name='notificationactor_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} on {self.notification_id}"
+
+# Notification Event - outbox of notification triggers, coalesced into Notification rows in batches
+class NotificationEvent(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    notification_type = models.CharField(max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.notification_type} for {self.user_id}"
+
 # VyRaPoints Transaction Model
 class VyRaPointsTransaction(models.Model):
     TRANSACTION_TYPES = [
@@ -256,21 +453,105 @@ class VyRaPointsTransaction(models.Model):
     description = models.TextField(blank=True)
     video = models.ForeignKey(Video, on_delete=models.SET_NULL, null=True, blank=True)
     battle = models.ForeignKey(Battle, on_delete=models.SET_NULL, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set for awards and spends that must happen once; enforced by PointsIdempotencyKey (see core.points)
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)
+    # Number of rows this one sums up, once rolled up (see core.rollups); 0 for an ordinary row
+    folded = models.PositiveIntegerField(default=0)
+    # Not auto_now_add: summary rows keep the day of the rows they replace
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='points_user_history_idx'),
+            # rebuild_leaderboards: equality on type first, then the time range
+            models.Index(fields=['transaction_type', 'created_at'], name='points_type_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.transaction_type} - {self.points} points"
 
+# Idempotency keys of ledger rows - apart from the ledger, which is partitioned on
+# PostgreSQL and so cannot hold a unique key without created_at (see core.rollups)
+class PointsIdempotencyKey(models.Model):
+    key = models.CharField(max_length=100, primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.key
+
+# Leaderboard aggregates - earned VyRa Points per scope and day, and all-time (see core.leaderboards)
+class LeaderboardDay(models.Model):
+    scope = models.CharField(max_length=50, blank=True)  # '' for everyone, 'hashtag:<id>'
+    day = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    points = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # User before day: a club board looks up each member's last seven days
+            models.UniqueConstraint(fields=['scope', 'user', 'day'], name='leaderboard_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['scope', 'day', '-points'], name='leaderboard_day_rank_idx'),
+            # Incremental sync of the in-memory boards
+            models.Index(fields=['scope', 'updated_at'], name='leaderboard_day_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.scope or 'all'} {self.day}: {self.points}"
+
+class LeaderboardTotal(models.Model):
+    scope = models.CharField(max_length=50, blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    points = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'user'], name='leaderboard_total_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['scope', '-points'], name='leaderboard_total_rank_idx'),
+            models.Index(fields=['scope', 'updated_at'], name='leaderboard_total_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.scope or 'all'}: {self.points}"
+
 # Chat Model
 class Chat(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    participants = models.ManyToManyField(User, related_name='chats')
+    participants = models.ManyToManyField(User, related_name='chats', through='ChatParticipant')
+    # Denormalized latest message, so the inbox needs no per-chat message query (see core.chats)
+    last_message = models.ForeignKey('ChatMessage', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_text = models.TextField(blank=True)
+    last_message_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    version = models.BigIntegerField(default=0)  # Last change version handed out: messages and reads, for sync
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Chat: {', '.join([p.username for p in self.participants.all()])}"
 
+# Chat Participant - a user's membership of a chat, with their unread count and the chat's last activity
+class ChatParticipant(models.Model):
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='members')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_memberships')
+    unread_count = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)  # Copied from the chat, for the inbox index
+    read_version = models.BigIntegerField(default=0)  # Chat version this member has read up to
+
+    class Meta:
+        unique_together = ('chat', 'user')
+        indexes = [
+            models.Index(fields=['user', '-last_activity_at'], name='chatparticipant_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.chat_id}"
+
 # Chat Message Model
 class ChatMessage(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -278,8 +559,17 @@ class ChatMessage(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     message = models.TextField()
     is_read = models.BooleanField(default=False)
+    version = models.BigIntegerField(default=0)  # Position in the chat, from Chat.version (see core.chats)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['chat', '-created_at', '-id'], name='chatmessage_chat_history_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['chat', 'version'], name='chatmessage_chat_version_uniq'),
+        ]
+
     def __str__(self):
         return f"{self.sender.username}: {self.message[:50]}"
 
@@ -301,6 +591,11 @@ class Status(models.Model):
     ask_me_anything = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='status_expires_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s status"
 
@@ -461,7 +756,9 @@ class LiveRoom(models.Model):
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='scheduled')
-    viewer_count = models.IntegerField(default=0)
+    viewer_count = models.IntegerField(default=0)  # Snapshot of the live count (core.presence)
+    peak_viewers = models.IntegerField(default=0)
+    viewer_seconds = models.BigIntegerField(default=0)  # Audience integrated over time, for the average
     started_at = models.DateTimeField(null=True, blank=True)
     ended_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -483,6 +780,19 @@ class LiveBattle(models.Model):
     def __str__(self):
         return f"Live Battle: {self.participant1.username} vs {self.participant2.username}"
 
+# Battle Vote Shard - votes not yet added to LiveBattle's tallies, spread over
+# BATTLE_VOTE_SHARDS rows per battle so concurrent votes rarely wait on one row (see core.battles)
+class BattleVoteShard(models.Model):
+    battle = models.ForeignKey(LiveBattle, on_delete=models.CASCADE, related_name='vote_shards')
+    shard = models.PositiveSmallIntegerField()
+    participant1_votes = models.IntegerField(default=0)
+    participant2_votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['battle', 'shard'], name='battlevoteshard_uniq'),
+        ]
+
 # Sound Library
 class Sound(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -496,6 +806,11 @@ class Sound(models.Model):
     usage_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-usage_count', '-created_at'], name='sound_popular_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -554,3 +869,49 @@ class VideoAnalytics(models.Model):
 
     def __str__(self):
         return f"Analytics for {self.video.id}"
+
+# Write-behind counter flush journal (see core.counters.CounterBuffer)
+class CounterFlushBatch(models.Model):
+    batch_id = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.batch_id
+
+# Search Document - denormalized text of a video/profile/hashtag for full-text search (see core.search)
+class SearchDocument(models.Model):
+    KINDS = [
+        ('video', 'Video'),
+        ('profile', 'Profile'),
+        ('hashtag', 'Hashtag'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.CharField(max_length=64)
+    title = models.TextField(blank=True)  # Username / display name / tag; ranked higher, used for autocomplete
+    body = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id}"
+
+# Badge Counter - a user's maintained unread/pending counts, served by /api/badges/ (see core.badges)
+class BadgeCounter(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='badge_counter')
+    unread_notifications = models.IntegerField(default=0)
+    unread_messages = models.IntegerField(default=0)  # Across all chats; per chat in ChatParticipant
+    pending_claims = models.IntegerField(default=0)  # Completed, unclaimed challenges
+
+    def __str__(self):
+        return f"Badges for {self.user_id}"
+
+# Job Checkpoint - where an incremental maintenance command left off
+class JobCheckpoint(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    last_run_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_run_at}"
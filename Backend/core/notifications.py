@@ -0,0 +1,215 @@
+"""Asynchronous, coalesced notifications.
+
+Likes, buzzes, comments and follows do not write Notification rows in the
+request. ``notify()`` appends a NotificationEvent to an outbox table in the
+caller's transaction, so an event exists exactly when its like/follow
+committed. After commit, a worker thread is woken; it waits
+NOTIFICATION_BATCH_DELAY seconds so a burst lands in one batch, then drains
+the outbox.
+
+Draining coalesces events per (recipient, type, video, time window) into a
+single row: "ada and 241 others liked your video". Windows are fixed
+NOTIFICATION_COALESCE_MINUTES buckets, so the group a row collects can be
+found by key. A group's distinct actors are kept in NotificationActor and
+counted from there, so someone liking again is not counted twice. A group
+has one row (notification_group_uniq): when drains in two processes both
+create it, the later one's batch fails on the constraint and is retried
+against the row the other wrote. A batch
+of events costs one lookup of existing groups, one bulk_create each of
+notifications and actors, one count of the existing groups' actors and one
+bulk_update, however viral the video. The process_notifications command
+drains anything left behind (for example by a restarted process) and
+serves deployments that turn the thread off. Each written notification is
+pushed to the recipient's open sockets (core.realtime) when the batch
+commits.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+
+from . import badges, realtime
+from .models import Notification, NotificationActor, NotificationEvent
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+VERBS = {
+    'like': 'liked your video',
+    'buzz': 'buzzed your video',
+    'comment': 'commented on your video',
+    'follow': 'started following you',
+}
+
+
+class ConcurrentDrain(Exception):
+    """Another drainer claimed some of the same events, or created one of the groups; the batch is retried"""
+
+
+def window_seconds():
+    return getattr(settings, 'NOTIFICATION_COALESCE_MINUTES', 60) * 60
+
+
+def group_key(notification_type, video_id, at):
+    return f'{notification_type}:{video_id or ""}:{int(at.timestamp() // window_seconds())}'
+
+
+def message(notification_type, actor_username, actor_count):
+    verb = VERBS.get(notification_type, notification_type)
+    if actor_count <= 1:
+        return f'{actor_username} {verb}'
+    others = actor_count - 1
+    return f'{actor_username} and {others} other{"s" if others > 1 else ""} {verb}'
+
+
+def coalesce(events):
+    """Group events by (recipient, group key): distinct actors and the latest event"""
+    groups = {}
+    for event in events:
+        key = (event.user_id, group_key(event.notification_type, event.video_id, event.created_at))
+        group = groups.setdefault(key, {'actors': {}, 'latest': event})
+        group['actors'][event.from_user_id] = event.from_user.username
+        group['latest'] = event
+    return groups
+
+
+class NotificationOutbox:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def notify(self, user_id, from_user, notification_type, video=None):
+        """Queue a notification in the current transaction; self-notifications are skipped"""
+        if user_id == from_user.pk:
+            return
+        NotificationEvent.objects.create(
+            user_id=user_id, from_user=from_user, notification_type=notification_type, video=video
+        )
+        transaction.on_commit(self.wake)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'NOTIFICATION_BATCH_SIZE', 1000)
+
+    def wake(self):
+        if not getattr(settings, 'NOTIFICATION_WORKER_THREAD', True):
+            return  # Drained by the process_notifications command
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-outbox', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(getattr(settings, 'NOTIFICATION_BATCH_DELAY', 1.0))  # Let a burst pile up
+            self._wakeup.clear()
+            try:
+                self.drain_all()
+            except Exception:
+                logger.exception('Draining the notification outbox failed')
+            finally:
+                connection.close()
+
+    def drain_all(self):
+        """Drain until the outbox is empty. Returns the number of events processed."""
+        total = 0
+        while True:
+            try:
+                drained = self.drain()
+            except ConcurrentDrain:
+                continue
+            total += drained
+            if drained < self.batch_size:
+                return total
+
+    def drain(self):
+        """Coalesce one batch of events into notifications. Returns the number of events processed."""
+        with transaction.atomic():
+            events = NotificationEvent.objects.select_related('from_user').only(
+                'user', 'notification_type', 'video', 'created_at', 'from_user__username'
+            ).order_by('id')
+            if connection.features.has_select_for_update_skip_locked:
+                events = events.select_for_update(skip_locked=True, of=('self',))
+            events = list(events[:self.batch_size])
+            if not events:
+                return 0
+            # Deleting first claims the batch: a concurrent drainer deletes fewer rows than it read
+            deleted, _ = NotificationEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+            if deleted != len(events):
+                raise ConcurrentDrain()
+            try:
+                self._write(coalesce(events))
+            except IntegrityError:
+                raise ConcurrentDrain()  # The whole batch rolls back, events included
+        return len(events)
+
+    def _existing_groups(self, groups):
+        return {
+            (notification.user_id, notification.group_key): notification
+            for notification in Notification.objects.filter(
+                user_id__in={user_id for user_id, _ in groups},
+                group_key__in={key for _, key in groups},
+            )
+        }
+
+    def _write(self, groups):
+        existing = self._existing_groups(groups)
+        created, updated = [], []
+        newly_unread = {}
+        for (user_id, key), group in groups.items():
+            latest = group['latest']
+            actors = group['actors']
+            notification = existing.get((user_id, key))
+            if notification is None:
+                notification = Notification(
+                    user_id=user_id, notification_type=latest.notification_type, video_id=latest.video_id,
+                    group_key=key, actor_count=len(actors),
+                )
+                created.append(notification)
+                newly_unread[user_id] = newly_unread.get(user_id, 0) + 1
+            else:
+                if notification.is_read:
+                    newly_unread[user_id] = newly_unread.get(user_id, 0) + 1
+                notification.is_read = False
+                notification.created_at = latest.created_at  # Resurface the group in the feed
+                updated.append(notification)
+            notification.from_user_id = latest.from_user_id
+            notification.latest_actor = actors[latest.from_user_id]
+            notification.group_actors = actors
+        Notification.objects.bulk_create(self._with_messages(created))
+        # Every distinct actor is recorded once per group, so repeat likes (or unlike and
+        # like again) and concurrent drains never inflate the count
+        NotificationActor.objects.bulk_create([
+            NotificationActor(notification=notification, user_id=actor_id)
+            for notification in created + updated for actor_id in notification.group_actors
+        ], ignore_conflicts=True)
+        if updated:
+            counts = dict(
+                NotificationActor.objects.filter(notification__in=updated)
+                .values('notification').annotate(actors=Count('id')).values_list('notification', 'actors')
+            )
+            for notification in updated:
+                notification.actor_count = counts[notification.pk]
+        Notification.objects.bulk_update(
+            self._with_messages(updated), ['from_user', 'message', 'actor_count', 'is_read', 'created_at']
+        )
+        badges.notifications_unread(newly_unread)
+        for notification in created + updated:
+            realtime.publish(realtime.user_group(notification.user_id), {
+                'type': 'notification', 'notification': NotificationSerializer(notification).data,
+            })
+
+    def _with_messages(self, notifications):
+        for notification in notifications:
+            notification.message = message(notification.notification_type, notification.latest_actor,
+                                            notification.actor_count)
+        return notifications
+
+
+notifications = NotificationOutbox()
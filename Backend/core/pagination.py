@@ -0,0 +1,172 @@
+import base64
+import json
+import math
+from datetime import datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination keyed on a unique ordering such as (created_at, id).
+
+    Each page is a range scan starting right after the last row of the
+    previous page, so page N costs the same as page 1 and rows inserted while
+    the client scrolls never shift or duplicate items. Cursors are opaque
+    base64 tokens. Views may override the ordering with ``keyset_ordering``.
+    Cursor values are parsed with their model fields before they reach a
+    query, so a forged cursor is a 404 rather than a database error.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        queryset = queryset.order_by(*ordering)
+
+        def fetch(position, limit):
+            rows = queryset
+            if position is not None:
+                rows = rows.filter(keyset_condition(ordering, position))
+            return list(rows[:limit])
+
+        return self.paginate_source(fetch, request, view, model=queryset.model)
+
+    def paginate_source(self, fetch, request, view=None, model=None):
+        """Paginate any row source: ``fetch(position, limit)`` returns up to
+        ``limit`` rows strictly after ``position`` (None for the first page)
+        in keyset order. Cursor values are typed by ``model``'s fields
+        (the view's model by default); others must be numbers."""
+        self.request = request
+        self.ordering = getattr(view, 'keyset_ordering', self.ordering)
+        self.page_size = self.get_page_size(request)
+        if model is None:
+            model = getattr(getattr(view, 'queryset', None), 'model', None)
+
+        results = fetch(self.decode_cursor(request, model), self.page_size + 1)
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE or 20
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+            if requested > 0:
+                page_size = min(requested, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return page_size
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        last = self.page[-1]
+        position = [self._field_value(last, field) for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position))
+
+    def _field_value(self, obj, field):
+        value = getattr(obj, field.lstrip('-'))
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, (int, float)):
+            return value
+        return str(value)
+
+    def encode_cursor(self, position):
+        raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request, model=None):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return [self._parse_value(model, field.lstrip('-'), value) for field, value in zip(self.ordering, position)]
+
+    def _parse_value(self, model, name, value):
+        """A cursor value as its field's type; NotFound if it does not fit the field"""
+        if value is None or isinstance(value, (bool, list, dict)):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            field = model._meta.get_field(name) if model is not None else None
+        except FieldDoesNotExist:
+            field = None
+        if field is None:
+            # Computed orderings (e.g. distance) are numbers
+            if not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise NotFound(self.invalid_cursor_message)
+            return value
+        try:
+            parsed = field.to_python(value)
+            field.run_validators(parsed)
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+        if parsed is None or (isinstance(parsed, datetime) and timezone.is_naive(parsed)):
+            raise NotFound(self.invalid_cursor_message)  # Issued cursors always carry an offset
+        if isinstance(parsed, float) and not math.isfinite(parsed):
+            raise NotFound(self.invalid_cursor_message)
+        return parsed
+
+
+def keyset_condition(ordering, position):
+    """Rows strictly after ``position`` in ``ordering`` (row-value comparison spelled out).
+
+    The OR-expansion is wrapped in an inclusive bound on the leading column so
+    the database can turn it into an index range scan.
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': position[index]})
+        for previous_field, previous_value in zip(ordering[:index], position[:index]):
+            step &= Q(**{previous_field.lstrip('-'): previous_value})
+        condition |= step
+    leading = ordering[0]
+    bound = 'lte' if leading.startswith('-') else 'gte'
+    return Q(**{f'{leading.lstrip("-")}__{bound}': position[0]}) & condition
+
+
+def wants_cursor(request):
+    """True when the client opted into keyset pagination by sending ?cursor= (empty for page 1)"""
+    return KeysetPagination.cursor_query_param in request.query_params
+
+
+class FeedPagination(PageNumberPagination):
+    """Page-number pagination by default, keyset pagination when the client sends ?cursor="""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if wants_cursor(request):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,193 @@
+"""VyRa Points ledger.
+
+Every change to a balance goes through here, so that ``Profile.vyra_points``
+always equals the sum of the user's VyRaPointsTransaction rows (the
+reconcile_points command checks that it does):
+
+- ``award`` / ``spend`` write the ledger row and move the balance in one
+  transaction. A spend is a conditional UPDATE
+  (``vyra_points = vyra_points - n WHERE vyra_points >= n``), so concurrent
+  spends can never overdraw; it raises InsufficientPoints instead.
+- Both take an optional idempotency key, recorded on the ledger row and
+  held unique in PointsIdempotencyKey: a repeated award or spend with the
+  same key is a no-op. Use one for anything a retry or a double tap could
+  repeat (claims, purchases, boosts).
+- ``award_later`` is for high-frequency micro-awards (a point per like or
+  share). Awards are buffered per user and reason in a CounterBuffer and
+  flushed together: one balance UPDATE per user and one ledger row per user
+  and reason, instead of two writes per tap.
+
+Earned points are also added to the leaderboards (core.leaderboards) in the
+same transaction, for everyone and for the hashtags of the video they were
+earned on.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import leaderboards
+from .counters import CounterBuffer
+from .models import PointsIdempotencyKey, Profile, VyRaPointsTransaction
+
+UPLOAD_POINTS = 10
+# Micro-award reasons: points per action, and the ledger description of a batch
+MICRO_AWARDS = {
+    'like': (1, 'Liked videos'),
+    'share': (1, 'Shared videos'),
+    'buzz': (3, 'Buzzed videos'),
+    'comment': (2, 'Commented on videos'),
+}
+
+
+class InsufficientPoints(Exception):
+    pass
+
+
+def _balance(user_id):
+    return Profile.objects.filter(user_id=user_id).values_list('vyra_points', flat=True).first() or 0
+
+
+def _claim(key):
+    """Record an idempotency key; IntegrityError if it was used before"""
+    if key is not None:
+        PointsIdempotencyKey.objects.create(key=key)
+
+
+def _already_recorded(key):
+    return key is not None and PointsIdempotencyKey.objects.filter(key=key).exists()
+
+
+def reserve(user_id, points):
+    """Take points from a balance if it covers them; False (and nothing taken) otherwise.
+
+    Writes no ledger row: use ``spend``, which records one in the same transaction.
+    """
+    return bool(Profile.objects.filter(user_id=user_id, vyra_points__gte=points).update(
+        vyra_points=F('vyra_points') - points
+    ))
+
+
+def award(user_id, points, description, transaction_type='earned', key=None, **links):
+    """Add points and their ledger row. Returns False if ``key`` was already used."""
+    try:
+        with transaction.atomic():
+            _claim(key)
+            VyRaPointsTransaction.objects.create(
+                user_id=user_id, points=points, transaction_type=transaction_type,
+                description=description, idempotency_key=key, **links
+            )
+            Profile.objects.filter(user_id=user_id).update(vyra_points=F('vyra_points') + points)
+            if transaction_type == 'earned':
+                _rank(user_id, points, links.get('video'))
+    except IntegrityError:
+        if _already_recorded(key):
+            return False
+        raise
+    return True
+
+
+def _rank(user_id, points, video=None):
+    """Add earned points to the leaderboards"""
+    boards = {(leaderboards.EVERYONE, user_id): points}
+    if video is not None:
+        for scope in leaderboards.video_hashtag_scopes([str(video.pk)]).get(str(video.pk), ()):
+            boards[(scope, user_id)] = points
+    leaderboards.record(boards)
+
+
+def spend(user_id, points, description, key=None, **links):
+    """Take points and write their ledger row. Returns False if ``key`` was already used.
+
+    Raises InsufficientPoints, with nothing written, if the balance does not
+    cover them.
+    """
+    try:
+        with transaction.atomic():
+            _claim(key)
+            VyRaPointsTransaction.objects.create(
+                user_id=user_id, points=-points, transaction_type='spent',
+                description=description, idempotency_key=key, **links
+            )
+            if not reserve(user_id, points):
+                raise InsufficientPoints
+    except IntegrityError:
+        if _already_recorded(key):
+            return False
+        raise
+    return True
+
+
+VIDEO = '@'  # Buffered field prefix for the points a user earned on one video: @<video id>
+
+
+class PointsAwardBuffer(CounterBuffer):
+    """Micro-awards per user (the buffer's pk is the user id): counts per reason, points per video"""
+
+    model = Profile
+    FIELDS = tuple(MICRO_AWARDS)
+    settings_prefix = 'POINTS_AWARD'
+
+    def __init__(self, key_prefix='points-award', **kwargs):
+        super().__init__(key_prefix=key_prefix, **kwargs)
+
+    def _check_field(self, field):
+        if not field.startswith(VIDEO):
+            super()._check_field(field)
+
+    def _write(self, updates):
+        ledger = []
+        boards = defaultdict(int)
+        hashtags = leaderboards.video_hashtag_scopes(
+            {field[len(VIDEO):] for fields in updates.values() for field in fields if field.startswith(VIDEO)}
+        )
+        for user_id, fields in updates.items():
+            user_id = int(user_id)
+            total = 0
+            for field, amount in fields.items():
+                if field.startswith(VIDEO):
+                    for scope in hashtags.get(field[len(VIDEO):], ()):
+                        boards[(scope, user_id)] += amount
+                    continue
+                points = MICRO_AWARDS[field][0] * amount
+                total += points
+                ledger.append(VyRaPointsTransaction(
+                    user_id=user_id, points=points, transaction_type='earned',
+                    description=f'{MICRO_AWARDS[field][1]} ({amount})',
+                ))
+            Profile.objects.filter(user_id=user_id).update(vyra_points=F('vyra_points') + total)
+            boards[(leaderboards.EVERYONE, user_id)] += total
+        VyRaPointsTransaction.objects.bulk_create(ledger)
+        leaderboards.record(boards)
+
+    def pending_points(self, user_id):
+        return sum(MICRO_AWARDS[reason][0] * count for reason, count in self.pending(user_id).items())
+
+
+point_awards = PointsAwardBuffer()
+
+
+def award_later(user_id, reason, video_id=None):
+    """Buffer a micro-award, earned on a video (for its hashtags' leaderboards), once the transaction commits"""
+    if reason not in MICRO_AWARDS:
+        raise ValueError(f'Unknown micro-award: {reason}')
+    deltas = {reason: 1}
+    if video_id is not None:
+        deltas[f'{VIDEO}{video_id}'] = MICRO_AWARDS[reason][0]
+    transaction.on_commit(lambda: point_awards.add_many(user_id, deltas))
+
+
+def balance(user_id):
+    """Stored balance plus micro-awards not yet flushed"""
+    return _balance(user_id) + point_awards.pending_points(user_id)
+
+
+def drifted_balances():
+    """Profiles whose balance differs from the sum of their ledger, annotated with ``ledger_total``"""
+    ledger_total = VyRaPointsTransaction.objects.filter(user_id=OuterRef('user_id')).values('user_id').annotate(
+        total=Sum('points')
+    ).values('total')
+    return Profile.objects.annotate(
+        ledger_total=Coalesce(Subquery(ledger_total, output_field=IntegerField()), Value(0))
+    ).filter(~Q(vyra_points=F('ledger_total')))
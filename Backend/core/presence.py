@@ -0,0 +1,239 @@
+"""Live room viewer presence.
+
+Viewers are tracked in memory, per process, from heartbeats: an open
+/ws/live/<room>/ socket (core.realtime) heartbeats on connect and then every
+PRESENCE_TTL_SECONDS / 2 from the server while it stays open, and clients
+without a socket POST join_viewer/heartbeat about as often. A viewer who
+stops heartbeating drops out after PRESENCE_TTL_SECONDS.
+
+A room counts each viewer's open sockets, so a viewer watching from two tabs
+leaves only when the last of them closes.
+
+Rooms are spread over PRESENCE_SHARDS shards, each with its own lock, so
+heartbeats for different rooms do not contend. Within a room, viewers sit in
+an OrderedDict in heartbeat order: a heartbeat moves its viewer to the end,
+so expired viewers are always at the front and expiry costs nothing for
+viewers still present.
+
+The LiveRoom row is written only by a flusher thread, once every
+PRESENCE_FLUSH_SECONDS for each room with viewers (or that just lost its
+last): the current viewer_count, peak_viewers (never lowered) and
+viewer_seconds (added to; divided by the stream's duration it gives the
+average audience). When the count changed, the same pass pushes it to the
+room's sockets.
+
+Like the in-memory channel layer, this suits a single ASGI process: with
+several workers, each counts only the viewers whose heartbeats reach it.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from . import realtime
+from .models import LiveRoom
+
+logger = logging.getLogger(__name__)
+
+
+class RoomPresence:
+    __slots__ = ('viewers', 'sockets', 'peak', 'viewer_seconds', 'changed_at', 'flushed_count', 'dirty')
+
+    def __init__(self, now):
+        self.viewers = OrderedDict()  # user_id -> expiry, oldest heartbeat first
+        self.sockets = {}  # user_id -> open sockets
+        self.peak = 0
+        self.viewer_seconds = 0.0  # Accumulated since the last flush
+        self.changed_at = now
+        self.flushed_count = None
+        self.dirty = False
+
+    def _account(self, now):
+        """Add the audience since the last change to viewer_seconds"""
+        self.viewer_seconds += len(self.viewers) * max(0.0, now - self.changed_at)
+        self.changed_at = max(self.changed_at, now)
+
+    def expire(self, now):
+        while self.viewers:
+            user_id, expiry = next(iter(self.viewers.items()))
+            if expiry > now:
+                break
+            self._account(expiry)  # They watched until their heartbeat ran out
+            del self.viewers[user_id]
+            self.dirty = True
+
+    def heartbeat(self, user_id, now, ttl):
+        self.expire(now)
+        if user_id not in self.viewers:
+            self._account(now)
+            self.dirty = True
+        self.viewers[user_id] = now + ttl
+        self.viewers.move_to_end(user_id)
+        self.peak = max(self.peak, len(self.viewers))
+        return len(self.viewers)
+
+    def leave(self, user_id, now):
+        self.expire(now)
+        if user_id in self.viewers:
+            self._account(now)
+            del self.viewers[user_id]
+            self.dirty = True
+        return len(self.viewers)
+
+    def connect(self, user_id, now, ttl):
+        self.sockets[user_id] = self.sockets.get(user_id, 0) + 1
+        return self.heartbeat(user_id, now, ttl)
+
+    def disconnect(self, user_id, now):
+        """Close one of the viewer's sockets; they leave with the last one"""
+        remaining = self.sockets.get(user_id, 0) - 1
+        if remaining > 0:
+            self.sockets[user_id] = remaining
+            self.expire(now)
+            return len(self.viewers)
+        self.sockets.pop(user_id, None)
+        return self.leave(user_id, now)
+
+    def snapshot(self, now):
+        """(count, peak, whole viewer-seconds since the last snapshot, whether the count changed)"""
+        self._account(now)
+        seconds = int(self.viewer_seconds)
+        self.viewer_seconds -= seconds
+        changed = len(self.viewers) != self.flushed_count
+        self.dirty = False
+        self.flushed_count = len(self.viewers)
+        return len(self.viewers), self.peak, seconds, changed
+
+
+class Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rooms = {}
+
+
+class Presence:
+    """Sharded viewer sets for every live room this process sees"""
+
+    def __init__(self, shards=None):
+        self.shards = [Shard() for _ in range(shards or getattr(settings, 'PRESENCE_SHARDS', 16))]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'PRESENCE_TTL_SECONDS', 30)
+
+    def _shard(self, room_id):
+        return self.shards[hash(str(room_id)) % len(self.shards)]
+
+    def _joined(self, room_id, user_id, method):
+        self._start_flusher()
+        shard = self._shard(room_id)
+        now = time.monotonic()
+        with shard.lock:
+            room = shard.rooms.get(str(room_id))
+            if room is None:
+                room = shard.rooms[str(room_id)] = RoomPresence(now)
+            return getattr(room, method)(user_id, now, self.ttl)
+
+    def _left(self, room_id, user_id, method):
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(str(room_id))
+            return getattr(room, method)(user_id, time.monotonic()) if room else 0
+
+    def heartbeat(self, room_id, user_id):
+        """Mark a user as watching; returns the room's live viewer count"""
+        return self._joined(room_id, user_id, 'heartbeat')
+
+    def leave(self, room_id, user_id):
+        return self._left(room_id, user_id, 'leave')
+
+    def connect(self, room_id, user_id):
+        """A viewer's socket opened; heartbeat() it while it stays open"""
+        return self._joined(room_id, user_id, 'connect')
+
+    def disconnect(self, room_id, user_id):
+        return self._left(room_id, user_id, 'disconnect')
+
+    def count(self, room_id, default=None):
+        """Live viewer count, or ``default`` for a room this process is not tracking"""
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(str(room_id))
+            if room is None:
+                return default
+            room.expire(time.monotonic())
+            return len(room.viewers)
+
+    def stats(self, room_id):
+        """Live count and peak as this process sees them (None when untracked)"""
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.get(str(room_id))
+            if room is None:
+                return None
+            room.expire(time.monotonic())
+            return {'viewerCount': len(room.viewers), 'peakViewers': room.peak}
+
+    def flush(self):
+        """Expire stale viewers and write snapshots of changed rooms. Returns the number of rooms written."""
+        now = time.monotonic()
+        snapshots = {}
+        for shard in self.shards:
+            with shard.lock:
+                for room_id, room in list(shard.rooms.items()):
+                    room.expire(now)
+                    if room.dirty or room.viewer_seconds >= 1:
+                        snapshots[room_id] = room.snapshot(now)
+                    elif not room.viewers and not room.sockets:
+                        del shard.rooms[room_id]  # Idle and fully written
+        self._write(snapshots)
+        return len(snapshots)
+
+    def close(self, room_id):
+        """Stop tracking a room (it ended), writing its final snapshot with no viewers"""
+        shard = self._shard(room_id)
+        with shard.lock:
+            room = shard.rooms.pop(str(room_id), None)
+            if room is None:
+                return
+            _, peak, seconds, _ = room.snapshot(time.monotonic())
+        self._write({str(room_id): (0, peak, seconds, True)})
+
+    def _write(self, snapshots):
+        for room_id, (count, peak, seconds, changed) in snapshots.items():
+            LiveRoom.objects.filter(pk=room_id).update(
+                viewer_count=count, peak_viewers=Greatest(F('peak_viewers'), peak),
+                viewer_seconds=F('viewer_seconds') + seconds,
+            )
+            if changed:
+                realtime.publish(realtime.live_group(room_id), {
+                    'type': 'viewers', 'viewerCount': count, 'peakViewers': peak,
+                })
+
+    def _start_flusher(self):
+        if self._thread is not None or not getattr(settings, 'PRESENCE_FLUSH_THREAD', True):
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='presence-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(getattr(settings, 'PRESENCE_FLUSH_SECONDS', 5.0))
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing live room presence failed')
+            finally:
+                connection.close()
+
+
+presence = Presence()
@@ -0,0 +1,345 @@
+"""Real-time delivery over WebSockets.
+
+VyRa/asgi.py hands WebSocket connections to ``websocket_application``;
+HTTP still goes to Django. Each socket follows one group:
+
+- ``/ws/chats/<chat id>/``: new messages and reads in a chat (members only)
+- ``/ws/notifications/``: the user's notifications
+- ``/ws/live/<room id>/``: battle votes and viewer counts in a live room; the
+  server heartbeats the socket's viewer (core.presence) every
+  PRESENCE_TTL_SECONDS / 2 until it closes
+
+Clients authenticate with their API token, as ``?token=`` (browsers cannot
+set headers on a WebSocket request) or an ``Authorization: Token`` header.
+
+Views call ``publish(group, event)``; the event goes out once their
+transaction commits, encoded once however many sockets receive it, through
+the channel layer named by REALTIME_CHANNEL_LAYER. InMemoryChannelLayer
+delivers to the sockets of its own process, which suits a single ASGI
+worker. RedisChannelLayer relays every publish through Redis pub/sub, so
+any worker (or the notification thread, or a WSGI process) reaches sockets
+held by every other worker.
+
+A socket queues at most REALTIME_QUEUE_SIZE events. A client that falls
+further behind is disconnected (code 4008) instead of being buffered without
+bound; it catches up over HTTP (chat ``?since=``, notifications) and
+reconnects.
+"""
+import asyncio
+import json
+import logging
+import re
+import threading
+import uuid
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import presence as viewers  # Imports this module back; only used at call time
+from .models import ChatParticipant, LiveRoom
+
+logger = logging.getLogger(__name__)
+
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+CLOSE_TOO_SLOW = 4008
+
+
+def chat_group(chat_id):
+    return f'chat.{chat_id}'
+
+
+def user_group(user_id):
+    return f'user.{user_id}'
+
+
+def live_group(room_id):
+    return f'live.{room_id}'
+
+
+def encode(event):
+    return json.dumps(event, cls=JSONEncoder, separators=(',', ':'))
+
+
+class Subscriber:
+    """One socket's bounded queue of encoded events, fed from any thread"""
+
+    def __init__(self, loop, max_queued):
+        self.loop = loop
+        self.queue = asyncio.Queue(max_queued)
+
+    def put(self, text):
+        """Queue an event; call on the subscriber's loop"""
+        if self.queue.full():
+            # Too far behind: drop the backlog and tell the socket to close
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+        else:
+            self.queue.put_nowait(text)
+
+
+class InMemoryChannelLayer:
+    """Groups of subscribers in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def subscribe(self, group, subscriber):
+        with self.lock:
+            self.groups.setdefault(group, set()).add(subscriber)
+
+    def unsubscribe(self, group, subscriber):
+        with self.lock:
+            members = self.groups.get(group)
+            if members is not None:
+                members.discard(subscriber)
+                if not members:
+                    del self.groups[group]
+
+    def subscriber_count(self, group=None):
+        with self.lock:
+            if group is not None:
+                return len(self.groups.get(group, ()))
+            return sum(len(members) for members in self.groups.values())
+
+    def publish(self, group, event):
+        """Deliver an event to the group's subscribers; safe to call from any thread"""
+        self.deliver(group, encode(event))
+
+    def deliver(self, group, text):
+        with self.lock:
+            members = list(self.groups.get(group, ()))
+        by_loop = {}
+        for subscriber in members:
+            by_loop.setdefault(subscriber.loop, []).append(subscriber)
+        # One wakeup per event loop, not per socket
+        for loop, subscribers in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_put_all, subscribers, text)
+            except RuntimeError:
+                pass  # The loop has shut down; its sockets are gone
+
+
+def _put_all(subscribers, text):
+    for subscriber in subscribers:
+        subscriber.put(text)
+
+
+class RedisChannelLayer(InMemoryChannelLayer):
+    """Publishes through Redis pub/sub; a listener thread delivers to this process's subscribers.
+
+    Every process receives every event (one pattern subscription), which keeps
+    the layer stateless; split REALTIME_REDIS_URL per shard if that outgrows
+    one Redis.
+    """
+
+    prefix = 'vyra.realtime.'
+
+    def __init__(self):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisChannelLayer requires the redis package')
+        self.redis = redis.Redis.from_url(getattr(settings, 'REALTIME_REDIS_URL', 'redis://localhost:6379/0'))
+        self.listener = None
+
+    def subscribe(self, group, subscriber):
+        super().subscribe(group, subscriber)
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self._listen, name='realtime-redis', daemon=True)
+                self.listener.start()
+
+    def publish(self, group, event):
+        self.redis.publish(self.prefix + group, encode(event))
+
+    def _listen(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(self.prefix + '*')
+        for message in pubsub.listen():
+            try:
+                group = message['channel'].decode()[len(self.prefix):]
+                self.deliver(group, message['data'].decode())
+            except Exception:
+                logger.exception('Delivering a real-time event failed')
+
+
+_layer = None
+_layer_lock = threading.Lock()
+
+
+def get_channel_layer():
+    global _layer
+    with _layer_lock:
+        if _layer is None:
+            path = getattr(settings, 'REALTIME_CHANNEL_LAYER', 'core.realtime.InMemoryChannelLayer')
+            _layer = import_string(path)()
+        return _layer
+
+
+def publish(group, event):
+    """Send an event to a group's sockets once the current transaction commits"""
+    transaction.on_commit(lambda: _publish_now(group, event))
+
+
+def _publish_now(group, event):
+    try:
+        get_channel_layer().publish(group, event)
+    except Exception:
+        # Real-time delivery is best effort: clients catch up over HTTP
+        logger.exception('Publishing a real-time event to %s failed', group)
+
+
+# Routing: authorize the user for the path's group, or return None
+
+def _join_chat(user, pk):
+    if ChatParticipant.objects.filter(chat_id=pk, user=user).exists():
+        return chat_group(pk)
+    return None
+
+
+def _join_notifications(user):
+    return user_group(user.pk)
+
+
+def _join_live(user, pk):
+    if LiveRoom.objects.filter(pk=pk).exists():
+        return live_group(pk)
+    return None
+
+
+UUID_PATTERN = r'(?P<pk>[0-9a-fA-F-]{32,36})'
+
+# (path, join, whether the socket is a live room viewer)
+ROUTES = [
+    (re.compile(rf'^/ws/chats/{UUID_PATTERN}/$'), _join_chat, False),
+    (re.compile(r'^/ws/notifications/$'), _join_notifications, False),
+    (re.compile(rf'^/ws/live/{UUID_PATTERN}/$'), _join_live, True),
+]
+
+
+def _route(path):
+    for pattern, join, viewer in ROUTES:
+        match = pattern.match(path)
+        if match:
+            kwargs = match.groupdict()
+            if 'pk' in kwargs:
+                try:
+                    kwargs['pk'] = uuid.UUID(kwargs['pk'])
+                except ValueError:
+                    return None, None, False
+            return join, kwargs, viewer
+    return None, None, False
+
+
+def _token(scope):
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin-1').partition(' ')
+            if keyword.lower() == 'token' and key:
+                return key.strip()
+    return None
+
+
+def _authorize(scope, join, kwargs):
+    """(close code, user, group) for the connection: a group, or the code to refuse it with"""
+    key = _token(scope)
+    token = Token.objects.select_related('user').filter(key=key).first() if key else None
+    if token is None or not token.user.is_active:
+        return CLOSE_UNAUTHORIZED, None, None
+    group = join(token.user, **kwargs)
+    if group is None:
+        return CLOSE_FORBIDDEN, None, None
+    return None, token.user, group
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application for ``websocket`` scopes"""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    join, kwargs, viewer = _route(scope['path'])
+    if join is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    code, user, group = await sync_to_async(_authorize)(scope, join, kwargs)
+    if group is None:
+        await send({'type': 'websocket.close', 'code': code})
+        return
+
+    layer = get_channel_layer()
+    subscriber = Subscriber(asyncio.get_running_loop(), getattr(settings, 'REALTIME_QUEUE_SIZE', 256))
+    layer.subscribe(group, subscriber)
+    heartbeat = (lambda: viewers.presence.heartbeat(kwargs['pk'], user.pk)) if viewer else None
+    tasks = []
+    connected = False
+    try:
+        await send({'type': 'websocket.accept'})
+        if viewer:
+            viewers.presence.connect(kwargs['pk'], user.pk)
+            connected = True
+        tasks = [
+            asyncio.ensure_future(_forward(subscriber, send)),
+            asyncio.ensure_future(_listen(receive, send, heartbeat)),
+        ]
+        if heartbeat:
+            tasks.append(asyncio.ensure_future(_keep_present(heartbeat)))
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        layer.unsubscribe(group, subscriber)
+        for task in tasks:
+            task.cancel()
+        if connected:
+            viewers.presence.disconnect(kwargs['pk'], user.pk)
+
+
+async def _keep_present(heartbeat):
+    """Renew the socket's viewer well before PRESENCE_TTL_SECONDS runs out, whether or not the client pings"""
+    while True:
+        await asyncio.sleep(viewers.presence.ttl / 2)
+        heartbeat()
+
+
+async def _forward(subscriber, send):
+    """Send queued events to the socket until it falls too far behind"""
+    queue = subscriber.queue
+    while True:
+        texts = [await queue.get()]
+        # Send whatever else is already queued without waiting for another wakeup
+        while not queue.empty():
+            texts.append(queue.get_nowait())
+        for text in texts:
+            if text is None:
+                await send({'type': 'websocket.close', 'code': CLOSE_TOO_SLOW})
+                return
+            await send({'type': 'websocket.send', 'text': text})
+
+
+async def _listen(receive, send, heartbeat=None):
+    """Answer pings (which also renew a viewer's presence) until the client disconnects;
+    the sockets are otherwise one-way"""
+    while True:
+        event = await receive()
+        if event['type'] == 'websocket.disconnect':
+            return
+        try:
+            message = json.loads(event.get('text') or 'null')
+        except ValueError:
+            continue
+        if isinstance(message, dict) and message.get('type') == 'ping':
+            if heartbeat:
+                heartbeat()
+            await send({'type': 'websocket.send', 'text': encode({'type': 'pong'})})
@@ -0,0 +1,91 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Follow, Profile
+from .timeline import backfill_author, remove_author
+
+
+def build_relationship_map(user_ids, current_user=None):
+    """Resolve relationship flags between the current user and a page of users.
+
+    Runs two set lookups no matter how many users are on the page (follower
+    counts are read from the denormalized Profile columns). Returns a dict
+    keyed by user id.
+    """
+    user_ids = list(set(user_ids))
+    relationships = {
+        user_id: {'is_following': False, 'is_followed_by': False}
+        for user_id in user_ids
+    }
+    if not user_ids or current_user is None or not current_user.is_authenticated:
+        return relationships
+
+    followed_by_me = Follow.objects.filter(
+        follower=current_user, following_id__in=user_ids
+    ).values_list('following_id', flat=True)
+    for user_id in followed_by_me:
+        relationships[user_id]['is_following'] = True
+
+    following_me = Follow.objects.filter(
+        follower_id__in=user_ids, following=current_user
+    ).values_list('follower_id', flat=True)
+    for user_id in following_me:
+        relationships[user_id]['is_followed_by'] = True
+
+    return relationships
+
+
+def follow_user(follower, following):
+    """Create a Follow, bump both profile counters and backfill the follower's timeline.
+
+    Returns (follow, created) like get_or_create.
+    """
+    with transaction.atomic():
+        follow, created = Follow.objects.get_or_create(follower=follower, following=following)
+        if created:
+            Profile.objects.filter(user=following).update(followers_count=F('followers_count') + 1)
+            Profile.objects.filter(user=follower).update(following_count=F('following_count') + 1)
+            backfill_author(follower, following)
+    return follow, created
+
+
+def unfollow_user(follower, following):
+    """Delete a Follow, decrement both profile counters and prune the follower's timeline.
+
+    Returns True if a Follow was removed.
+    """
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(follower=follower, following=following).delete()
+        if deleted:
+            Profile.objects.filter(user=following, followers_count__gt=0).update(
+                followers_count=F('followers_count') - 1
+            )
+            Profile.objects.filter(user=follower, following_count__gt=0).update(
+                following_count=F('following_count') - 1
+            )
+            remove_author(follower, following)
+    return bool(deleted)
+
+
+def annotate_actual_follow_counts(queryset):
+    """Annotate profiles with follower/following counts computed from Follow rows"""
+    followers = Follow.objects.filter(following=OuterRef('user')).values('following').annotate(
+        total=Count('id')
+    ).values('total')
+    following = Follow.objects.filter(follower=OuterRef('user')).values('follower').annotate(
+        total=Count('id')
+    ).values('total')
+    return queryset.annotate(
+        actual_followers=Coalesce(Subquery(followers), 0),
+        actual_following=Coalesce(Subquery(following), 0),
+    )
+
+
+def drifted_follow_counters(queryset=None):
+    """Profiles whose stored counters disagree with the Follow table"""
+    if queryset is None:
+        queryset = Profile.objects.all()
+    return annotate_actual_follow_counts(queryset).filter(
+        ~Q(followers_count=F('actual_followers')) | ~Q(following_count=F('actual_following'))
+    )
@@ -0,0 +1,179 @@
+"""Compaction and partitioning of the VyRa Points ledger.
+
+Likes, shares, comments and battle votes each add ledger rows, so the ledger
+grows with activity. Once rows are older than POINTS_ROLLUP_AFTER_DAYS,
+rollup_points folds each user's rows of a day into one summary row per
+transaction type, video and battle: the points summed, ``folded`` set to the
+number of rows it stands for, and dated on the same day. Summary rows are
+ledger rows, so:
+
+- a balance is still the sum of its ledger (reconcile_points), and each
+  batch checks that the sums of the users it touched are unchanged before
+  it commits;
+- rebuild_leaderboards, which sums earned rows per user and day, still
+  gives the same boards.
+
+Rows with an idempotency key record a claim, purchase or boost and are never
+folded; neither are rows alone in their group.
+
+On PostgreSQL the ledger is range-partitioned by month on ``created_at``
+(migration 0024): recent history and new rows only touch the current
+partitions' indexes, and old months can be detached or archived whole. A
+partitioned table cannot enforce a unique key that leaves out the partition
+column, which is why idempotency keys live in PointsIdempotencyKey.
+rollup_points also creates the coming months' partitions (a DEFAULT
+partition catches anything outside them). SQLite has no partitioning: the
+ledger stays one table and the rollup alone keeps it small.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Sum, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import VyRaPointsTransaction
+
+LEDGER_TABLE = VyRaPointsTransaction._meta.db_table
+GROUP = ('user_id', 'transaction_type', 'video_id', 'battle_id')
+# Filtering on every type lets a created_at range use points_type_created_idx
+TYPES = [kind for kind, _ in VyRaPointsTransaction.TRANSACTION_TYPES]
+
+
+class RollupError(Exception):
+    pass
+
+
+def day_bounds(day):
+    """The aware datetimes a local day starts and ends at"""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def rollup_cutoff(days=None):
+    """Start of the first local day whose rows are still kept as they are"""
+    if days is None:
+        days = getattr(settings, 'POINTS_ROLLUP_AFTER_DAYS', 30)
+    return day_bounds(timezone.localdate() - timedelta(days=days))[0]
+
+
+def _foldable(**filters):
+    return VyRaPointsTransaction.objects.filter(idempotency_key__isnull=True, **filters)
+
+
+def rollup(before, batch_size=500):
+    """Fold the rows created before ``before``, a day at a time. Returns (rows folded, summary rows written)."""
+    folded = summaries = 0
+    # One query per type, so each is a seek on points_type_created_idx
+    firsts = [
+        _foldable(transaction_type=kind, created_at__lt=before).order_by('created_at').values_list(
+            'created_at', flat=True
+        ).first()
+        for kind in TYPES
+    ]
+    if not any(firsts):
+        return folded, summaries
+    day = timezone.localdate(min(first for first in firsts if first))
+    while True:
+        start, end = day_bounds(day)
+        if start >= before:
+            break
+        rows = _foldable(transaction_type__in=TYPES, created_at__gte=start, created_at__lt=min(end, before))
+        # Only users with two or more rows in a group gain anything from a rollup
+        users = sorted({
+            row['user_id'] for row in rows.values(*GROUP).annotate(count=Count('pk')).filter(count__gt=1).order_by()
+        })
+        for i in range(0, len(users), batch_size):
+            done, written = _fold(rows.filter(user_id__in=users[i:i + batch_size]), day)
+            folded += done
+            summaries += written
+        day += timedelta(days=1)
+    return folded, summaries
+
+
+def _totals(rows):
+    return dict(rows.values('user_id').annotate(total=Sum('points')).order_by().values_list('user_id', 'total'))
+
+
+def _fold(rows, day):
+    """Replace ``rows`` (a batch of users' rows of one day) by one row per group"""
+    with transaction.atomic():
+        before = _totals(rows)
+        groups = list(rows.values(*GROUP).annotate(
+            count=Count('pk'), total=Sum('points'), last=Max('created_at'), description=Max('description'),
+            # A summary row stands for the rows it folded, an ordinary row for itself
+            represented=Sum(Greatest('folded', Value(1))), own_folded=Max('folded'),
+        ).order_by())
+        deleted, _ = rows.delete()
+        VyRaPointsTransaction.objects.bulk_create([
+            VyRaPointsTransaction(
+                user_id=group['user_id'], transaction_type=group['transaction_type'],
+                video_id=group['video_id'], battle_id=group['battle_id'], points=group['total'],
+                created_at=group['last'],
+                **({
+                    'folded': group['represented'],
+                    'description': f'Daily total of {group["represented"]} transactions on {day.isoformat()}',
+                } if group['count'] > 1 else {
+                    'folded': group['own_folded'], 'description': group['description'],
+                }),
+            )
+            for group in groups
+        ])
+        if _totals(rows) != before:
+            raise RollupError(f'Rolling up {day} would change balances')
+    return deleted, len(groups)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass', [LEDGER_TABLE])
+        return cursor.fetchone() is not None
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_statements(table, first_month, last_month):
+    """CREATE TABLE statements for the monthly partitions (UTC months) of a ledger table, first to last
+
+    Migration 0024 keeps its own copy, which must name partitions the same way.
+    """
+    statements = []
+    month = month_start(first_month)
+    while month <= last_month:
+        statements.append(
+            f'CREATE TABLE IF NOT EXISTS {LEDGER_TABLE}_p{month:%Y%m} PARTITION OF {table} '
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+        )
+        month = next_month(month)
+    return statements
+
+
+def _last_partition_month():
+    month = month_start(timezone.now().date())
+    for _ in range(getattr(settings, 'POINTS_PARTITION_MONTHS_AHEAD', 3)):
+        month = next_month(month)
+    return month
+
+
+def ensure_partitions():
+    """Create this month's and the next POINTS_PARTITION_MONTHS_AHEAD months' ledger partitions.
+
+    Returns how many were checked; none off PostgreSQL.
+    """
+    if not is_partitioned():
+        return 0
+    statements = partition_statements(LEDGER_TABLE, timezone.now().date(), _last_partition_month())
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    return len(statements)
+
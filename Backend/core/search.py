@@ -0,0 +1,160 @@
+"""Full-text search over videos, profiles and hashtags.
+
+Searchable text is denormalized into ``SearchDocument`` rows (kept current by
+the signals in core.signals). The documents are indexed by the database:
+
+- PostgreSQL: a generated, weighted ``tsvector`` column with a GIN index.
+- SQLite: an FTS5 table per kind over the documents, synced by triggers.
+
+Both are created by migration 0016. Other backends fall back to
+``icontains`` over the documents. Queries are split into words that must all
+match; the last word also matches as a prefix, so partially typed usernames
+and hashtags are found. Results are ranked best first, with the title
+(username, display name, tag) weighted above the body. Ranking cost grows
+with the number of matches, so only the newest RANK_CANDIDATES matching
+documents are ranked; a query for a word found in most documents still
+returns the best of recent matches in bounded time.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, When
+
+from .models import SearchDocument
+
+MAX_RESULTS = 500
+MAX_TERMS = 8
+RANK_CANDIDATES = 500
+TERM_RE = re.compile(r'[^\W_]+')
+
+
+def fts_table(kind):
+    return f'core_searchdocument_{kind}_fts'
+
+
+def terms(text):
+    return TERM_RE.findall((text or '').lower())[:MAX_TERMS]
+
+
+def video_document(video, hashtag_names):
+    return video.username, ' '.join([video.description or '', *(f'#{name}' for name in hashtag_names)])
+
+
+def profile_document(profile, username):
+    return f'{username} {profile.display_name}'.strip(), profile.bio or ''
+
+
+def hashtag_document(hashtag):
+    return hashtag.name, ''
+
+
+def object_key(pk):
+    """SearchDocument.object_id for a primary key (UUIDs as 32-char hex, like SQLite stores them)"""
+    return pk.hex if hasattr(pk, 'hex') else str(pk)
+
+
+def all_documents(video_model, profile_model, hashtag_model, document_model):
+    """Unsaved documents for every video, profile and hashtag (models passed in so migrations can use historical ones)"""
+    for video in video_model.objects.prefetch_related('hashtags').iterator(chunk_size=2000):
+        title, body = video_document(video, [tag.name for tag in video.hashtags.all()])
+        yield document_model(kind='video', object_id=object_key(video.pk), title=title, body=body)
+    for profile in profile_model.objects.select_related('user').iterator(chunk_size=2000):
+        title, body = profile_document(profile, profile.user.username)
+        yield document_model(kind='profile', object_id=object_key(profile.pk), title=title, body=body)
+    for hashtag in hashtag_model.objects.iterator(chunk_size=2000):
+        title, body = hashtag_document(hashtag)
+        yield document_model(kind='hashtag', object_id=object_key(hashtag.pk), title=title, body=body)
+
+
+def _save(kind, pk, title, body):
+    SearchDocument.objects.update_or_create(
+        kind=kind, object_id=object_key(pk), defaults={'title': title, 'body': body}
+    )
+
+
+def index_video(video):
+    _save('video', video.pk, *video_document(video, video.hashtags.values_list('name', flat=True)))
+
+
+def index_videos(videos):
+    for video in videos.prefetch_related('hashtags'):
+        _save('video', video.pk, *video_document(video, [tag.name for tag in video.hashtags.all()]))
+
+
+def index_profile(profile):
+    _save('profile', profile.pk, *profile_document(profile, profile.user.username))
+
+
+def index_hashtag(hashtag):
+    _save('hashtag', hashtag.pk, *hashtag_document(hashtag))
+
+
+def unindex(kind, pk):
+    SearchDocument.objects.filter(kind=kind, object_id=object_key(pk)).delete()
+
+
+def search(kind, text, limit=MAX_RESULTS, title_only=False):
+    """object_ids of ``kind`` documents matching every word of ``text``, best match first"""
+    words = terms(text)
+    if not words:
+        return []
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(kind, words, limit, title_only)
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(kind, words, limit, title_only)
+    return _search_fallback(kind, words, limit, title_only)
+
+
+def autocomplete(kind, prefix, limit=10):
+    """Prefix matches on document titles (usernames, display names, hashtags)"""
+    return search(kind, prefix, limit, title_only=True)
+
+
+def _search_sqlite(kind, words, limit, title_only):
+    column = 'title : ' if title_only else ''
+    phrases = [f'{column}"{word}"' for word in words]
+    phrases[-1] += '*'
+    table = fts_table(kind)
+    with connection.cursor() as cursor:
+        # rank is bm25 with the column weights configured by the migration
+        cursor.execute(
+            f'SELECT d.object_id FROM (SELECT rowid, rank FROM ('
+            f'SELECT rowid, rank FROM {table} WHERE {table} MATCH %s ORDER BY rowid DESC LIMIT %s'
+            f') ORDER BY rank LIMIT %s) hit JOIN core_searchdocument d ON d.id = hit.rowid ORDER BY hit.rank',
+            [' AND '.join(phrases), RANK_CANDIDATES, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_postgresql(kind, words, limit, title_only):
+    weight = 'A' if title_only else ''
+    parts = [f'{word}:{weight}' if weight else word for word in words[:-1]] + [f'{words[-1]}:*{weight}']
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT object_id FROM ("
+            "SELECT id, object_id, document FROM core_searchdocument, to_tsquery('simple', %s) query "
+            "WHERE kind = %s AND document @@ query ORDER BY id DESC LIMIT %s"
+            ") hit, to_tsquery('simple', %s) query ORDER BY ts_rank(document, query) DESC, id DESC LIMIT %s",
+            [' & '.join(parts), kind, RANK_CANDIDATES, ' & '.join(parts), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _search_fallback(kind, words, limit, title_only):
+    documents = SearchDocument.objects.filter(kind=kind)
+    for word in words:
+        condition = Q(title__icontains=word)
+        if not title_only:
+            condition |= Q(body__icontains=word)
+        documents = documents.filter(condition)
+    return list(documents.order_by('-updated_at').values_list('object_id', flat=True)[:limit])
+
+
+def ranked(queryset, object_ids):
+    """Filter a queryset to search hits and order it by rank"""
+    if not object_ids:
+        return queryset.none()
+    return queryset.filter(pk__in=object_ids).order_by(
+        Case(*[When(pk=object_id, then=position) for position, object_id in enumerate(object_ids)],
+             output_field=IntegerField())
+    )
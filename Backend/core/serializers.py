@@ -1,5 +1,9 @@
+import os
+
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 from .models import (
     Profile, Badge, Video, Hashtag, Like, Comment, Share, Buzz,
     Follow, Product, Battle, BattleVote, Notification, VyRaPointsTransaction,
@@ -7,6 +11,8 @@ from .models import (
     LiveRoom, LiveBattle, Sound, ProfileSkin, UserSkin, Block, VideoAnalytics, Status,
     Chat, ChatMessage
 )
+from .counters import video_counters
+from .presence import presence
 
 # User Serializer
 class UserSerializer(serializers.ModelSerializer):
@@ -21,13 +27,11 @@ class BadgeSerializer(serializers.ModelSerializer):
         model = Badge
         fields = ['id', 'name', 'description', 'icon', 'earned_at']
 
-# Profile Serializer - ENHANCED with follower counts
+# Profile Serializer - ENHANCED with follower counts (stored on Profile)
 class ProfileSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     badges = BadgeSerializer(many=True, read_only=True)
     profile_image_url = serializers.SerializerMethodField()
-    followers_count = serializers.SerializerMethodField()
-    following_count = serializers.SerializerMethodField()
     is_following = serializers.SerializerMethodField()
     is_followed_by = serializers.SerializerMethodField()
 
@@ -39,7 +43,10 @@ class ProfileSerializer(serializers.ModelSerializer):
             'badges', 'is_verified', 'theme_accent', 'created_at', 'location',
             'followers_count', 'following_count', 'is_following', 'is_followed_by'
         ]
-        read_only_fields = ['id', 'created_at', 'total_likes', 'total_buzz', 'vyra_points', 'upload_count']
+        read_only_fields = [
+            'id', 'created_at', 'total_likes', 'total_buzz', 'vyra_points', 'upload_count',
+            'followers_count', 'following_count'
+        ]
 
     def get_profile_image_url(self, obj):
         # Check both profile_image and Profileimg (legacy field)
@@ -54,18 +61,18 @@ class ProfileSerializer(serializers.ModelSerializer):
             return image_field.url
         return None
 
-    def get_followers_count(self, obj):
-        """Calculate followers count"""
-        from .models import Follow
-        return Follow.objects.filter(following=obj.user).count()
-
-    def get_following_count(self, obj):
-        """Calculate following count"""
-        from .models import Follow
-        return Follow.objects.filter(follower=obj.user).count()
+    def _get_relationship(self, obj):
+        """Pre-resolved relationship data for this profile, if the view supplied it"""
+        relationships = self.context.get('relationships')
+        if relationships is not None:
+            return relationships.get(obj.user_id)
+        return None
 
     def get_is_following(self, obj):
         """Check if current user is following this profile"""
+        relationship = self._get_relationship(obj)
+        if relationship is not None:
+            return relationship['is_following']
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             from .models import Follow
@@ -77,6 +84,9 @@ class ProfileSerializer(serializers.ModelSerializer):
 
     def get_is_followed_by(self, obj):
         """Check if this profile is following current user"""
+        relationship = self._get_relationship(obj)
+        if relationship is not None:
+            return relationship['is_followed_by']
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             from .models import Follow
@@ -108,7 +118,7 @@ class ProfileSerializer(serializers.ModelSerializer):
 # Video Serializer - matches Flutter VideoItem
 class VideoSerializer(serializers.ModelSerializer):
     username = serializers.CharField(read_only=True)
-    userId = serializers.CharField(source='user.id', read_only=True)
+    userId = serializers.CharField(source='user_id', read_only=True)
     videoUrl = serializers.SerializerMethodField()
     videoPath = serializers.SerializerMethodField()
     isLocal = serializers.BooleanField(read_only=True)
@@ -120,6 +130,7 @@ class VideoSerializer(serializers.ModelSerializer):
     createdAt = serializers.DateTimeField(source='created_at', read_only=True)
     thumbnailUrl = serializers.CharField(source='thumbnail_url', read_only=True, allow_null=True)
     hashtags = serializers.SerializerMethodField()
+    processing = serializers.SerializerMethodField()
 
     class Meta:
         model = Video
@@ -127,107 +138,97 @@ class VideoSerializer(serializers.ModelSerializer):
             'id', 'username', 'userId', 'description', 'videoUrl', 'videoPath',
             'video_file', 'video_url', 'isLocal', 'likes', 'comments', 'shares', 'buzzCount', 'privacy',
             'location', 'hashtags', 'allowComments', 'allowDuet', 'allowStitch',
-            'createdAt', 'thumbnailUrl'
+            'createdAt', 'thumbnailUrl', 'processing'
         ]
         read_only_fields = ['id', 'likes', 'comments', 'shares', 'buzzCount', 'created_at', 'videoUrl', 'videoPath']
         extra_kwargs = {
             'video_file': {'write_only': False},  # Allow writing to video_file
         }
 
+    @staticmethod
+    def eager_load(queryset):
+        """Prefetch what the serializer reads so a page costs a fixed number of queries"""
+        return queryset.select_related('media_job').prefetch_related('hashtags')
+
+    def _absolute_url(self, url):
+        """Make a URL absolute against the request host, resolved once per request"""
+        if url.startswith('http://') or url.startswith('https://'):
+            return url
+        base_url = self.context.get('base_url')
+        if base_url is None:
+            request = self.context.get('request')
+            base_url = request.build_absolute_uri('/').rstrip('/') if request else 'http://127.0.0.1:8000'
+            self.context['base_url'] = base_url
+        return base_url + (url if url.startswith('/') else '/' + url)
+
     def get_videoUrl(self, obj):
         """CRITICAL: Always return absolute URL"""
-        import logging
-        logger = logging.getLogger(__name__)
-        
         # Check video_url field first
         if obj.video_url:
             url = str(obj.video_url).strip()
             if url and url != 'null' and url.lower() != 'none':
-                # If already absolute, return it
-                if url.startswith('http://') or url.startswith('https://'):
-                    return url
-                # Make relative URL absolute
-                request = self.context.get('request')
-                if request:
-                    return request.build_absolute_uri(url)
-                # Fallback to localhost
-                return f"http://127.0.0.1:8000{url if url.startswith('/') else '/' + url}"
-        
-        # Check video_file field
-        if obj.video_file:
+                return self._absolute_url(url)
+
+        # Fall back to the uploaded file
+        if obj.video_file and obj.video_file.name:
             try:
-                # Get the file URL - this should work for FileField
-                file_url = obj.video_file.url
-                if file_url:
-                    request = self.context.get('request')
-                    if request:
-                        # Build absolute URI using request
-                        absolute_url = request.build_absolute_uri(file_url)
-                        logger.info(f"Built video URL from file with request: {absolute_url}")
-                        return absolute_url
-                    else:
-                        # No request - build manually
-                        if file_url.startswith('http://') or file_url.startswith('https://'):
-                            logger.info(f"Video URL already absolute: {file_url}")
-                            return file_url
-                        # Make relative path absolute
-                        # FileField.url typically returns something like '/media/videos/filename.mp4'
-                        absolute_url = f"http://127.0.0.1:8000{file_url if file_url.startswith('/') else '/' + file_url}"
-                        logger.info(f"Built video URL from file without request: {absolute_url}")
-                        return absolute_url
-                else:
-                    logger.warning(f"Video {obj.id} has video_file but file_url is empty")
-            except Exception as e:
-                logger.error(f"Error building video URL from file for video {obj.id}: {e}")
-                # Try to construct URL from file name if possible
-                try:
-                    if obj.video_file.name:
-                        file_path = obj.video_file.name
-                        request = self.context.get('request')
-                        if request:
-                            return request.build_absolute_uri(f'/media/{file_path}')
-                        return f"http://127.0.0.1:8000/media/{file_path}"
-                except:
-                    pass
-        
-        logger.warning(f"Video {obj.id} has no videoUrl - video_url={obj.video_url}, video_file={obj.video_file}")
+                return self._absolute_url(obj.video_file.url)
+            except Exception:
+                return self._absolute_url(f'/media/{obj.video_file.name}')
         return None
 
     def get_videoPath(self, obj):
-        if obj.video_file:
-            return obj.video_file.path
+        if obj.video_file and obj.video_file.name:
+            return os.path.join(settings.MEDIA_ROOT, obj.video_file.name)
         return None
 
     def get_hashtags(self, obj):
         return [hashtag.name for hashtag in obj.hashtags.all()]
 
+    def _media_url(self, name):
+        return self._absolute_url(settings.MEDIA_URL + name) if name else None
+
+    def get_processing(self, obj):
+        """Status and outputs of the video's media job (core.media); None for videos never queued"""
+        job = getattr(obj, 'media_job', None)
+        if job is None:
+            return None
+        return {
+            'status': job.status,
+            'duration': job.duration,
+            'width': job.width,
+            'height': job.height,
+            'posterUrl': self._media_url(job.poster),
+            'previewUrl': self._media_url(job.preview),
+            'hlsUrl': self._media_url(job.hls_manifest),
+            'renditions': [
+                {'height': rendition['height'], 'width': rendition['width'], 'bitrate': rendition['bitrate'],
+                 'url': self._media_url(rendition['playlist'])}
+                for rendition in job.renditions
+            ],
+        }
+
+    # Buffered counter field -> output key
+    BUFFERED_COUNTERS = {
+        'likes': 'likes',
+        'comments_count': 'comments',
+        'shares': 'shares',
+        'buzz_count': 'buzzCount',
+    }
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['id'] = str(instance.id)
+        # Include engagement not yet flushed by the write-behind buffer
+        for field, delta in video_counters.pending(instance.pk).items():
+            key = self.BUFFERED_COUNTERS[field]
+            data[key] = max(0, data[key] + delta)
         data['boostScore'] = instance.boost_score
         data['collabType'] = instance.collab_type
         data['sensitiveFlag'] = instance.sensitive_flag
-        
-        # Ensure videoUrl is never null if video exists
-        # Try multiple times to get the URL
-        if not data.get('videoUrl'):
-            # First try the method again with fresh context
-            video_url = self.get_videoUrl(instance)
-            if video_url:
-                data['videoUrl'] = video_url
-            elif instance.video_file:
-                # If video_file exists but URL is None, try constructing it manually
-                try:
-                    file_name = instance.video_file.name
-                    if file_name:
-                        request = self.context.get('request')
-                        if request:
-                            data['videoUrl'] = request.build_absolute_uri(f'/media/{file_name}')
-                        else:
-                            data['videoUrl'] = f'http://127.0.0.1:8000/media/{file_name}'
-                except:
-                    pass
-        
+        # Without a client-provided thumbnail, show the generated poster
+        if not data['thumbnailUrl'] and data['processing']:
+            data['thumbnailUrl'] = data['processing']['posterUrl']
         return data
 
 # Comment Serializer
@@ -298,16 +299,17 @@ class BattleSerializer(serializers.ModelSerializer):
 
 # Notification Serializer
 class NotificationSerializer(serializers.ModelSerializer):
-    userId = serializers.CharField(source='user.id', read_only=True)
-    fromUserId = serializers.CharField(source='from_user.id', read_only=True, allow_null=True)
+    userId = serializers.CharField(source='user_id', read_only=True)
+    fromUserId = serializers.CharField(source='from_user_id', read_only=True, allow_null=True)
     notificationType = serializers.CharField(source='notification_type', read_only=True)
+    actorCount = serializers.IntegerField(source='actor_count', read_only=True)
     isRead = serializers.BooleanField(source='is_read', read_only=True)
     createdAt = serializers.DateTimeField(source='created_at', read_only=True)
 
     class Meta:
         model = Notification
         fields = [
-            'id', 'userId', 'fromUserId', 'notificationType', 'message',
+            'id', 'userId', 'fromUserId', 'notificationType', 'message', 'actorCount',
             'video', 'battle', 'isRead', 'createdAt'
         ]
         read_only_fields = ['id', 'created_at']
@@ -315,10 +317,11 @@ class NotificationSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['id'] = str(instance.id)
-        if instance.video:
-            data['video'] = str(instance.video.id)
-        if instance.battle:
-            data['battle'] = str(instance.battle.id)
+        # Foreign keys by id, without fetching the rows
+        if instance.video_id:
+            data['video'] = str(instance.video_id)
+        if instance.battle_id:
+            data['battle'] = str(instance.battle_id)
         return data
 
 # VyRaPoints Transaction Serializer
@@ -329,7 +332,7 @@ class VyRaPointsTransactionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = VyRaPointsTransaction
-        fields = ['id', 'userId', 'points', 'transactionType', 'description', 'video', 'battle', 'createdAt']
+        fields = ['id', 'userId', 'points', 'transactionType', 'description', 'video', 'battle', 'folded', 'createdAt']
         read_only_fields = ['id', 'created_at']
 
     def to_representation(self, instance):
@@ -418,7 +421,9 @@ class UserChallengeProgressSerializer(serializers.ModelSerializer):
 # Live Room Serializers
 class LiveRoomSerializer(serializers.ModelSerializer):
     hostName = serializers.CharField(source='host.username', read_only=True)
-    viewerCount = serializers.IntegerField(source='viewer_count', read_only=True)
+    viewerCount = serializers.SerializerMethodField()
+    peakViewers = serializers.SerializerMethodField()
+    averageViewers = serializers.SerializerMethodField()
     startedAt = serializers.DateTimeField(source='started_at', allow_null=True)
     endedAt = serializers.DateTimeField(source='ended_at', allow_null=True)
     createdAt = serializers.DateTimeField(source='created_at', read_only=True)
@@ -426,9 +431,24 @@ class LiveRoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = LiveRoom
         fields = ['id', 'host', 'hostName', 'title', 'description', 'status', 
-                  'viewerCount', 'startedAt', 'endedAt', 'createdAt']
+                  'viewerCount', 'peakViewers', 'averageViewers', 'startedAt', 'endedAt', 'createdAt']
         read_only_fields = ['id', 'viewer_count', 'created_at']
 
+    def get_viewerCount(self, obj):
+        """Live count from presence when this process tracks the room, else the last snapshot"""
+        return presence.count(obj.pk, default=obj.viewer_count)
+
+    def get_peakViewers(self, obj):
+        stats = presence.stats(obj.pk)
+        return max(obj.peak_viewers, stats['peakViewers'] if stats else 0)
+
+    def get_averageViewers(self, obj):
+        """Flushed viewer-seconds over the time the room has been live"""
+        if not obj.started_at:
+            return 0
+        seconds = ((obj.ended_at or timezone.now()) - obj.started_at).total_seconds()
+        return round(obj.viewer_seconds / seconds, 1) if seconds > 0 else 0
+
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['id'] = str(instance.id)
@@ -452,6 +472,9 @@ class LiveBattleSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         data['id'] = str(instance.id)
+        # Include votes not yet flushed from the battle's shards (core.battles.pending_votes)
+        data['participant1Votes'] += getattr(instance, 'pending_participant1_votes', 0)
+        data['participant2Votes'] += getattr(instance, 'pending_participant2_votes', 0)
         return data
 
 # Sound Serializer
@@ -583,8 +606,8 @@ class ChatMessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ChatMessage
-        fields = ['id', 'sender_id', 'sender_username', 'message', 'isRead', 'createdAt']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'sender_id', 'sender_username', 'message', 'isRead', 'version', 'createdAt']
+        read_only_fields = ['id', 'version', 'created_at']
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -605,11 +628,17 @@ class ChatSerializer(serializers.ModelSerializer):
         fields = ['id', 'participants_data', 'last_message', 'unread_count', 'createdAt', 'updatedAt']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def _members(self, obj):
+        """ChatParticipant rows with users and profiles; prefetched as member_list by core.chats.inbox"""
+        if not hasattr(obj, 'member_list'):
+            obj.member_list = list(obj.members.select_related('user__profile'))
+        return obj.member_list
+
     def get_participants_data(self, obj):
         """Get participant info excluding current user"""
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            participants = obj.participants.exclude(id=request.user.id)
+            participants = [member.user for member in self._members(obj) if member.user_id != request.user.id]
             return [{
                 'id': str(p.id),
                 'username': p.username,
@@ -618,23 +647,24 @@ class ChatSerializer(serializers.ModelSerializer):
         return []
 
     def get_last_message(self, obj):
-        """Get the last message in the chat"""
-        last_msg = obj.messages.order_by('-created_at').first()
-        if last_msg:
+        """Get the last message in the chat (denormalized onto the chat, see core.chats)"""
+        if obj.last_message_id:
             return {
-                'id': str(last_msg.id),
-                'message': last_msg.message,
-                'senderId': str(last_msg.sender.id),
-                'senderName': last_msg.sender.username,
-                'createdAt': last_msg.created_at.isoformat(),
+                'id': str(obj.last_message_id),
+                'message': obj.last_message_text,
+                'senderId': str(obj.last_message_sender_id),
+                'senderName': obj.last_message_sender.username if obj.last_message_sender else '',
+                'createdAt': obj.last_message_at.isoformat(),
             }
         return None
 
     def get_unread_count(self, obj):
         """Get unread message count for current user"""
+        if hasattr(obj, 'my_unread_count'):
+            return obj.my_unread_count
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.messages.exclude(sender=request.user).filter(is_read=False).count()
+            return next((m.unread_count for m in self._members(obj) if m.user_id == request.user.id), 0)
         return 0
 
     def to_representation(self, instance):
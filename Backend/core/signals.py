@@ -1,7 +1,10 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile
+from .models import Hashtag, Profile, UserChallengeProgress, Video
+from . import badges, search
+from .autocomplete import autocomplete
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -15,3 +18,110 @@ def create_user_profile(sender, instance, created, **kwargs):
             }
         )
 
+# Search index maintenance (core.search)
+
+@receiver(post_save, sender=User)
+def reindex_user_profile(sender, instance, created, raw=False, **kwargs):
+    """Keep the profile document's username current"""
+    if not created and not raw:
+        profile = Profile.objects.filter(user=instance).first()
+        if profile:
+            search.index_profile(profile)
+
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_profile(instance)
+
+@receiver(post_save, sender=Video)
+def index_video(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_video(instance)
+
+@receiver(post_init, sender=Hashtag)
+def remember_hashtag_name(sender, instance, **kwargs):
+    instance._search_indexed_name = instance.name
+
+@receiver(post_save, sender=Hashtag)
+def index_hashtag(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and 'name' not in update_fields):
+        return
+    renamed = not created and instance.name != instance._search_indexed_name
+    instance._search_indexed_name = instance.name
+    if created or renamed:
+        search.index_hashtag(instance)
+    if renamed:
+        # Tagged video documents include the tag name
+        search.index_videos(instance.videos.all())
+
+@receiver(m2m_changed, sender=Hashtag.videos.through)
+def reindex_tagged_videos(sender, instance, action, pk_set, **kwargs):
+    """Video documents include their hashtags"""
+    if isinstance(instance, Video):
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            search.index_video(instance)
+        return
+    if action == 'pre_clear':
+        instance._search_cleared_video_ids = list(instance.videos.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_search_cleared_video_ids', [])
+    elif action not in ('post_add', 'post_remove'):
+        return
+    search.index_videos(Video.objects.filter(pk__in=pk_set or []))
+
+@receiver(post_delete, sender=Video)
+def unindex_video(sender, instance, **kwargs):
+    search.unindex('video', instance.pk)
+
+@receiver(post_delete, sender=Profile)
+def unindex_profile(sender, instance, **kwargs):
+    search.unindex('profile', instance.pk)
+
+@receiver(pre_delete, sender=Hashtag)
+def remember_tagged_videos(sender, instance, **kwargs):
+    # The tag's video links are deleted without m2m_changed
+    instance._search_tagged_video_ids = list(instance.videos.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Hashtag)
+def unindex_hashtag(sender, instance, **kwargs):
+    search.unindex('hashtag', instance.pk)
+    search.index_videos(Video.objects.filter(pk__in=getattr(instance, '_search_tagged_video_ids', [])))
+
+# In-memory autocomplete (core.autocomplete); applied after commit so
+# rolled-back changes never reach the index
+
+@receiver(post_save, sender=User)
+def refresh_user_suggestion(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        profile = Profile.objects.filter(user=instance).select_related('user').first()
+        if profile:
+            transaction.on_commit(lambda: autocomplete.update_profile(profile))
+
+@receiver(post_save, sender=Profile)
+def refresh_profile_suggestion(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: autocomplete.update_profile(instance))
+
+@receiver(post_save, sender=Hashtag)
+def refresh_hashtag_suggestion(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: autocomplete.update_hashtag(instance))
+
+@receiver(post_delete, sender=Profile)
+def remove_profile_suggestion(sender, instance, **kwargs):
+    transaction.on_commit(lambda: autocomplete.remove_profile(instance.user_id))
+
+@receiver(post_delete, sender=Hashtag)
+def remove_hashtag_suggestion(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.remove_hashtag(pk))
+
+
+# Pending challenge claims badge (core.badges)
+
+@receiver(post_save, sender=UserChallengeProgress)
+@receiver(post_delete, sender=UserChallengeProgress)
+def refresh_pending_claims(sender, instance, raw=False, **kwargs):
+    if not raw:
+        badges.refresh_pending_claims(instance.user_id)
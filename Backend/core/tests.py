@@ -1,3 +1,2188 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import (
+    autocomplete, geo, interests, leaderboards, media, notifications, points, realtime, search, trending, uploads,
+)
+from .battles import VOTE_COST, BattleEnded, battle_votes, cast_vote, end_battle
+from .benchmarks import LocalWebSocket
+from .pagination import KeysetPagination
+from .presence import presence
+from .counters import VideoCounterBuffer, video_counters
+from .models import (
+    BadgeCounter, BattleVoteShard, Challenge, Chat, ChatMessage, ChatParticipant, Club, ClubMember, Comment,
+    CounterFlushBatch, Follow, Hashtag, InterestProfile, LeaderboardDay, LeaderboardTotal, Like, LiveBattle,
+    LiveRoom, MediaJob, Notification, NotificationActor, NotificationEvent, PointsIdempotencyKey, Product, Profile,
+    ProfileSkin, SearchDocument, Sound, Status, TimelineEntry, UserChallengeProgress, UserSkin, Video, VideoUpload,
+    VyRaPointsTransaction,
+)
+from .relationships import follow_user, unfollow_user
+
+
+# Background flushers write through their own connections, outside each test's
+# transaction; tests flush explicitly (or turn a thread back on themselves)
+background_threads_off = override_settings(
+    COUNTER_FLUSH_THREAD=False, NOTIFICATION_WORKER_THREAD=False, MEDIA_PROCESSING_WORKER_THREADS=False,
+    PRESENCE_FLUSH_THREAD=False,
+)
+
+
+def setUpModule():
+    background_threads_off.enable()
+
+
+def tearDownModule():
+    background_threads_off.disable()
+
+
+def index_names(index):
+    """``index`` and, on a partitioned table, the indexes PostgreSQL made for it on each partition"""
+    if connection.vendor != 'postgresql':
+        return [index]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(%s)', [index],
+        )
+        return [index] + [row[0] for row in cursor.fetchall()]
+
+
+def make_user(username):
+    """Create a user; the post_save signal creates the matching profile"""
+    return User.objects.create_user(username=username)
+
+
+def explain(sql):
+    """The database's query plan for a captured statement, as text"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Test tables are tiny, so the planner would otherwise always prefer a sequential scan
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+        else:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+def full_scan_pattern(table):
+    if connection.vendor == 'postgresql':
+        # A partitioned table (the points ledger) is scanned partition by partition
+        return re.compile(rf'Seq Scan on {table}(_p\d+|_default)?\b')
+    return re.compile(rf'SCAN (TABLE )?{table}\b(?! USING)')
+
+
+class ProfileRelationshipQueryTests(TestCase):
+    def setUp(self):
+        self.viewer = make_user('viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def _add_users(self, count, prefix):
+        users = [make_user(f'{prefix}{i}') for i in range(count)]
+        for user in users:
+            follow_user(self.viewer, user)
+            follow_user(user, self.viewer)
+        return users
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_profile_list_query_count_is_independent_of_page_size(self):
+        self._add_users(2, 'small')
+        small_count, _ = self._count_queries('/api/profiles/')
+
+        self._add_users(15, 'large')
+        large_count, response = self._count_queries('/api/profiles/')
+
+        self.assertEqual(len(response.json()['results']), 18)
+        self.assertEqual(small_count, large_count)
+
+    def test_profile_list_relationship_data(self):
+        followed = self._add_users(1, 'friend')[0]
+        response = self.client.get('/api/profiles/', {'search': 'friend'})
+        data = response.json()['results'][0]
+        self.assertEqual(data['id'], str(followed.id))
+        self.assertEqual(data['followersCount'], 1)
+        self.assertEqual(data['followingCount'], 1)
+        self.assertTrue(data['isFollowing'])
+        self.assertTrue(data['isFollowedBy'])
+
+    def test_followers_query_count_is_independent_of_follower_count(self):
+        self._add_users(2, 'small')
+        small_count, _ = self._count_queries(f'/api/profiles/{self.viewer.profile.pk}/followers/')
+
+        self._add_users(12, 'large')
+        large_count, response = self._count_queries(f'/api/profiles/{self.viewer.profile.pk}/followers/')
+
+        self.assertEqual(len(response.json()), 14)
+        self.assertEqual(small_count, large_count)
+
+
+class VideoSerializerQueryTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('creator')
+        self.tags = [Hashtag.objects.create(name=f'tag{i}') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _add_videos(self, count):
+        for i in range(count):
+            video = Video.objects.create(
+                user=self.user, username=self.user.username, description=f'v{i}',
+                video_url=f'/media/videos/v{i}.mp4',
+            )
+            video.hashtags.set(self.tags)
+
+    def _count_queries(self, url, params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response.json()
+
+    def test_feed_query_count_is_independent_of_page_size(self):
+        for params in ({}, {'cursor': ''}, {'username': 'creator'}):
+            with self.subTest(params=params):
+                self._add_videos(2)
+                small_count, _ = self._count_queries('/api/videos/', params)
+                self._add_videos(10)
+                large_count, _ = self._count_queries('/api/videos/', params)
+                self.assertEqual(small_count, large_count)
+
+    def test_video_urls_and_hashtags(self):
+        self._add_videos(1)
+        item = self.client.get('/api/videos/').json()['results'][0]
+        self.assertEqual(item['videoUrl'], 'http://testserver/media/videos/v0.mp4')
+        self.assertEqual(item['userId'], str(self.user.id))
+        self.assertEqual(sorted(item['hashtags']), ['tag0', 'tag1', 'tag2'])
+
+
+class IndexPlanTests(TestCase):
+    """EXPLAIN the statements the viewsets run and check they are index-backed"""
+
+    def setUp(self):
+        self.user = make_user('planner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertIndexBacked(self, method, url, table, index, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, params or {})
+        self.assertLess(response.status_code, 400)
+
+        statements = [
+            query['sql'] for query in ctx.captured_queries
+            if re.search(rf'\b(FROM|UPDATE) "?{table}"?', query['sql'])
+        ]
+        self.assertTrue(statements, f'{url} did not query {table}')
+        plans = [explain(sql) for sql in statements]
+        for sql, plan in zip(statements, plans):
+            self.assertIsNone(full_scan_pattern(table).search(plan), f'Full scan of {table}:\n{sql}\n{plan}')
+        names = index_names(index)
+        self.assertTrue(
+            any(name in plan for name in names for plan in plans), f'{index} not used by {url}:\n' + '\n'.join(plans)
+        )
+
+    def test_video_queries(self):
+        Video.objects.create(user=self.user, username=self.user.username, description='v')
+        self.assertIndexBacked('get', '/api/videos/', 'core_video', 'video_privacy_feed_idx', {'privacy': 'Public'})
+        self.assertIndexBacked('get', '/api/videos/', 'core_video', 'video_username_idx', {'username': 'planner'})
+        self.assertIndexBacked('get', '/api/videos/recommended/', 'core_video', 'video_trending_idx')
+        self.assertIndexBacked(
+            'get', '/api/videos/nearby/', 'core_video', 'video_privacy_geohash_idx', {'lat': 5.6, 'lng': -0.19}
+        )
+
+    def test_notification_queries(self):
+        Notification.objects.create(user=self.user, notification_type='like', message='m')
+        self.assertIndexBacked('get', '/api/notifications/', 'core_notification', 'notification_user_feed_idx')
+        self.assertIndexBacked(
+            'post', '/api/notifications/mark_all_read/', 'core_notification', 'notification_unread_idx'
+        )
+
+    def test_points_queries(self):
+        VyRaPointsTransaction.objects.create(user=self.user, points=5, transaction_type='earned')
+        self.assertIndexBacked('get', '/api/vyra-points/', 'core_vyrapointstransaction', 'points_user_history_idx')
+        hashtag = Hashtag.objects.create(name='dance')
+        LeaderboardDay.objects.create(scope=leaderboards.hashtag_scope(hashtag.pk), day=timezone.localdate(),
+                                      user=self.user, points=5)
+        for period in ('daily', 'weekly'):
+            self.assertIndexBacked('get', '/api/vyra-points/leaderboard/', 'core_leaderboardday',
+                                   'leaderboard_day_rank_idx', {'period': period, 'hashtag': 'dance'})
+        self.assertIndexBacked('get', '/api/vyra-points/leaderboard/', 'core_leaderboardtotal',
+                               'leaderboard_total_rank_idx', {'period': 'all', 'hashtag': 'dance'})
+
+    def test_chat_history_queries(self):
+        chat = Chat.objects.create()
+        chat.participants.add(self.user)
+        ChatMessage.objects.create(chat=chat, sender=self.user, message='hi')
+        url = f'/api/chats/{chat.pk}/messages/'
+        self.assertIndexBacked('get', url, 'core_chatmessage', 'chatmessage_chat_history_idx')
+        self.assertIndexBacked('get', url, 'core_chatmessage', 'chatmessage_chat_history_idx', {'cursor': ''})
+        # SQLite names the index behind chatmessage_chat_version_uniq itself
+        for params in ({'before': ''}, {'before': 5}, {'since': 0}):
+            self.assertIndexBacked('get', url, 'core_chatmessage', 'sqlite_autoindex_core_chatmessage', params)
+
+    def test_status_queries(self):
+        Status.objects.create(user=self.user, expires_at=timezone.now() + timedelta(hours=1))
+        self.assertIndexBacked('get', '/api/statuses/', 'core_status', 'status_expires_idx')
+
+    def test_product_and_sound_queries(self):
+        Product.objects.create(seller=self.user, seller_name='planner', name='p', description='d', price=1)
+        Sound.objects.create(title='s')
+        self.assertIndexBacked('get', '/api/products/', 'core_product', 'product_boost_idx')
+        self.assertIndexBacked(
+            'get', '/api/products/', 'core_product', 'product_promoted_idx', {'is_promoted': 'true'}
+        )
+        self.assertIndexBacked('get', '/api/sounds/', 'core_sound', 'sound_popular_idx')
+
+
+class NearbyVideoTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('mapper')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _video(self, lat, lng, privacy='Public'):
+        return Video.objects.create(
+            user=self.user, username=self.user.username, description=f'{lat},{lng}',
+            latitude=lat, longitude=lng, privacy=privacy,
+        )
+
+    def test_geohash_is_kept_in_sync_on_save(self):
+        video = self._video(57.64911, 10.40744)
+        self.assertEqual(video.geohash, geo.encode_geohash(57.64911, 10.40744))
+        self.assertTrue(video.geohash.startswith('u4pruydqq'))
+        video.latitude = None
+        video.save(update_fields=['latitude'])
+        video.refresh_from_db()
+        self.assertIsNone(video.geohash)
+
+    def test_nearby_is_sorted_and_bounded_by_radius(self):
+        far = self._video(5.70, -0.20)  # ~11 km away
+        near = self._video(5.61, -0.19)
+        middle = self._video(5.65, -0.19)
+        self._video(5.61, -0.19, privacy='Private')
+        self._video(6.70, -1.60)  # Kumasi
+
+        response = self.client.get('/api/videos/nearby/', {'lat': 5.60, 'lng': -0.19, 'radius': 10})
+        self.assertEqual([item['id'] for item in response.json()], [str(near.id), str(middle.id)])
+        self.assertLess(response.json()[0]['distanceKm'], response.json()[1]['distanceKm'])
+
+        response = self.client.get('/api/videos/nearby/', {'lat': 5.60, 'lng': -0.19, 'radius': 15})
+        self.assertEqual(response.json()[-1]['id'], str(far.id))
+
+    def test_nearby_cursor_walks_by_distance(self):
+        expected = [str(self._video(5.60 + i * 0.001, -0.19).id) for i in range(7)]
+        seen = []
+        response = self.client.get('/api/videos/nearby/', {'lat': 5.60, 'lng': -0.19, 'cursor': '', 'page_size': 3})
+        while True:
+            data = response.json()
+            seen.extend(item['id'] for item in data['results'])
+            if not data['next']:
+                break
+            response = self.client.get(data['next'])
+        self.assertEqual(seen, expected)
+
+    def test_nearby_across_the_antimeridian(self):
+        east = self._video(0.0, 179.99)
+        west = self._video(0.0, -179.99)
+        response = self.client.get('/api/videos/nearby/', {'lat': 0.0, 'lng': 179.995, 'radius': 5})
+        self.assertEqual({item['id'] for item in response.json()}, {str(east.id), str(west.id)})
+
+    def test_distances_match_pure_python(self):
+        lats, lngs = [5.61, 6.70, -33.9], [-0.19, -1.60, 18.4]
+        distances = geo.haversine_km(5.60, -0.19, lats, lngs)
+        with patch.object(geo, 'np', None):
+            self.assertEqual([round(d, 6) for d in geo.haversine_km(5.60, -0.19, lats, lngs)],
+                             [round(d, 6) for d in distances])
+        self.assertAlmostEqual(distances[0], 1.112, places=2)
+
+    def test_clusters_by_zoom(self):
+        for i in range(3):
+            self._video(6.45 + i * 0.0001, 3.40)
+        self._video(6.50, 3.34)
+        params = {'lat': 6.47, 'lng': 3.37, 'radius': 20}
+
+        coarse = self.client.get('/api/videos/clusters/', {**params, 'zoom': 5}).json()
+        self.assertEqual([cell['count'] for cell in coarse], [4])
+
+        fine = self.client.get('/api/videos/clusters/', {**params, 'zoom': 14}).json()
+        self.assertEqual([cell['count'] for cell in fine], [3, 1])
+
+    def test_missing_location_is_rejected(self):
+        self.assertEqual(self.client.get('/api/videos/nearby/', {'lat': 5.6}).status_code, 400)
+
+
+class TrendingScoreTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _video(self, description, age_hours=0, likes=0, tags=()):
+        video = Video.objects.create(user=self.user, username='creator', description=description, likes=likes)
+        if age_hours:
+            video.created_at = timezone.now() - timedelta(hours=age_hours)
+            video.save()
+        for tag in tags:
+            Hashtag.objects.get_or_create(name=tag)[0].videos.add(video)
+        return video
+
+    def _like(self, video):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/videos/{video.pk}/like/')
+
+    def test_score_decays_with_age(self):
+        with self.settings(TRENDING_HALF_LIFE_HOURS=24):
+            fresh = self._video('fresh', likes=10)
+            day_old = self._video('day old', age_hours=24, likes=10)
+            popular_day_old = self._video('popular', age_hours=24, likes=100)
+        self.assertGreater(fresh.trending_score, day_old.trending_score)
+        self.assertGreater(popular_day_old.trending_score, fresh.trending_score)
+
+    def test_recommended_ranks_by_score_within_interests(self):
+        liked = self._video('liked', tags=['dance'])
+        self._like(liked)
+        quiet = self._video('quiet', age_hours=48, tags=['dance'])
+        hot = self._video('hot', likes=500, tags=['dance', 'music'])
+        self._video('off topic', likes=1000, tags=['cooking'])
+        call_command('refresh_trending_scores', stdout=StringIO())
+
+        ids = [item['id'] for item in self.client.get('/api/videos/recommended/').json()]
+        self.assertEqual(ids, [str(hot.id), str(liked.id), str(quiet.id)])
+
+    def test_refresh_only_rescans_touched_videos(self):
+        touched = self._video('touched')
+        self._video('untouched')
+        Video.objects.update(updated_at=timezone.now() - timedelta(days=1))
+        out = StringIO()
+        call_command('refresh_trending_scores', stdout=out)
+        self.assertIn('Scanned 2 video(s)', out.getvalue())
+
+        before = Video.objects.get(pk=touched.pk).trending_score
+        self._like(touched)
+        out = StringIO()
+        call_command('refresh_trending_scores', stdout=out)
+        self.assertIn('Scanned 1 video(s), updated 1 score(s)', out.getvalue())
+        self.assertGreater(Video.objects.get(pk=touched.pk).trending_score, before)
+
+
+class InterestProfileTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('viewer')
+        self.creator = make_user('creator')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _video(self, creator, tags=(), likes=0):
+        video = Video.objects.create(user=creator, username=creator.username, description='v', likes=likes)
+        for tag in tags:
+            Hashtag.objects.get_or_create(name=tag)[0].videos.add(video)
+        return video
+
+    def _engage(self, video, action='like'):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/videos/{video.pk}/{action}/')
+
+    def test_engagement_updates_weights(self):
+        dance = self._video(self.creator, ['dance'])
+        self._engage(dance, 'like')
+        self._engage(dance, 'share')
+        profile = InterestProfile.objects.get(user=self.user)
+        dance_id = str(Hashtag.objects.get(name='dance').pk)
+        self.assertAlmostEqual(profile.hashtags[dance_id], 4.0, places=3)
+        self.assertAlmostEqual(profile.creators[str(self.creator.pk)], 4.0, places=3)
+
+    def test_weights_decay_and_stay_bounded(self):
+        start = timezone.now()
+        profile = InterestProfile(user=self.user, hashtags={}, creators={}, as_of=start)
+        with self.settings(INTEREST_HALF_LIFE_DAYS=1):
+            interests.apply_engagement(profile, 'like', [1], None, start)
+            interests.apply_engagement(profile, 'like', [2], None, start + timedelta(days=1))
+        self.assertAlmostEqual(profile.hashtags['1'], 0.5)
+        self.assertAlmostEqual(profile.hashtags['2'], 1.0)
+
+        interests.apply_engagement(profile, 'like', range(3, 200), None, profile.as_of)
+        self.assertEqual(len(profile.hashtags), interests.MAX_HASHTAGS)
+
+    def test_recommended_prefers_affinity(self):
+        other = make_user('other')
+        self._engage(self._video(self.creator, ['dance']))
+        self._engage(self._video(self.creator, ['dance']))
+        self._engage(self._video(other, ['music']))
+        favourite = self._video(self.creator, ['dance'], likes=10)
+        slightly_hotter = self._video(other, ['music'], likes=12)
+        self._video(make_user('stranger'), ['cooking'], likes=1000)
+
+        ids = [item['id'] for item in self.client.get('/api/videos/recommended/').json()]
+        self.assertLess(ids.index(str(favourite.id)), ids.index(str(slightly_hotter.id)))
+        self.assertEqual(len(ids), 5)  # The cooking video matches no interest
+
+    def test_recommended_cost_does_not_grow_with_history(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get('/api/videos/recommended/').status_code, 200)
+            return len(ctx.captured_queries)
+
+        for _ in range(2):
+            self._engage(self._video(self.creator, ['dance']))
+        small = count_queries()
+        for _ in range(15):
+            self._engage(self._video(self.creator, ['dance']))
+        self.assertEqual(count_queries(), small)
+
+    def test_batch_scorer_matches_pure_python(self):
+        profile = InterestProfile(user=self.user, hashtags={'1': 2.0, '2': 0.5}, creators={'7': 3.0}, as_of=timezone.now())
+        candidates = [([1, 2], 7), ([2], 8), ([], 9), ([1, 1], 7)]
+        scores = interests.affinities(profile, candidates, profile.as_of)
+        with patch.object(interests, 'np', None):
+            self.assertEqual(interests.affinities(profile, candidates, profile.as_of), scores)
+        self.assertEqual(scores, [5.5, 0.5, 0.0, 5.0])
+
+    def test_rebuild_matches_incremental_profile(self):
+        self._engage(self._video(self.creator, ['dance']))
+        self._engage(self._video(self.creator, ['music']), 'buzz')
+        incremental = InterestProfile.objects.get(user=self.user)
+        InterestProfile.objects.all().delete()
+
+        call_command('rebuild_interest_profiles', stdout=StringIO())
+        rebuilt = InterestProfile.objects.get(user=self.user)
+        self.assertEqual(rebuilt.hashtags.keys(), incremental.hashtags.keys())
+        for key, weight in incremental.hashtags.items():
+            self.assertAlmostEqual(rebuilt.hashtags[key], weight, places=3)
+        self.assertAlmostEqual(rebuilt.creators[str(self.creator.pk)], 3.0, places=3)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _video(self, description, tags=(), username='viewer'):
+        video = Video.objects.create(user=self.user, username=username, description=description)
+        for tag in tags:
+            Hashtag.objects.get_or_create(name=tag)[0].videos.add(video)
+        return video
+
+    def _search_videos(self, text):
+        return [item['id'] for item in self.client.get('/api/videos/', {'search': text}).json()['results']]
+
+    def test_matches_every_word_and_last_word_as_prefix(self):
+        both = self._video('sunset over the lagoon')
+        self._video('sunset at the beach')
+        self.assertEqual(self._search_videos('lagoon sunset'), [str(both.pk)])
+        self.assertEqual(self._search_videos('sunset lag'), [str(both.pk)])
+        self.assertEqual(self._search_videos('Sunset LAGOON!'), [str(both.pk)])
+
+    def test_title_matches_rank_first(self):
+        in_body = self._video('afrobeats with kemi')
+        in_title = self._video('morning dance', username='kemi')
+        self.assertEqual(self._search_videos('kemi'), [str(in_title.pk), str(in_body.pk)])
+
+    def test_hashtag_changes_reindex_videos(self):
+        video = self._video('weekend', ['owambe'])
+        self.assertEqual(self._search_videos('owambe'), [str(video.pk)])
+
+        tag = Hashtag.objects.get(name='owambe')
+        tag.name = 'asoebi'
+        tag.save()
+        self.assertEqual(self._search_videos('owambe'), [])
+        self.assertEqual(self._search_videos('asoebi'), [str(video.pk)])
+
+        tag.videos.remove(video)
+        self.assertEqual(self._search_videos('asoebi'), [])
+        video.hashtags.add(tag)
+        self.assertEqual(self._search_videos('asoebi'), [str(video.pk)])
+
+        tag.delete()
+        self.assertEqual(self._search_videos('asoebi'), [])
+        self.assertFalse(SearchDocument.objects.filter(kind='hashtag').exists())
+
+    def test_tag_use_does_not_reindex_tagged_videos(self):
+        def upload_queries():
+            with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/videos/', {'description': 'again', 'hashtags': 'owambe'})
+            self.assertEqual(response.status_code, 201, response.content)
+            return len(ctx.captured_queries)
+
+        self._video('first', ['owambe'])
+        upload_queries()  # Creates the uploader's leaderboard rows
+        few = upload_queries()
+        for i in range(10):
+            self._video(f'more {i}', ['owambe'])
+        self.assertEqual(upload_queries(), few)
+        self.assertEqual(Hashtag.objects.get(name='owambe').usage_count, 3)
+
+        tag = Hashtag.objects.get(name='owambe')
+        tag.save()  # Unchanged name: the tag's videos keep their documents
+        with self.assertNumQueries(0):
+            tag.save(update_fields=[])
+        self.assertEqual(len(self._search_videos('owambe')), 14)
+
+    def test_deleted_videos_are_unindexed(self):
+        video = self._video('ephemeral clip')
+        video.delete()
+        self.assertEqual(self._search_videos('ephemeral'), [])
+        self.assertFalse(SearchDocument.objects.filter(kind='video').exists())
+
+    def test_profile_search_follows_username_and_display_name(self):
+        user = make_user('tunde')
+        profile = Profile.objects.get(user=user)
+        profile.display_name = 'Tunde Bakare'
+        profile.save()
+
+        def found(text):
+            return [item['username'] for item in self.client.get('/api/profiles/', {'search': text}).json()['results']]
+
+        self.assertEqual(found('bakare'), ['tunde'])
+        user.username = 'tbakare'
+        user.save()
+        self.assertEqual(found('tbak'), ['tbakare'])
+        self.assertEqual(found('tunde'), ['tbakare'])  # Still in the display name
+
+    def test_autocomplete_matches_title_prefixes_only(self):
+        Hashtag.objects.create(name='lagos')
+        Hashtag.objects.create(name='lagosnights')
+        Hashtag.objects.create(name='abuja')
+        tags = Hashtag.objects.in_bulk(field_name='name')
+        self.assertEqual(
+            set(search.autocomplete('hashtag', 'lag')),
+            {search.object_key(tags['lagos'].pk), search.object_key(tags['lagosnights'].pk)},
+        )
+        self.assertEqual(search.autocomplete('hashtag', 'x'), [])
+
+    def test_rebuild_search_index_command(self):
+        video = self._video('rebuilt', ['rebuild'])
+        SearchDocument.objects.all().delete()
+        self.assertEqual(self._search_videos('rebuilt'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self._search_videos('rebuilt'), [str(video.pk)])
+        self.assertEqual(self._search_videos('rebuild'), [str(video.pk)])
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        autocomplete.autocomplete.reset()
+        self.user = make_user('viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _suggest(self, q, **params):
+        response = self.client.get('/api/autocomplete/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _user(self, username, display_name='', followers=0):
+        with self.captureOnCommitCallbacks(execute=True):
+            user = make_user(username)
+            Profile.objects.filter(user=user).update(display_name=display_name or username, followers_count=followers)
+            profile = Profile.objects.get(user=user)
+            profile.save()
+        return user
+
+    def test_ranked_by_followers_and_usage(self):
+        self._user('amaka', followers=5)
+        self._user('amara', 'Amara Obi', followers=50)
+        self._user('bola', 'Bola Amadi', followers=10)
+        Hashtag.objects.create(name='amapiano', usage_count=30)
+        Hashtag.objects.create(name='amala', usage_count=3)
+
+        result = self._suggest('Am')
+        self.assertEqual([user['username'] for user in result['users']], ['amara', 'bola', 'amaka'])
+        self.assertEqual([tag['name'] for tag in result['hashtags']], ['amapiano', 'amala'])
+        self.assertEqual(self._suggest('#ama', type='hashtags'), {'hashtags': result['hashtags']})
+        self.assertEqual(len(self._suggest('am', limit=1)['users']), 1)
+        self.assertEqual(self._suggest(''), {'users': [], 'hashtags': []})
+
+    def test_signals_refresh_the_built_index(self):
+        user = self._user('chidi')
+        self.assertEqual(self._suggest('chi')['users'][0]['username'], 'chidi')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.username = 'nnamdi'
+            user.save()
+            tag = Hashtag.objects.create(name='chill')
+        self.assertEqual([user['username'] for user in self._suggest('chi')['users']], ['nnamdi'])  # Display name
+        self.assertEqual(self._suggest('nna')['users'][0]['username'], 'nnamdi')
+        self.assertEqual(self._suggest('chi')['hashtags'][0]['name'], 'chill')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.delete()
+        self.assertEqual(self._suggest('chi')['hashtags'], [])
+
+    def test_evicted_entries_are_found_through_the_search_index(self):
+        with self.settings(AUTOCOMPLETE_MAX_ENTRIES=2):
+            self._user('zainab', followers=9)
+            self._user('zara', followers=8)
+            self._user('zeke', followers=1)
+            autocomplete.autocomplete.reset()
+            self.assertEqual(
+                [user['username'] for user in self._suggest('z')['users']], ['zainab', 'zara', 'zeke']
+            )
+
+    def test_cached_top_lists_match_a_full_scan(self):
+        rng = random.Random(7)
+        index = autocomplete.PrefixIndex(max_entries=40)
+
+        def entry(pk):
+            name = ''.join(rng.choices('abc', k=rng.randint(1, 4)))
+            return pk, rng.randint(0, 20), (name,), {'id': pk}
+
+        def expected(prefix):
+            matches = [pk for pk, (_, keys, _) in index.entries.items() if any(key.startswith(prefix) for key in keys)]
+            return sorted(matches, key=lambda pk: (-index.entries[pk][0], pk))[:5]
+
+        with patch.object(autocomplete, 'SCAN_LIMIT', 2), patch.object(autocomplete, 'TOP_K', 5):
+            index.load(entry(pk) for pk in range(60))
+            for _ in range(300):
+                if rng.random() < 0.2:
+                    index.remove(rng.randrange(80))
+                else:
+                    index.upsert(*entry(rng.randrange(80)))
+                self.assertLessEqual(len(index.entries), 40)
+                for prefix in ('a', 'b', 'ab', 'ca'):
+                    self.assertEqual([item['id'] for item in index.query(prefix, 5)], expected(prefix))
+
+
+class NotificationPipelineTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.creator = make_user('creator')
+        self.video = Video.objects.create(user=self.creator, username='creator', description='v')
+        self.client = APIClient()
+
+    def _as(self, username):
+        user = User.objects.filter(username=username).first() or make_user(username)
+        self.client.force_authenticate(user)
+        return user
+
+    def _post(self, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data or {}, format='json')
+            notifications.notifications.drain_all()  # What the worker thread does after commit
+        return response
+
+    def _notifications(self):
+        self.client.force_authenticate(self.creator)
+        return self.client.get('/api/notifications/').json()['results']
+
+    def test_likes_coalesce_into_one_notification(self):
+        for name in ('ada', 'bayo', 'chike'):
+            self._as(name)
+            self._post(f'/api/videos/{self.video.pk}/like/')
+
+        [notification] = self._notifications()
+        self.assertEqual(notification['message'], 'chike and 2 others liked your video')
+        self.assertEqual(notification['actorCount'], 3)
+        self.assertEqual(notification['video'], str(self.video.pk))
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_types_and_videos_group_separately(self):
+        other = Video.objects.create(user=self.creator, username='creator', description='w')
+        self._as('ada')
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        self._post(f'/api/videos/{other.pk}/like/')
+        self._post(f'/api/videos/{self.video.pk}/add_comment/', {'text': 'nice'})
+        self._post(f'/api/profiles/{Profile.objects.get(user=self.creator).pk}/follow/')
+
+        messages = sorted(notification['message'] for notification in self._notifications())
+        self.assertEqual(messages, [
+            'ada commented on your video', 'ada liked your video', 'ada liked your video',
+            'ada started following you',
+        ])
+
+    def test_batch_coalesces_with_constant_queries(self):
+        fans = [make_user(f'fan{i}') for i in range(30)]
+        NotificationEvent.objects.bulk_create([
+            NotificationEvent(user=self.creator, from_user=fan, notification_type='like', video=self.video)
+            for fan in fans
+        ])
+        BadgeCounter.objects.create(user=self.creator)
+        # savepoint, select, delete, existing groups, insert, actors, unread badge, release
+        with self.assertNumQueries(8):
+            self.assertEqual(notifications.notifications.drain(), 30)
+        notification = Notification.objects.get(user=self.creator)
+        self.assertEqual(notification.actor_count, 30)
+        self.assertEqual(notification.message, 'fan29 and 29 others liked your video')
+
+    def test_group_created_by_a_concurrent_drain_is_joined(self):
+        ada, bayo = make_user('ada'), make_user('bayo')
+        event = NotificationEvent.objects.create(
+            user=self.creator, from_user=bayo, notification_type='like', video=self.video
+        )
+        # Another process's drain wrote the group after this one looked for it
+        rival = Notification.objects.create(
+            user=self.creator, from_user=ada, notification_type='like', video=self.video, actor_count=1,
+            message='ada liked your video', group_key=notifications.group_key('like', self.video.pk, event.created_at),
+        )
+        NotificationActor.objects.create(notification=rival, user=ada)
+        outbox = notifications.notifications
+        looked_up = [{}]
+        with patch.object(outbox, '_existing_groups', side_effect=lambda groups: (
+            looked_up.pop() if looked_up else type(outbox)._existing_groups(outbox, groups)
+        )):
+            with self.assertRaises(notifications.ConcurrentDrain):
+                outbox.drain()
+            self.assertTrue(NotificationEvent.objects.exists())  # The batch rolled back
+            self.assertEqual(outbox.drain_all(), 1)
+
+        notification = Notification.objects.get(user=self.creator)
+        self.assertEqual(notification.pk, rival.pk)
+        self.assertEqual((notification.actor_count, notification.message), (2, 'bayo and 1 other liked your video'))
+
+    def test_later_events_update_the_group_until_the_window_ends(self):
+        ada = self._as('ada')
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        Notification.objects.update(is_read=True)
+
+        self._as('bayo')
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        notification = Notification.objects.get()
+        self.assertEqual((notification.actor_count, notification.is_read), (2, False))
+        self.assertEqual(notification.message, 'bayo and 1 other liked your video')
+
+        # The same actor again does not inflate the count
+        self._as('bayo')
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        self.assertEqual(Notification.objects.get().actor_count, 2)
+        # Nor does an earlier actor unliking and liking again
+        self._as('ada')
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        notification = Notification.objects.get()
+        self.assertEqual((notification.actor_count, notification.message), (2, 'ada and 1 other liked your video'))
+        self.assertEqual(set(notification.actors.values_list('user__username', flat=True)), {'ada', 'bayo'})
+
+        later = timezone.now() + timedelta(minutes=61)
+        NotificationEvent.objects.create(user=self.creator, from_user=ada, notification_type='like',
+                                         video=self.video, created_at=later)
+        call_command('process_notifications', stdout=StringIO())
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_self_engagement_is_not_notified(self):
+        self.client.force_authenticate(self.creator)
+        self._post(f'/api/videos/{self.video.pk}/like/')
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+
+
+class BadgeCounterTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('viewer')
+        self.friend = make_user('friend')
+        self.client = APIClient()
+
+    def _as(self, user):
+        self.client.force_authenticate(user)
+
+    def _post(self, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data or {}, format='json')
+            notifications.notifications.drain_all()
+        self.assertLess(response.status_code, 300)
+        return response
+
+    def _badges(self):
+        self._as(self.user)
+        with self.assertNumQueries(2):
+            return self.client.get('/api/badges/').json()
+
+    def test_notification_counts_follow_coalescing_and_reads(self):
+        video = Video.objects.create(user=self.user, username='viewer', description='v')
+        for name in ('ada', 'bayo'):
+            self._as(make_user(name))
+            self._post(f'/api/videos/{video.pk}/like/')
+            self._post(f'/api/videos/{video.pk}/add_comment/', {'text': 'hi'})
+        self.assertEqual(self._badges()['notifications'], 2)  # One like group, one comment group
+
+        [comment, like] = Notification.objects.order_by('notification_type')
+        self._post(f'/api/notifications/{like.pk}/mark_read/')
+        self._post(f'/api/notifications/{like.pk}/mark_read/')
+        self.assertEqual(self._badges()['notifications'], 1)
+
+        # A new like resurfaces the read group
+        self._as(make_user('chike'))
+        self._post(f'/api/videos/{video.pk}/like/')
+        self.assertEqual(self._badges()['notifications'], 2)
+
+        self._as(self.user)
+        self._post('/api/notifications/mark_all_read/')
+        self.assertEqual(self._badges()['notifications'], 0)
+
+    def test_chat_counts_per_chat(self):
+        self._as(self.user)
+        chat_id = self._post('/api/chats/get_or_create/', {'user_id': self.friend.pk}).json()['id']
+        self._as(self.friend)
+        for text in ('hi', 'there'):
+            self._post(f'/api/chats/{chat_id}/send_message/', {'message': text})
+        self.assertEqual(self._badges()['messages'], 2)
+        self.assertEqual(self._badges()['chats'], {chat_id: 2})
+
+        self._as(self.user)
+        self.assertEqual(self.client.get('/api/chats/').json()['results'][0]['unread_count'], 2)
+        self._post(f'/api/chats/{chat_id}/mark_read/')
+        self.assertEqual(self._badges(), {'notifications': 0, 'messages': 0, 'chats': {}, 'challengeClaims': 0})
+
+    def test_pending_claims(self):
+        challenge = Challenge.objects.create(title='Upload', description='d', challenge_type='upload', points_reward=5)
+        progress = UserChallengeProgress.objects.create(challenge=challenge, user=self.user)
+        self.assertEqual(self._badges()['challengeClaims'], 0)
+        progress.completed = True
+        progress.save()
+        self.assertEqual(self._badges()['challengeClaims'], 1)
+        self._post(f'/api/challenges/{challenge.pk}/claim/')
+        self.assertEqual(self._badges()['challengeClaims'], 0)
+
+    def test_reconcile_badges_repairs_drift(self):
+        video = Video.objects.create(user=self.user, username='viewer', description='v')
+        Notification.objects.create(user=self.user, notification_type='like', message='m', video=video)
+        chat = Chat.objects.create()
+        chat.participants.add(self.user, self.friend)
+        ChatMessage.objects.create(chat=chat, sender=self.friend, message='unseen', version=1)
+        ChatMessage.objects.create(chat=chat, sender=self.user, message='mine', version=2)
+        BadgeCounter.objects.create(user=self.friend, unread_notifications=4)
+
+        out = StringIO()
+        call_command('reconcile_badges', '--dry-run', stdout=out)
+        self.assertIn('Found 2 drifted chat count(s), 2 drifted badge counter(s)', out.getvalue())
+        self.assertFalse(ChatParticipant.objects.filter(unread_count__gt=0).exists())
+
+        call_command('reconcile_badges', stdout=StringIO())
+        self.assertEqual(
+            self._badges(), {'notifications': 1, 'messages': 1, 'chats': {str(chat.pk): 1}, 'challengeClaims': 0}
+        )
+        friend = BadgeCounter.objects.get(user=self.friend)
+        self.assertEqual((friend.unread_notifications, friend.unread_messages), (0, 1))
+        out = StringIO()
+        call_command('reconcile_badges', '--dry-run', stdout=out)
+        self.assertIn('Found 0 drifted chat count(s), 0 drifted badge counter(s)', out.getvalue())
+
+
+class ChatInboxTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('viewer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _chat_with(self, other, *messages):
+        chat_id = self.client.post('/api/chats/get_or_create/', {'user_id': other.pk}, format='json').json()['id']
+        for sender, text in messages:
+            self.client.force_authenticate(sender)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/chats/{chat_id}/send_message/', {'message': text}, format='json')
+        self.client.force_authenticate(self.user)
+        return chat_id
+
+    def test_inbox_queries_do_not_grow_with_chats(self):
+        for i in range(2):
+            friend = make_user(f'friend{i}')
+            self._chat_with(friend, (friend, 'hello'))
+        with self.assertNumQueries(3):
+            self.client.get('/api/chats/')
+        for i in range(2, 8):
+            friend = make_user(f'friend{i}')
+            self._chat_with(friend, (friend, 'hello'))
+        with self.assertNumQueries(3):
+            results = self.client.get('/api/chats/').json()['results']
+        self.assertEqual(len(results), 8)
+
+    def test_inbox_order_last_message_and_unread(self):
+        ada, bob = make_user('ada'), make_user('bob')
+        ada_chat = self._chat_with(ada, (ada, 'one'), (ada, 'two'))
+        bob_chat = self._chat_with(bob, (self.user, 'hey bob'))
+        results = self.client.get('/api/chats/').json()['results']
+        self.assertEqual([chat['id'] for chat in results], [bob_chat, ada_chat])
+        bob_row, ada_row = results
+        self.assertEqual(bob_row['participants_data'], [{'id': str(bob.pk), 'username': 'bob', 'displayName': 'bob'}])
+        self.assertEqual((bob_row['last_message']['message'], bob_row['unread_count']), ('hey bob', 0))
+        self.assertEqual(ada_row['last_message']['message'], 'two')
+        self.assertEqual(ada_row['last_message']['senderName'], 'ada')
+        self.assertEqual(ada_row['unread_count'], 2)
+        self.assertEqual(ChatParticipant.objects.get(chat_id=bob_chat, user=bob).unread_count, 1)
+
+        # Replying moves the chat to the top; reading clears only the reader's count
+        self._chat_with(ada, (self.user, 'back at you'))
+        self.client.post(f'/api/chats/{ada_chat}/mark_read/')
+        ada_row = self.client.get('/api/chats/').json()['results'][0]
+        self.assertEqual((ada_row['id'], ada_row['unread_count']), (ada_chat, 0))
+        self.assertEqual(ChatParticipant.objects.get(chat_id=ada_chat, user=ada).unread_count, 1)
+
+    def test_outsiders_cannot_post(self):
+        ada, eve = make_user('ada'), make_user('eve')
+        chat_id = self._chat_with(ada)
+        self.client.force_authenticate(eve)
+        response = self.client.post(f'/api/chats/{chat_id}/send_message/', {'message': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class ChatHistorySyncTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('viewer')
+        self.friend = make_user('friend')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        chat_id = self.client.post('/api/chats/get_or_create/', {'user_id': self.friend.pk}, format='json').json()['id']
+        self.chat = Chat.objects.get(pk=chat_id)
+        self.url = f'/api/chats/{chat_id}/messages/'
+
+    def _send(self, sender, *texts):
+        self.client.force_authenticate(sender)
+        for text in texts:
+            self.client.post(f'/api/chats/{self.chat.pk}/send_message/', {'message': text}, format='json')
+        self.client.force_authenticate(self.user)
+
+    def _get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_scrollback_with_before(self):
+        self._send(self.friend, *[f'm{i}' for i in range(1, 6)])
+        page = self._get(before='', page_size=2)
+        self.assertEqual([m['message'] for m in page['results']], ['m5', 'm4'])
+        self.assertEqual(page['since'], 5)
+        page = self._get(before=page['before'], page_size=2)
+        self.assertEqual([m['message'] for m in page['results']], ['m3', 'm2'])
+        page = self._get(before=page['before'], page_size=2)
+        self.assertEqual(([m['message'] for m in page['results']], page['before']), (['m1'], None))
+        # Without before/since the full history is still returned, oldest first
+        self.assertEqual(len(self.client.get(self.url).json()), 5)
+
+    def test_sync_returns_new_messages_and_read_changes(self):
+        self._send(self.friend, 'hello')
+        since = self._get(before='')['since']
+        self.assertEqual(self._get(since=since), {'results': [], 'reads': [], 'since': since, 'hasMore': False})
+
+        self._send(self.user, 'hi', 'how are you')
+        self._send(self.friend, 'good')
+        self.client.force_authenticate(self.friend)
+        self.client.post(f'/api/chats/{self.chat.pk}/mark_read/')
+        self.client.force_authenticate(self.user)
+
+        changed = self._get(since=since)
+        self.assertEqual([m['message'] for m in changed['results']], ['hi', 'how are you', 'good'])
+        self.assertEqual(changed['reads'], [{'userId': str(self.friend.pk), 'readUpTo': 5}])
+        self.assertEqual((changed['since'], changed['hasMore']), (5, False))
+        self.assertTrue(all(m['isRead'] for m in changed['results'][:2]))
+
+        # Pages of new messages continue from the last one returned
+        self._send(self.friend, 'a', 'b', 'c')
+        first = self._get(since=changed['since'], page_size=2)
+        self.assertEqual(([m['message'] for m in first['results']], first['hasMore']), (['a', 'b'], True))
+        rest = self._get(since=first['since'], page_size=2)
+        self.assertEqual(([m['message'] for m in rest['results']], rest['hasMore']), (['c'], False))
+        self.assertEqual(rest['since'], self.chat.messages.order_by('-version').first().version)
+
+    def test_mark_read_without_unread_is_not_a_change(self):
+        self._send(self.user, 'hi')
+        self.client.post(f'/api/chats/{self.chat.pk}/mark_read/')
+        self.assertEqual(Chat.objects.get(pk=self.chat.pk).version, 1)
+
+    def test_invalid_version(self):
+        response = self.client.get(self.url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PRESENCE_FLUSH_THREAD=False)
+class RealtimeTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        realtime._layer = None
+        self.user = make_user('viewer')
+        self.friend = make_user('friend')
+        self.token = Token.objects.create(user=self.user).key
+        self.client = APIClient()
+
+    def _post(self, user, url, data=None):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, data or {}, format='json')
+            notifications.notifications.drain_all()
+        return response
+
+    def _flush_votes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            battle_votes.flush()
+
+    async def _connect(self, path, token=None):
+        socket = LocalWebSocket(realtime.websocket_application, path, token or self.token)
+        return socket, await socket.connect()
+
+    def test_chat_socket_gets_messages_and_reads(self):
+        chat_id = self._post(self.user, '/api/chats/get_or_create/', {'user_id': self.friend.pk}).json()['id']
+
+        async def scenario():
+            socket, opened = await self._connect(f'/ws/chats/{chat_id}/')
+            self.assertEqual(opened, {'type': 'websocket.accept'})
+            await sync_to_async(self._post)(self.friend, f'/api/chats/{chat_id}/send_message/', {'message': 'yo'})
+            event = json.loads((await socket.receive())['text'])
+            self.assertEqual((event['type'], event['message']['message']), ('message', 'yo'))
+            self.assertEqual(event['message']['senderId'], str(self.friend.pk))
+
+            await sync_to_async(self._post)(self.user, f'/api/chats/{chat_id}/mark_read/')
+            event = json.loads((await socket.receive())['text'])
+            self.assertEqual(event, {'type': 'read', 'userId': str(self.user.pk), 'readUpTo': 2})
+
+            await socket.send_text('{"type": "ping"}')
+            self.assertEqual((await socket.receive())['text'], '{"type":"pong"}')
+            await socket.close()
+            self.assertEqual(realtime.get_channel_layer().subscriber_count(), 0)
+
+        async_to_sync(scenario)()
+
+    def test_refused_connections(self):
+        chat = Chat.objects.create()
+        chat.participants.add(self.friend)
+        outsider = Token.objects.create(user=make_user('outsider')).key
+
+        async def scenario():
+            for path, token, code in (
+                (f'/ws/chats/{chat.pk}/', outsider, realtime.CLOSE_FORBIDDEN),
+                (f'/ws/live/{chat.pk}/', None, realtime.CLOSE_FORBIDDEN),
+                ('/ws/notifications/', 'not-a-token', realtime.CLOSE_UNAUTHORIZED),
+                ('/ws/nowhere/', None, realtime.CLOSE_NOT_FOUND),
+            ):
+                _, closed = await self._connect(path, token)
+                self.assertEqual(closed, {'type': 'websocket.close', 'code': code}, path)
+
+        async_to_sync(scenario)()
+
+    def test_notification_and_battle_vote_events(self):
+        video = Video.objects.create(user=self.user, username='viewer', description='v')
+        room = LiveRoom.objects.create(host=self.user, title='Battle night')
+        battle = LiveBattle.objects.create(live_room=room, participant1=self.user, participant2=self.friend)
+        Profile.objects.filter(user=self.friend).update(vyra_points=10)
+
+        async def scenario():
+            notified, _ = await self._connect('/ws/notifications/')
+            live, _ = await self._connect(f'/ws/live/{room.pk}/')
+            await sync_to_async(self._post)(self.friend, f'/api/videos/{video.pk}/like/')
+            event = json.loads((await notified.receive())['text'])
+            self.assertEqual(event['type'], 'notification')
+            self.assertEqual(event['notification']['message'], 'friend liked your video')
+
+            await sync_to_async(self._post)(self.friend, f'/api/live-battles/{battle.pk}/vote/', {'participant': '2'})
+            await sync_to_async(self._flush_votes)()
+            event = json.loads((await live.receive())['text'])
+            self.assertEqual(event, {
+                'type': 'battle_vote', 'battleId': str(battle.pk), 'participant1Votes': 0, 'participant2Votes': 1,
+            })
+
+        async_to_sync(scenario)()
+
+    def test_slow_client_is_disconnected(self):
+        subscriber = realtime.Subscriber(None, 2)
+        for text in ('a', 'b', 'c'):
+            subscriber.put(text)
+        self.assertEqual((subscriber.queue.qsize(), subscriber.queue.get_nowait()), (1, None))
+
+
+@override_settings(PRESENCE_FLUSH_THREAD=False, PRESENCE_TTL_SECONDS=30)
+class PresenceTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        realtime._layer = None
+        for shard in presence.shards:
+            shard.rooms.clear()
+        self.host = make_user('host')
+        self.room = LiveRoom.objects.create(
+            host=self.host, title='Live', status='live', started_at=timezone.now() - timedelta(seconds=100),
+        )
+        self.url = f'/api/live-rooms/{self.room.pk}/'
+        self.client = APIClient()
+        clock = patch('core.presence.time.monotonic', return_value=1000.0)
+        self.monotonic = clock.start()
+        self.addCleanup(clock.stop)
+
+    def _at(self, seconds):
+        self.monotonic.return_value = 1000.0 + seconds
+
+    def _post(self, user, action):
+        self.client.force_authenticate(user)
+        return self.client.post(self.url + f'{action}/').json()
+
+    def test_heartbeats_join_and_leave(self):
+        ada, bayo = make_user('ada'), make_user('bayo')
+        self.assertEqual(self._post(ada, 'join_viewer'), {'viewerCount': 1})
+        self.assertEqual(self._post(bayo, 'heartbeat'), {'viewerCount': 2})
+        self.assertEqual(self._post(ada, 'heartbeat'), {'viewerCount': 2})
+        self.assertEqual(self._post(bayo, 'leave_viewer'), {'viewerCount': 1})
+        self.assertEqual(self.client.get(self.url).json()['viewerCount'], 1)
+        # Heartbeats never touch the room row
+        self.assertEqual(LiveRoom.objects.get(pk=self.room.pk).viewer_count, 0)
+
+        self._post(self.host, 'end')
+        room = LiveRoom.objects.get(pk=self.room.pk)
+        self.assertEqual((room.viewer_count, room.peak_viewers), (0, 2))
+        self.assertIsNone(presence.count(self.room.pk))
+
+    def test_ttl_expiry_and_flush(self):
+        ada, bayo = make_user('ada'), make_user('bayo')
+        self._post(ada, 'join_viewer')
+        self._at(10)
+        self._post(bayo, 'join_viewer')
+        self._at(35)  # ada's heartbeat ran out at 30
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(presence.flush(), 1)
+        room = LiveRoom.objects.get(pk=self.room.pk)
+        # ada watched 30s, bayo 25s so far
+        self.assertEqual((room.viewer_count, room.peak_viewers, room.viewer_seconds), (1, 2, 55))
+        self.assertEqual(presence.flush(), 0)  # Nothing new to write yet
+
+        self._at(50)  # bayo expires at 40
+        presence.flush()
+        stats = self.client.get(self.url + 'viewers/').json()
+        self.assertEqual(stats['viewerCount'], 0)
+        self.assertEqual(stats['peakViewers'], 2)
+        self.assertAlmostEqual(stats['averageViewers'], 0.6, delta=0.1)  # 60 viewer-seconds over ~100s
+        presence.flush()
+        self.assertIsNone(presence.count(self.room.pk))  # Idle rooms are dropped once written
+
+    def test_live_socket_counts_as_viewer(self):
+        token = Token.objects.create(user=make_user('ada')).key
+
+        async def scenario():
+            socket = LocalWebSocket(realtime.websocket_application, f'/ws/live/{self.room.pk}/', token)
+            await socket.connect()
+            self.assertEqual(presence.count(self.room.pk), 1)
+            await socket.close()
+            self.assertEqual(presence.count(self.room.pk), 0)
+
+        async_to_sync(scenario)()
+
+    def test_viewer_leaves_with_their_last_socket(self):
+        token = Token.objects.create(user=make_user('ada')).key
+
+        async def scenario():
+            path = f'/ws/live/{self.room.pk}/'
+            phone, tablet = (LocalWebSocket(realtime.websocket_application, path, token) for _ in range(2))
+            await phone.connect()
+            await tablet.connect()
+            self.assertEqual(presence.count(self.room.pk), 1)
+            await phone.close()
+            self.assertEqual(presence.count(self.room.pk), 1)  # Still watching on the tablet
+            await tablet.close()
+            self.assertEqual(presence.count(self.room.pk), 0)
+
+        async_to_sync(scenario)()
+
+    @override_settings(PRESENCE_TTL_SECONDS=0.2)
+    def test_open_socket_is_heartbeated_by_the_server(self):
+        token = Token.objects.create(user=make_user('ada')).key
+
+        # A running clock (the event loop's too): the server's heartbeats are timed sleeps
+        self.monotonic.side_effect = time.perf_counter
+
+        async def scenario():
+            socket = LocalWebSocket(realtime.websocket_application, f'/ws/live/{self.room.pk}/', token)
+            await socket.connect()
+            # Past the connect heartbeat's expiry, with no ping from the client
+            await asyncio.sleep(0.35)
+            self.assertEqual(presence.count(self.room.pk), 1)
+            await socket.close()
+
+        async_to_sync(scenario)()
+
+
+class FollowCounterTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_follow_and_unfollow_maintain_counters(self):
+        self.client.post(f'/api/profiles/{self.bob.profile.pk}/follow/')
+        self.assertEqual(Profile.objects.get(user=self.bob).followers_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.alice).following_count, 1)
+
+        response = self.client.get(f'/api/profiles/{self.bob.profile.pk}/')
+        self.assertEqual(response.json()['followersCount'], 1)
+        self.assertTrue(response.json()['isFollowing'])
+
+        self.client.delete(f'/api/profiles/{self.bob.profile.pk}/unfollow/')
+        self.assertEqual(Profile.objects.get(user=self.bob).followers_count, 0)
+        self.assertEqual(Profile.objects.get(user=self.alice).following_count, 0)
+
+    def test_repair_follow_counts_fixes_drift(self):
+        Follow.objects.create(follower=self.alice, following=self.bob)
+        Profile.objects.filter(user=self.alice).update(followers_count=7)
+
+        call_command('repair_follow_counts', stdout=StringIO())
+
+        alice = Profile.objects.get(user=self.alice)
+        bob = Profile.objects.get(user=self.bob)
+        self.assertEqual((alice.followers_count, alice.following_count), (0, 1))
+        self.assertEqual((bob.followers_count, bob.following_count), (1, 0))
+
+
+class ConcurrentEngagementTests(TransactionTestCase):
+    THREADS = 16
+
+    def setUp(self):
+        caches['counters'].clear()
+
+    def test_parallel_likes_are_counted_exactly(self):
+        owner = make_user('owner')
+        video = Video.objects.create(user=owner, username=owner.username, description='viral')
+        likers = [make_user(f'liker{i}') for i in range(self.THREADS)]
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def like(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                response = client.post(f'/api/videos/{video.pk}/like/')
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=like, args=(user,)) for user in likers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        video_counters.flush()
+        video.refresh_from_db()
+        self.assertEqual(video.likes, self.THREADS)
+        self.assertEqual(Like.objects.filter(video=video).count(), self.THREADS)
+
+
+class BattleVoteTests(TestCase):
+    def setUp(self):
+        self.host = make_user('host')
+        self.rival = make_user('rival')
+        room = LiveRoom.objects.create(host=self.host, title='Battle night', status='live')
+        self.battle = LiveBattle.objects.create(live_room=room, participant1=self.host, participant2=self.rival)
+        self.client = APIClient()
+
+    def _vote(self, user, participant, **headers):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/live-battles/{self.battle.pk}/vote/', {'participant': participant},
+                                    format='json', headers=headers)
+
+    def test_votes_are_charged_at_once_and_tallied_on_flush(self):
+        fan = make_user('fan')
+        Profile.objects.filter(user=fan).update(vyra_points=VOTE_COST * 3)
+        for participant in ('1', '2', '2'):
+            response = self._vote(fan, participant)
+        self.assertEqual(response.json(), {'voted': True, 'participant1Votes': 1, 'participant2Votes': 2})
+        self.assertEqual(Profile.objects.get(user=fan).vyra_points, 0)
+        # Every debit has its ledger row before any flush
+        self.assertEqual(
+            list(VyRaPointsTransaction.objects.filter(user=fan).values_list('points', 'transaction_type', 'description')),
+            [(-VOTE_COST, 'spent', f'Voted in live battle: {self.battle.pk}')] * 3,
+        )
+        # and every vote its shard count, so a restart loses nothing
+        self.assertEqual(LiveBattle.objects.get(pk=self.battle.pk).participant2_votes, 0)
+        self.assertEqual(battle_votes.pending(self.battle.pk), {'participant1_votes': 1, 'participant2_votes': 2})
+        listed = self.client.get('/api/live-battles/').json()['results'][0]
+        self.assertEqual((listed['participant1Votes'], listed['participant2Votes']), (1, 2))
+
+        with self.assertNumQueries(8), self.captureOnCommitCallbacks(execute=True):
+            # Savepoint, battles with votes, battle locks, shards, tally UPDATE, shard DELETE, release, totals
+            battle_votes.flush()
+        battle = LiveBattle.objects.get(pk=self.battle.pk)
+        self.assertEqual((battle.participant1_votes, battle.participant2_votes), (1, 2))
+        self.assertEqual(battle_votes.pending(self.battle.pk), {})
+        self.assertEqual(self.client.get(f'/api/live-battles/{self.battle.pk}/').json()['participant2Votes'], 2)
+
+    def test_retried_vote_is_charged_and_counted_once(self):
+        fan = make_user('fan')
+        Profile.objects.filter(user=fan).update(vyra_points=VOTE_COST * 3)
+        for _ in range(2):
+            self.assertEqual(self._vote(fan, '1', Idempotency_Key='tap-1').status_code, 200)
+        self.assertEqual(Profile.objects.get(user=fan).vyra_points, VOTE_COST * 2)
+        self.assertEqual(VyRaPointsTransaction.objects.filter(user=fan).count(), 1)
+        self.assertEqual(battle_votes.pending(self.battle.pk), {'participant1_votes': 1})
+
+    def test_ending_the_battle_writes_the_last_votes(self):
+        fan = make_user('fan')
+        Profile.objects.filter(user=fan).update(vyra_points=VOTE_COST * 3)
+        for participant in ('2', '2', '1'):
+            self._vote(fan, participant)
+        self.client.force_authenticate(self.host)
+        response = self.client.post(f'/api/live-battles/{self.battle.pk}/end/')
+        self.assertEqual(response.json(), {
+            'ended': True, 'participant1Votes': 1, 'participant2Votes': 2, 'winnerId': str(self.rival.pk),
+        })
+        self.assertEqual(battle_votes.pending(self.battle.pk), {})
+        self.assertIsNotNone(LiveBattle.objects.get(pk=self.battle.pk).ended_at)
+        self.assertEqual(self._vote(fan, '1').json(), {'error': 'Battle has ended'})
+
+    def test_vote_reaching_an_ended_battle_is_not_charged(self):
+        fan = make_user('fan')
+        Profile.objects.filter(user=fan).update(vyra_points=VOTE_COST)
+        self._vote(fan, '1')
+        Profile.objects.filter(user=fan).update(vyra_points=VOTE_COST)
+        battle = LiveBattle.objects.get(pk=self.battle.pk)  # Still open when the view looked
+        end_battle(LiveBattle.objects.get(pk=self.battle.pk))
+        with self.assertRaises(BattleEnded):
+            cast_vote(battle, fan.pk, '2')
+        self.assertEqual(Profile.objects.get(user=fan).vyra_points, VOTE_COST)
+        self.assertEqual(VyRaPointsTransaction.objects.filter(user=fan).count(), 1)
+
+    def test_vote_without_points_is_refused(self):
+        fan = make_user('fan')
+        Profile.objects.filter(user=fan).update(vyra_points=VOTE_COST - 1)
+        response = self._vote(fan, '1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Insufficient VyRa Points'})
+        self.assertEqual(Profile.objects.get(user=fan).vyra_points, VOTE_COST - 1)
+        self.assertEqual(battle_votes.pending(self.battle.pk), {})
+
+
+class ConcurrentBattleVoteTests(TransactionTestCase):
+    THREADS = 16
+
+    def setUp(self):
+        caches['counters'].clear()
+
+    def test_parallel_votes_never_overdraw(self):
+        host, rival, fan = make_user('host'), make_user('rival'), make_user('fan')
+        room = LiveRoom.objects.create(host=host, title='Battle night', status='live')
+        battle = LiveBattle.objects.create(live_room=room, participant1=host, participant2=rival)
+        Profile.objects.filter(user=fan).update(vyra_points=VOTE_COST * 5)
+        barrier = threading.Barrier(self.THREADS)
+        statuses = []
+
+        def vote():
+            client = APIClient()
+            client.force_authenticate(fan)
+            try:
+                barrier.wait()
+                statuses.append(client.post(f'/api/live-battles/{battle.pk}/vote/', {'participant': '1'}).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=vote) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        battle_votes.flush()
+        self.assertEqual(sorted(statuses), [200] * 5 + [400] * (self.THREADS - 5))
+        self.assertEqual(Profile.objects.get(user=fan).vyra_points, 0)
+        self.assertEqual(LiveBattle.objects.get(pk=battle.pk).participant1_votes, 5)
+        self.assertEqual(
+            VyRaPointsTransaction.objects.filter(user=fan).aggregate(total=Sum('points'))['total'], -VOTE_COST * 5
+        )
+
+
+    def test_votes_during_flushes_and_the_end_are_counted_once(self):
+        host, rival = make_user('host'), make_user('rival')
+        fans = [make_user(f'fan{i}') for i in range(4)]
+        room = LiveRoom.objects.create(host=host, title='Battle night', status='live')
+        battle = LiveBattle.objects.create(live_room=room, participant1=host, participant2=rival)
+        Profile.objects.filter(user__in=fans).update(vyra_points=VOTE_COST * 10)
+        counted, errors = [], []
+
+        def vote(fan):
+            try:
+                for i in range(10):
+                    try:
+                        counted.append(cast_vote(battle, fan.pk, '12'[i % 2]))
+                    except BattleEnded:
+                        pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        def flush():
+            try:
+                for _ in range(5):
+                    battle_votes.flush()
+                end_battle(battle)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=vote, args=(fan,)) for fan in fans] + [threading.Thread(target=flush)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        battle.refresh_from_db()
+        self.assertIsNotNone(battle.ended_at)
+        spent = -VyRaPointsTransaction.objects.filter(user__in=fans).aggregate(total=Sum('points'))['total']
+        self.assertEqual(battle.participant1_votes + battle.participant2_votes, spent // VOTE_COST)
+        self.assertEqual(sum(counted), spent // VOTE_COST)
+        self.assertFalse(BattleVoteShard.objects.exists())
+
+
+@override_settings(POINTS_AWARD_FLUSH_INTERVAL=60)
+class PointsLedgerTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        points.point_awards.flush()  # Restart the flush interval
+        self.user = make_user('spender')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _post(self, url, data=None, **headers):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(url, data or {}, format='json', headers=headers)
+
+    def _ledger_total(self):
+        return VyRaPointsTransaction.objects.filter(user=self.user).aggregate(total=Sum('points'))['total'] or 0
+
+    def test_spend_refuses_overdraft_and_writes_nothing(self):
+        points.award(self.user.pk, 30, 'Starting points')
+        with self.assertRaises(points.InsufficientPoints):
+            points.spend(self.user.pk, 31, 'Too much')
+        self.assertEqual(Profile.objects.get(user=self.user).vyra_points, 30)
+        self.assertEqual(self._ledger_total(), 30)
+
+    def test_keyed_spend_and_purchase_are_charged_once(self):
+        points.award(self.user.pk, 300, 'Starting points')
+        video = Video.objects.create(user=self.user, username=self.user.username, description='boost me')
+        for _ in range(2):
+            response = self._post(f'/api/videos/{video.pk}/boost/', {'boost_type': 'glow'}, Idempotency_Key='tap-1')
+        self.assertEqual(response.json(), {'boosted': True, 'boostScore': 10, 'remainingPoints': 250})
+
+        skin = ProfileSkin.objects.create(name='Neon', primary_color='#000000', secondary_color='#ffffff', cost_points=100)
+        self.assertEqual(points.spend(self.user.pk, 100, 'Purchased skin', key=f'skin:{skin.pk}:{self.user.pk}'), True)
+        response = self._post(f'/api/profile-skins/{skin.pk}/purchase/')  # Retried after the charge went through
+        self.assertEqual(response.json(), {'purchased': True, 'remainingPoints': 150})
+        self.assertTrue(UserSkin.objects.filter(user=self.user, skin=skin).exists())
+        self.assertEqual(self._ledger_total(), 150)
+
+    def test_micro_awards_are_buffered_and_flushed_per_reason(self):
+        owner = make_user('owner')
+        videos = [Video.objects.create(user=owner, username=owner.username, description=f'v{i}') for i in range(3)]
+        for video in videos:
+            self._post(f'/api/videos/{video.pk}/like/')
+        self._post(f'/api/videos/{videos[0].pk}/share/')
+        self.assertEqual(Profile.objects.get(user=self.user).vyra_points, 0)
+        self.assertEqual(self.client.get('/api/vyra-points/total/').json(), {'totalPoints': 4})
+
+        points.point_awards.flush()
+        self.assertEqual(Profile.objects.get(user=self.user).vyra_points, 4)
+        self.assertEqual(
+            sorted(VyRaPointsTransaction.objects.filter(user=self.user).values_list('description', 'points')),
+            [('Liked videos (3)', 3), ('Shared videos (1)', 1)],
+        )
+        call_command('reconcile_points', '--dry-run', stdout=StringIO())
+
+    def test_boost_reranks_the_video(self):
+        points.award(self.user.pk, 100, 'Starting points')
+        video = Video.objects.create(user=self.user, username=self.user.username, description='boost me')
+        Video.objects.filter(pk=video.pk).update(updated_at=timezone.now() - timedelta(days=1))
+        before = Video.objects.get(pk=video.pk)
+        self._post(f'/api/videos/{video.pk}/boost/', {'boost_type': 'glow'})
+        after = Video.objects.get(pk=video.pk)
+        self.assertGreater(after.updated_at, before.updated_at)
+        self.assertGreater(after.trending_score, before.trending_score)
+        self.assertAlmostEqual(after.trending_score, trending.trending_score(after))
+
+    def test_reconcile_points_records_adjustments(self):
+        points.award(self.user.pk, 10, 'Uploaded video')
+        Profile.objects.filter(user=self.user).update(vyra_points=25)  # Written outside the ledger
+        with self.assertRaises(CommandError):
+            call_command('reconcile_points', stdout=StringIO())
+        self.assertFalse(VyRaPointsTransaction.objects.filter(description='Ledger reconciliation').exists())
+
+        out = StringIO()
+        call_command('reconcile_points', '--adjust', stdout=out)
+        self.assertIn(f'{self.user.pk}: balance 25, ledger 10', out.getvalue())
+        adjustment = VyRaPointsTransaction.objects.get(user=self.user, description='Ledger reconciliation')
+        self.assertEqual((adjustment.points, adjustment.transaction_type), (15, 'reward'))
+        call_command('reconcile_points', '--dry-run', stdout=StringIO())
+
+
+class ConcurrentSpendTests(TransactionTestCase):
+    THREADS = 8
+
+    def test_parallel_boosts_never_overdraw(self):
+        seller = make_user('seller')
+        points.award(seller.pk, 300, 'Starting points')
+        product = Product.objects.create(seller=seller, seller_name=seller.username, name='Hoodie', description='d', price=10)
+        barrier = threading.Barrier(self.THREADS)
+        statuses = []
+
+        def boost():
+            client = APIClient()
+            client.force_authenticate(seller)
+            try:
+                barrier.wait()
+                statuses.append(client.post(f'/api/products/{product.pk}/boost/').status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=boost) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200] * 3 + [400] * (self.THREADS - 3))
+        self.assertEqual(Profile.objects.get(user=seller).vyra_points, 0)
+        self.assertEqual(Product.objects.get(pk=product.pk).boost_score, 60)
+        self.assertFalse(points.drifted_balances().exists())
+
+
+class VideoCounterBufferTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.owner = make_user('owner')
+        self.video = Video.objects.create(user=self.owner, username=self.owner.username, description='clip')
+        self.client = APIClient()
+
+    def _like_as(self, username):
+        self.client.force_authenticate(make_user(username))
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/videos/{self.video.pk}/like/')
+
+    def test_reads_merge_buffered_deltas(self):
+        self._like_as('a')
+        self._like_as('b')
+        self.assertEqual(Video.objects.get(pk=self.video.pk).likes, 0)
+
+        response = self.client.get(f'/api/videos/{self.video.pk}/')
+        self.assertEqual(response.json()['likes'], 2)
+
+        self.assertEqual(video_counters.flush(), 1)
+        self.assertEqual(Video.objects.get(pk=self.video.pk).likes, 2)
+        self.assertEqual(self.client.get(f'/api/videos/{self.video.pk}/').json()['likes'], 2)
+
+    def test_flush_is_exactly_once(self):
+        video_counters.add(self.video.pk, 'shares', 3)
+        video_counters.flush()
+        video_counters.flush()
+        self.assertEqual(Video.objects.get(pk=self.video.pk).shares, 3)
+
+        video_counters.add(self.video.pk, 'shares', 2)
+        video_counters.flush()
+        self.assertEqual(Video.objects.get(pk=self.video.pk).shares, 5)
+        self.assertEqual(video_counters.pending(self.video.pk), {})
+
+    def test_interrupted_flush_is_settled_not_reapplied(self):
+        video_counters.add(self.video.pk, 'buzz_count', 4)
+        settle = video_counters._settle
+        video_counters._settle = lambda deltas: None  # Crash after commit, before settling
+        try:
+            video_counters.flush()
+        finally:
+            video_counters._settle = settle
+        self.assertEqual(CounterFlushBatch.objects.count(), 1)
+
+        video_counters.flush()
+        self.assertEqual(Video.objects.get(pk=self.video.pk).buzz_count, 4)
+        self.assertEqual(video_counters.pending(self.video.pk), {})
+
+
+class CounterFlusherTests(TransactionTestCase):
+    @override_settings(COUNTER_FLUSH_THREAD=True)
+    def test_quiet_rows_are_flushed_by_the_thread(self):
+        caches['counters'].clear()
+        owner = make_user('quiet')
+        video = Video.objects.create(user=owner, username=owner.username, description='clip')
+        buffer = VideoCounterBuffer(flush_interval=0.2, key_prefix='quiet-counter')
+        buffer.add(video.pk, 'likes')  # The only increment: nothing else would flush it
+        self.assertEqual(Video.objects.get(pk=video.pk).likes, 0)
+        deadline = time.monotonic() + 5
+        while Video.objects.get(pk=video.pk).likes == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(Video.objects.get(pk=video.pk).likes, 1)
+        self.assertEqual(buffer.pending(video.pk), {})
+
+
+class BoardTests(TestCase):
+    def test_ranks_and_top_k(self):
+        board = leaderboards.Board(2, {1: 10, 2: 30, 3: 20})
+        self.assertEqual(board.leaders(5), [(2, 30), (3, 20)])
+        self.assertEqual([board.rank(user) for user in (1, 2, 3, 4)], [3, 1, 2, None])
+
+        board.set(1, 30)  # Ties share a rank and enter the top K
+        self.assertEqual((board.rank(1), board.rank(2), board.rank(3)), (1, 1, 3))
+        self.assertEqual(board.leaders(5), [(1, 30), (2, 30)])
+        board.set(4, 40)
+        board.set(3, 35)
+        self.assertEqual(board.leaders(5), [(4, 40), (3, 35)])
+        board.set(4, 5)  # A drop (after a rebuild) recomputes the top K
+        self.assertEqual(board.leaders(5), [(3, 35), (1, 30)])
+        self.assertEqual(board.rank(4), 4)
+
+
+@override_settings(POINTS_AWARD_FLUSH_INTERVAL=60, LEADERBOARD_SYNC_SECONDS=0)
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        points.point_awards.flush()
+        leaderboards.leaderboards.reset()
+        self.owner = make_user('owner')
+        self.video = Video.objects.create(user=self.owner, username=self.owner.username, description='#dance')
+        self.hashtag = Hashtag.objects.create(name='dance')
+        self.hashtag.videos.add(self.video)
+        self.fans = [make_user(f'fan{i}') for i in range(3)]
+        self.client = APIClient()
+
+    def _engage(self, user, *actions):
+        self.client.force_authenticate(user)
+        for action in actions:
+            data = {'text': 'nice'} if action == 'add_comment' else {}
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/videos/{self.video.pk}/{action}/', data, format='json')
+
+    def _board(self, **params):
+        self.client.force_authenticate(self.owner)
+        return [(row['user__username'], row['total_points'], row['rank'])
+                for row in self.client.get('/api/vyra-points/leaderboard/', params).json()]
+
+    def test_boards_follow_awards(self):
+        self._engage(self.fans[0], 'like', 'buzz')
+        self._engage(self.fans[1], 'like', 'share')
+        self._engage(self.fans[2], 'like')
+        points.point_awards.flush()
+        self.assertEqual(self._board(), [('fan0', 4, 1), ('fan1', 2, 2), ('fan2', 1, 3)])
+
+        self._engage(self.fans[2], 'buzz', 'add_comment')
+        points.point_awards.flush()
+        expected = [('fan2', 6, 1), ('fan0', 4, 2), ('fan1', 2, 3)]
+        for period in leaderboards.PERIODS:
+            self.assertEqual(self._board(period=period), expected, period)
+        self.assertEqual(self._board(hashtag='#dance'), expected)
+        self.assertEqual(self.client.get('/api/vyra-points/leaderboard/', {'hashtag': 'other'}).status_code, 404)
+
+        club = Club.objects.create(name='Crew', description='d', category='Dance', creator=self.owner)
+        ClubMember.objects.create(club=club, user=self.fans[0])
+        ClubMember.objects.create(club=club, user=self.fans[1])
+        self.assertEqual(self._board(club=club.pk), [('fan0', 4, 1), ('fan1', 2, 2)])
+
+        self.client.force_authenticate(self.fans[1])
+        self.assertEqual(self.client.get('/api/vyra-points/rank/').json(),
+                         {'userId': str(self.fans[1].pk), 'period': 'weekly', 'rank': 3, 'points': 2})
+        rank = self.client.get('/api/vyra-points/rank/', {'club': club.pk, 'period': 'all'}).json()
+        self.assertEqual((rank['rank'], rank['points']), (2, 2))
+        self.assertEqual(self.client.get('/api/vyra-points/rank/', {'user': self.owner.pk}).json()['rank'], None)
+        self.assertEqual(self.client.get('/api/vyra-points/leaderboard/', {'period': 'monthly'}).status_code, 400)
+
+    def test_weekly_board_sums_the_last_seven_days(self):
+        today = timezone.localdate()
+        LeaderboardDay.objects.bulk_create([
+            LeaderboardDay(day=today - timedelta(days=6), user=self.fans[0], points=5),
+            LeaderboardDay(day=today - timedelta(days=7), user=self.fans[1], points=50),
+            LeaderboardDay(day=today, user=self.fans[1], points=3),
+        ])
+        self.assertEqual(self._board(), [('fan0', 5, 1), ('fan1', 3, 2)])
+        self.assertEqual(self._board(period='daily'), [('fan1', 3, 1)])
+
+    def test_refreshes_query_outside_the_boards_lock(self):
+        boards = leaderboards.leaderboards
+        today = timezone.localdate()
+        LeaderboardDay.objects.create(day=today, user=self.fans[0], points=5)
+        LeaderboardTotal.objects.create(user=self.fans[0], points=5)
+        locked = []
+
+        def record(execute, sql, params, many, context):
+            locked.append(boards._lock.locked())
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            self.assertEqual(leaderboards.top('daily', 10), [(self.fans[0].pk, 5)])  # First load
+            LeaderboardDay.objects.filter(user=self.fans[0]).update(points=8, updated_at=timezone.now())
+            self.assertEqual(leaderboards.top('daily', 10), [(self.fans[0].pk, 8)])  # Catch-up
+
+            # While one request refreshes, the others read the boards as they are
+            LeaderboardDay.objects.filter(user=self.fans[0]).update(points=9, updated_at=timezone.now())
+            with boards._refreshing, self.assertNumQueries(0):
+                self.assertEqual(leaderboards.rank('daily', self.fans[0].pk), (1, 8))
+
+            with patch('core.leaderboards.timezone.localdate', return_value=today + timedelta(days=1)):
+                self.assertEqual(leaderboards.top('daily', 10), [])  # Next day's load
+                self.assertEqual(leaderboards.rank('all', self.fans[0].pk), (1, 5))
+        self.assertTrue(locked)
+        self.assertNotIn(True, locked)
+
+    def test_rebuild_matches_incremental_boards(self):
+        points.award(self.owner.pk, points.UPLOAD_POINTS, 'Uploaded video', video=self.video)
+        self._engage(self.fans[0], 'like', 'buzz', 'add_comment')
+        self._engage(self.fans[1], 'share')
+        points.award(self.fans[1].pk, 7, 'Bonus')
+        points.point_awards.flush()
+
+        def snapshot():
+            return (
+                sorted(LeaderboardDay.objects.values_list('scope', 'day', 'user_id', 'points')),
+                sorted(LeaderboardTotal.objects.values_list('scope', 'user_id', 'points')),
+            )
+        incremental = snapshot()
+        self.assertIn((leaderboards.hashtag_scope(self.hashtag.pk), self.fans[0].pk, 6), incremental[1])
+        call_command('rebuild_leaderboards', stdout=StringIO())
+        self.assertEqual(snapshot(), incremental)
+
+
+class PointsRollupTests(TestCase):
+    def setUp(self):
+        self.user = make_user('earner')
+        self.video = Video.objects.create(user=self.user, username=self.user.username, description='mine')
+        self.old = timezone.now() - timedelta(days=40)
+
+    def _award(self, amount, description, days_ago=40, **kwargs):
+        points.award(self.user.pk, amount, description, **kwargs)
+        row = VyRaPointsTransaction.objects.latest('created_at')
+        VyRaPointsTransaction.objects.filter(pk=row.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+
+    def _rows(self):
+        return sorted(VyRaPointsTransaction.objects.values_list('transaction_type', 'points', 'folded', 'description'))
+
+    def test_rollup_folds_old_rows_and_keeps_the_ledger_provable(self):
+        for _ in range(3):
+            self._award(1, 'Liked videos (1)')
+        self._award(2, 'Commented on videos (1)', video=self.video)
+        self._award(50, 'Claimed challenge', key='claim:1')
+        self._award(1, 'Liked videos (1)', days_ago=1)
+        self._award(1, 'Liked videos (1)', days_ago=1)
+        call_command('rebuild_leaderboards', stdout=StringIO())
+        boards = sorted(LeaderboardDay.objects.values_list('scope', 'day', 'user_id', 'points'))
+
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('rollup_points', stdout=StringIO())
+        day = timezone.localdate(self.old).isoformat()
+        self.assertEqual(self._rows(), [
+            ('earned', 1, 0, 'Liked videos (1)'),
+            ('earned', 1, 0, 'Liked videos (1)'),
+            ('earned', 2, 0, 'Commented on videos (1)'),  # Alone in its group
+            ('earned', 3, 3, f'Daily total of 3 transactions on {day}'),
+            ('earned', 50, 0, 'Claimed challenge'),  # Keyed rows are kept
+        ])
+        call_command('reconcile_points', '--dry-run', stdout=StringIO())
+        call_command('rebuild_leaderboards', stdout=StringIO())
+        self.assertEqual(sorted(LeaderboardDay.objects.values_list('scope', 'day', 'user_id', 'points')), boards)
+        for query in ctx.captured_queries:
+            # Reads and writes of existing rows; not inserts, nor creating the coming months' partitions
+            if 'core_vyrapointstransaction' in query['sql'] and query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE')):
+                self.assertNotRegex(explain(query['sql']), full_scan_pattern('core_vyrapointstransaction'))
+
+        # A summary row is folded again with later rows of its day
+        self._award(1, 'Liked videos (1)')
+        call_command('rollup_points', stdout=StringIO())
+        self.assertIn(('earned', 4, 4, f'Daily total of 4 transactions on {day}'), self._rows())
+        self.assertEqual(Profile.objects.get(user=self.user).vyra_points, 58)
+
+    def test_idempotency_keys_survive_rollup(self):
+        self.assertTrue(points.award(self.user.pk, 5, 'Claimed challenge', key='claim:7'))
+        VyRaPointsTransaction.objects.update(created_at=self.old)
+        call_command('rollup_points', stdout=StringIO())
+        self.assertFalse(points.award(self.user.pk, 5, 'Claimed challenge', key='claim:7'))
+        self.assertEqual(PointsIdempotencyKey.objects.get().key, 'claim:7')
+        self.assertEqual(points.balance(self.user.pk), 5)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=directory, VIDEO_UPLOAD_DIR=os.path.join(directory, 'chunks'))
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = make_user('uploader')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = bytes(range(256)) * 4 + b'tail'  # 1028 bytes: 400, 400 and 228
+
+    def _start(self, **fields):
+        body = {'filename': 'clip.mp4', 'size': len(self.data), 'chunkSize': 400,
+                'checksum': hashlib.sha256(self.data).hexdigest(), **fields}
+        response = self.client.post('/api/videos/uploads/', body, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def _put(self, upload, index, body=None, checksum=None):
+        body = self.data[index * 400:(index + 1) * 400] if body is None else body
+        headers = {'X-Chunk-SHA256': checksum or hashlib.sha256(body).hexdigest()}
+        return self.client.put(f'/api/videos/uploads/{upload["uploadId"]}/chunks/{index}/', body,
+                               content_type='application/octet-stream', headers=headers)
+
+    def _finalize(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/videos/uploads/{upload["uploadId"]}/finalize/',
+                                    {'description': 'chunked #dance', 'hashtags': 'dance'}, format='json')
+
+    def test_upload_resumes_and_finalizes_into_a_video(self):
+        upload = self._start()
+        self.assertEqual((upload['chunkCount'], upload['receivedChunks']), (3, []))
+        self.assertEqual(self._put(upload, 2).status_code, 200)
+        self.assertEqual(self._put(upload, 1).status_code, 200)
+        # A corrupted chunk is refused and not recorded
+        self.assertEqual(self._put(upload, 0, checksum='0' * 64).status_code, 400)
+        state = self.client.get(f'/api/videos/uploads/{upload["uploadId"]}/').json()
+        self.assertEqual(state['receivedChunks'], [1, 2])
+
+        self.assertEqual(self._finalize(upload).status_code, 409)  # Chunk 0 is missing
+        self.assertEqual(self._put(upload, 0).status_code, 200)
+        self.assertEqual(self._put(upload, 0).status_code, 200)  # Retries replace the chunk
+        response = self._finalize(upload)
+        self.assertEqual(response.status_code, 201, response.content)
+
+        video = Video.objects.get()
+        with video.video_file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.data)
+        self.assertEqual((video.user, video.description), (self.user, 'chunked #dance'))
+        self.assertTrue(video.hashtags.filter(name='dance').exists())
+        self.assertEqual(Profile.objects.get(user=self.user).vyra_points, points.UPLOAD_POINTS)
+        self.assertFalse(os.path.exists(os.path.join(settings.VIDEO_UPLOAD_DIR, upload['uploadId'])))
+
+        # Finalizing again returns the same video; no more chunks are taken
+        again = self._finalize(upload)
+        self.assertEqual((again.status_code, again.json()['id']), (200, str(video.pk)))
+        self.assertEqual(self._put(upload, 0).status_code, 409)
+        self.assertEqual(Video.objects.count(), 1)
+
+    def test_bad_chunks_and_files_are_refused(self):
+        upload = self._start()
+        self.assertEqual(self._put(upload, 0, body=b'short').status_code, 400)
+        self.assertEqual(self._put(upload, 3, body=b'x').status_code, 404)
+        self.client.force_authenticate(make_user('someone'))
+        self.assertEqual(self._put(upload, 0).status_code, 404)
+        self.client.force_authenticate(self.user)
+
+        # The whole file is checked on finalize too
+        upload = self._start(checksum=hashlib.sha256(b'something else').hexdigest())
+        for index in range(3):
+            self._put(upload, index)
+        response = self._finalize(upload)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['receivedChunks'], [0, 1, 2])
+        self.assertEqual(VideoUpload.objects.get(pk=upload['uploadId']).status, 'uploading')
+        self.assertFalse(Video.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'videos')), [])
+
+        self.assertEqual(self.client.post('/api/videos/uploads/', {'filename': 'big.mp4', 'size': 10 ** 13},
+                                          format='json').status_code, 413)
+
+    def test_idle_uploads_are_purged(self):
+        long_ago = timezone.now() - timedelta(hours=settings.VIDEO_UPLOAD_EXPIRE_HOURS + 1)
+        idle, active, assembling, complete = (self._start() for _ in range(4))
+        for upload in (idle, active, assembling, complete):
+            self._put(upload, 0)
+        VideoUpload.objects.update(created_at=long_ago, last_activity_at=long_ago)
+        # Started long ago, but still sending chunks
+        self.assertEqual(self._put(active, 1).status_code, 200)
+        VideoUpload.objects.filter(pk=assembling['uploadId']).update(status='assembling')
+        VideoUpload.objects.filter(pk=complete['uploadId']).update(status='complete')
+
+        call_command('purge_video_uploads', stdout=StringIO())
+        self.assertEqual(
+            sorted(VideoUpload.objects.values_list('status', flat=True)), ['assembling', 'complete', 'uploading']
+        )
+        self.assertFalse(VideoUpload.objects.filter(pk=idle['uploadId']).exists())
+        self.assertFalse(os.path.exists(os.path.join(settings.VIDEO_UPLOAD_DIR, idle['uploadId'])))
+        self.assertTrue(os.path.exists(os.path.join(settings.VIDEO_UPLOAD_DIR, assembling['uploadId'], '0.part')))
+
+    def test_chunk_reaching_an_expired_upload_is_refused(self):
+        upload = self._start()
+        long_ago = timezone.now() - timedelta(hours=settings.VIDEO_UPLOAD_EXPIRE_HOURS + 1)
+        VideoUpload.objects.update(last_activity_at=long_ago)
+        record = VideoUpload.objects.get()
+        # Listed as expired; the chunk arrives before the purge claims it, and keeps it
+        self.assertEqual(list(uploads.expired_uploads()), [record])
+        self.assertEqual(self._put(upload, 0).status_code, 200)
+        self.assertFalse(uploads.expire(record))
+        # Claimed by the purge first: the chunk is refused rather than written into a deleted upload
+        VideoUpload.objects.update(last_activity_at=long_ago)
+        self.assertTrue(uploads.expire(record))
+        self.assertEqual(self._put(upload, 1).status_code, 409)
+
+
+class MediaPipelineTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=directory)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.user = make_user('director')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _video(self, content=b'not really a video'):
+        video = Video(user=self.user, username=self.user.username, description='clip')
+        video.video_file.save('clip.mp4', ContentFile(content))
+        return video
+
+    def _enqueue(self, video):
+        with self.captureOnCommitCallbacks(execute=True):
+            media.enqueue(video)
+        media.run_pending()
+        return MediaJob.objects.get(pk=video.pk)
+
+    @override_settings(FFMPEG_BINARY='/nonexistent/ffmpeg')
+    def test_uploads_are_queued_until_ffmpeg_is_installed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/videos/', {
+                'description': 'fresh', 'video_file': ContentFile(b'frames', name='fresh.mp4'),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['processing']['status'], 'queued')
+        job = MediaJob.objects.get(pk=response.json()['id'])
+        self.assertEqual((job.status, job.attempts), ('queued', 0))
+        with self.assertRaises(CommandError):
+            call_command('process_media_jobs', stdout=StringIO())
+
+        # Videos never queued (e.g. linked by URL) have no processing state
+        Video.objects.create(user=self.user, username=self.user.username, description='linked',
+                             video_url='https://cdn.example.com/v.mp4')
+        with self.assertNumQueries(4):  # Follows, count, page with jobs joined, hashtags
+            results = {video['description']: video for video in self.client.get('/api/videos/').json()['results']}
+        self.assertIsNone(results['linked']['processing'])
+
+    @override_settings(FFMPEG_BINARY='true', FFPROBE_BINARY='false')
+    def test_failing_jobs_are_retried_then_given_up(self):
+        job = self._enqueue(self._video())
+        self.assertEqual((job.status, job.attempts), ('failed', settings.MEDIA_PROCESSING_MAX_ATTEMPTS))
+        self.assertIn('exited with 1', job.error)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, media.PROCESSED_DIR)), [])
+
+    @override_settings(FFMPEG_BINARY='true', FFPROBE_BINARY='true')
+    def test_stale_running_jobs_are_reclaimed(self):
+        stale, fresh = self._video(), self._video()
+        long_ago = timezone.now() - timedelta(seconds=settings.MEDIA_PROCESSING_LEASE + 1)
+        MediaJob.objects.create(video=stale, status='running', attempts=1, started_at=long_ago)
+        MediaJob.objects.create(video=fresh, status='running', attempts=1, started_at=timezone.now())
+
+        job = media.claim_next()
+        self.assertEqual((job.pk, job.status, job.attempts), (stale.pk, 'running', 2))
+        self.assertIsNone(media.claim_next())
+        # The worker that timed out cannot record over the new claim
+        timed_out = MediaJob.objects.select_related('video').get(pk=stale.pk)
+        timed_out.attempts = 1
+        self.assertFalse(media.process(timed_out))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ('running', 2, ''))
+
+    @override_settings(FFMPEG_BINARY='true', FFPROBE_BINARY='true')
+    def test_unexpected_errors_requeue_the_job(self):
+        video = self._video()
+        with self.captureOnCommitCallbacks(execute=True):
+            media.enqueue(video)
+        job = media.claim_next()
+        with patch('core.media.render', side_effect=OSError('No space left on device')), self.assertLogs('core.media'):
+            self.assertFalse(media.process(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertEqual(job.error, 'OSError: No space left on device')
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, media.output_name(video))))
+
+    def test_ladder_follows_the_short_side(self):
+        self.assertEqual(media.ladder(1080, 1920), [
+            ('1080p', 1080, 1920, 5000, 128), ('720p', 720, 1280, 2800, 128), ('480p', 480, 854, 1200, 96),
+            ('360p', 360, 640, 700, 64), ('240p', 240, 426, 400, 64),
+        ])
+        self.assertEqual([rung[:3] for rung in media.ladder(640, 360)], [('360p', 640, 360), ('240p', 426, 240)])
+        self.assertEqual([rung[:3] for rung in media.ladder(200, 150)], [('240p', 200, 150)])  # Never upscaled
+        self.assertIn('RESOLUTION=640x360\n360p.m3u8', media.master_playlist(media.ladder(640, 360)))
+
+    @skipUnless(shutil.which('ffmpeg') and shutil.which('ffprobe'), 'needs ffmpeg and ffprobe')
+    def test_video_is_processed_into_poster_preview_and_renditions(self):
+        source = os.path.join(settings.MEDIA_ROOT, 'source.mp4')
+        subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=25:duration=3',
+                        '-f', 'lavfi', '-i', 'sine=duration=3', '-shortest', '-pix_fmt', 'yuv420p', source], check=True)
+        with open(source, 'rb') as clip:
+            video = self._video(clip.read())
+        job = self._enqueue(video)
+        self.assertEqual(job.status, 'done', job.error)
+        self.assertEqual((job.width, job.height), (640, 360))
+        self.assertAlmostEqual(job.duration, 3, delta=0.2)
+        self.assertEqual([rendition['height'] for rendition in job.renditions], [360, 240])
+        for name in [job.poster, job.preview, job.hls_manifest] + [r['playlist'] for r in job.renditions]:
+            self.assertTrue(os.path.getsize(os.path.join(settings.MEDIA_ROOT, name)))
+
+        data = self.client.get(f'/api/videos/{video.pk}/').json()
+        self.assertTrue(data['processing']['hlsUrl'].endswith(f'/media/processed/{video.pk}/master.m3u8'))
+        self.assertEqual(data['thumbnailUrl'], data['processing']['posterUrl'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.user = make_user('scroller')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _walk(self, url, params):
+        seen = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            seen.extend(item['id'] for item in data['results'])
+            if not data['next']:
+                return seen
+            response = self.client.get(data['next'])
+
+    def test_video_feed_cursor_walks_every_row_once(self):
+        videos = [
+            Video.objects.create(user=self.user, username=self.user.username, description=f'v{i}')
+            for i in range(7)
+        ]
+        # Force ties on created_at so the id tie-breaker is exercised
+        Video.objects.filter(pk__in=[v.pk for v in videos[:4]]).update(created_at=videos[0].created_at)
+
+        seen = self._walk('/api/videos/', {'cursor': '', 'page_size': 3})
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(set(seen), {str(v.pk) for v in videos})
+
+    def test_new_uploads_do_not_shift_later_pages(self):
+        for i in range(4):
+            Video.objects.create(user=self.user, username=self.user.username, description=f'v{i}')
+        first = self.client.get('/api/videos/', {'cursor': '', 'page_size': 2}).json()
+        Video.objects.create(user=self.user, username=self.user.username, description='late upload')
+        second = self.client.get(first['next']).json()
+        self.assertTrue(set(r['id'] for r in first['results']).isdisjoint(r['id'] for r in second['results']))
+        self.assertEqual(len(second['results']), 2)
+
+    def test_page_number_mode_is_unchanged(self):
+        Video.objects.create(user=self.user, username=self.user.username, description='v')
+        data = self.client.get('/api/videos/').json()
+        self.assertIn('count', data)
+        self.assertEqual(len(data['results']), 1)
+
+    def test_comments_and_notifications_support_cursor(self):
+        video = Video.objects.create(user=self.user, username=self.user.username, description='v')
+        for i in range(5):
+            Comment.objects.create(video=video, user=self.user, username=self.user.username, text=f'c{i}')
+            Notification.objects.create(user=self.user, notification_type='like', message=f'n{i}')
+
+        self.assertEqual(len(self._walk(f'/api/videos/{video.pk}/comments/', {'cursor': '', 'page_size': 2})), 5)
+        self.assertEqual(len(self._walk('/api/notifications/', {'cursor': '', 'page_size': 2})), 5)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/videos/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_forged_cursor_values_are_rejected(self):
+        video = Video.objects.create(user=self.user, username=self.user.username, description='v')
+        Comment.objects.create(video=video, user=self.user, username=self.user.username, text='c')
+        paginator = KeysetPagination()
+        forged = [
+            ['yesterday', str(video.pk)], [123, str(video.pk)], ['2026-01-01T00:00:00', str(video.pk)],
+            [timezone.now().isoformat(), 'not-a-uuid'], [timezone.now().isoformat(), None],
+            [timezone.now().isoformat(), ['nested']],
+        ]
+        for position in forged:
+            for url in ('/api/videos/', f'/api/videos/{video.pk}/comments/'):
+                response = self.client.get(url, {'cursor': paginator.encode_cursor(position)})
+                self.assertEqual(response.status_code, 404, (url, position))
+        response = self.client.get('/api/notifications/', {
+            'cursor': paginator.encode_cursor([timezone.now().isoformat(), 'x']),
+        })
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/videos/nearby/', {
+            'lat': 5.6, 'lng': -0.19, 'cursor': paginator.encode_cursor(['far', str(video.pk)]),
+        })
+        self.assertEqual(response.status_code, 404)
+
+
+class HomeTimelineTests(TestCase):
+    def setUp(self):
+        caches['counters'].clear()
+        self.viewer = make_user('viewer')
+        self.author = make_user('author')
+        self.stranger = make_user('stranger')
+        self.client = APIClient()
+
+    def _upload(self, user, privacy):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/videos/', {'description': privacy, 'privacy': privacy}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def _feed_ids(self):
+        self.client.force_authenticate(self.viewer)
+        return [item['id'] for item in self.client.get('/api/videos/', {'cursor': ''}).json()['results']]
+
+    def test_uploads_fan_out_to_followers(self):
+        follow_user(self.viewer, self.author)
+        friends_video = self._upload(self.author, 'Friends')
+        self.assertTrue(TimelineEntry.objects.filter(user=self.viewer, video_id=friends_video).exists())
+        self.assertTrue(TimelineEntry.objects.filter(user=self.author, video_id=friends_video).exists())
+
+    def test_home_feed_matches_followed_or_public_query(self):
+        follow_user(self.viewer, self.author)
+        expected = {
+            self._upload(self.author, 'Friends'),
+            self._upload(self.stranger, 'Public'),
+            self._upload(self.viewer, 'Private'),
+        }
+        self._upload(self.stranger, 'Friends')  # Not followed, not public
+
+        self.assertEqual(set(self._feed_ids()), expected)
+        call_command('check_timelines', stdout=StringIO())
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        private = self._upload(self.author, 'Private')
+        self.assertNotIn(private, self._feed_ids())
+
+        follow_user(self.viewer, self.author)
+        self.assertIn(private, self._feed_ids())
+
+        unfollow_user(self.viewer, self.author)
+        self.assertNotIn(private, self._feed_ids())
+
+    def test_high_fanout_authors_are_pulled_at_read_time(self):
+        follow_user(self.viewer, self.author)
+        with self.settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0):
+            private = self._upload(self.author, 'Private')
+            self.assertFalse(TimelineEntry.objects.filter(user=self.viewer, video_id=private).exists())
+            self.assertIn(private, self._feed_ids())
+
+    def test_backfill_timelines_command(self):
+        Follow.objects.create(follower=self.viewer, following=self.author)
+        video = Video.objects.create(user=self.author, username=self.author.username, description='old', privacy='Private')
+        call_command('backfill_timelines', stdout=StringIO())
+        self.assertTrue(TimelineEntry.objects.filter(user=self.viewer, video=video).exists())
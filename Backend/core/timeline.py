@@ -0,0 +1,124 @@
+"""Materialized home timelines.
+
+Videos are fanned out on write into ``TimelineEntry`` rows for the author and
+every follower, so reading the followed part of the home feed is one range
+scan over ``(user, created_at, video)``. Authors with more than
+``TIMELINE_FANOUT_MAX_FOLLOWERS`` followers are not fanned out; their videos
+are pulled at read time instead (hybrid fan-out-on-read).
+
+The home feed is the followed timeline merged with the global public stream,
+matching ``Q(username__in=followed_users) | Q(privacy='Public')``.
+"""
+import heapq
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Follow, Profile, TimelineEntry, Video
+from .pagination import keyset_condition
+
+FEED_ORDERING = ('-created_at', '-id')
+TIMELINE_ORDERING = ('-created_at', '-video_id')
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_MAX_FOLLOWERS', 10000)
+
+
+def backfill_limit():
+    return getattr(settings, 'TIMELINE_BACKFILL_PER_AUTHOR', 100)
+
+
+def is_fanout_author(user_id):
+    """Whether new videos by this author are pushed to followers' timelines"""
+    followers = Profile.objects.filter(user_id=user_id).values_list('followers_count', flat=True).first()
+    return (followers or 0) <= fanout_limit()
+
+
+def fan_out_video(video, batch_size=1000):
+    """Push a new video into the author's timeline and, for regular authors, every follower's"""
+    recipients = [video.user_id]
+    if is_fanout_author(video.user_id):
+        recipients.extend(
+            Follow.objects.filter(following_id=video.user_id).values_list('follower_id', flat=True)
+        )
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user_id=user_id, video_id=video.pk, created_at=video.created_at) for user_id in recipients],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    return len(recipients)
+
+
+def backfill_author(user, author, limit=None):
+    """Copy an author's most recent videos into one user's timeline (after a follow)"""
+    if author.pk != user.pk and not is_fanout_author(author.pk):
+        return 0
+    videos = Video.objects.filter(user=author).order_by(*FEED_ORDERING).values_list('pk', 'created_at')
+    entries = [
+        TimelineEntry(user=user, video_id=video_id, created_at=created_at)
+        for video_id, created_at in videos[:limit or backfill_limit()]
+    ]
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    return len(entries)
+
+
+def remove_author(user, author):
+    """Drop an author's videos from one user's timeline (after an unfollow)"""
+    deleted, _ = TimelineEntry.objects.filter(user=user, video__user=author).delete()
+    return deleted
+
+
+def _after(ordering, position):
+    return keyset_condition(ordering, position) if position is not None else Q()
+
+
+def home_feed(user, limit, position=None):
+    """Up to ``limit`` home feed videos after keyset ``position`` (created_at, id), newest first.
+
+    Three bounded range scans, merged: the user's materialized timeline,
+    non-public videos of followed high-fanout authors, and the public stream.
+    """
+    timeline = [
+        entry.video for entry in TimelineEntry.objects.filter(user=user)
+        .filter(_after(TIMELINE_ORDERING, position))
+        .select_related('video')
+        .order_by(*TIMELINE_ORDERING)[:limit]
+    ]
+
+    big_authors = Profile.objects.filter(
+        user__followers__follower=user, followers_count__gt=fanout_limit()
+    ).values_list('user_id', flat=True)
+    pulled = list(
+        Video.objects.filter(user_id__in=list(big_authors)).exclude(privacy='Public')
+        .filter(_after(FEED_ORDERING, position))
+        .order_by(*FEED_ORDERING)[:limit]
+    )
+
+    public = list(
+        Video.objects.filter(privacy='Public')
+        .filter(_after(FEED_ORDERING, position))
+        .order_by(*FEED_ORDERING)[:limit]
+    )
+
+    merged = heapq.merge(timeline, pulled, public, key=lambda video: (video.created_at, video.pk), reverse=True)
+    feed = []
+    seen = set()
+    for video in merged:
+        if video.pk in seen:
+            continue
+        seen.add(video.pk)
+        feed.append(video)
+        if len(feed) == limit:
+            break
+    return feed
+
+
+def followed_or_public_queryset(user):
+    """The on-the-fly feed query (page-number mode, and the consistency checker's reference)"""
+    followed_users = list(
+        Follow.objects.filter(follower=user).values_list('following__username', flat=True)
+    ) + [user.username]
+    return Video.objects.filter(
+        Q(username__in=followed_users) | Q(privacy='Public')
+    ).distinct().order_by(*FEED_ORDERING)
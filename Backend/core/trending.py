@@ -0,0 +1,30 @@
+"""Time-decayed trending score for videos.
+
+Ranking by ``engagement * exp(-age / tau)`` is the same as ranking by
+``log(engagement) + created_at / tau``: the ``now / tau`` term is shared by
+every video. The stored score uses the second form, so it never changes while
+a video's counters stay the same, and a refresh only has to revisit videos
+whose engagement moved (see the ``refresh_trending_scores`` command).
+"""
+import math
+
+from django.conf import settings
+from django.utils import timezone
+
+# Engagement weights (likes*2 + comments*3 + buzz*4 + boost_score*5)
+WEIGHTS = {'likes': 2, 'comments_count': 3, 'buzz_count': 4, 'boost_score': 5}
+
+
+def decay_seconds():
+    """tau: the score halves every TRENDING_HALF_LIFE_HOURS"""
+    half_life_hours = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24.0)
+    return half_life_hours * 3600 / math.log(2)
+
+
+def engagement(video):
+    return sum(max(0, getattr(video, field) or 0) * weight for field, weight in WEIGHTS.items())
+
+
+def trending_score(video):
+    created_at = video.created_at or timezone.now()
+    return math.log1p(engagement(video)) + created_at.timestamp() / decay_seconds()
@@ -0,0 +1,204 @@
+"""Resumable, chunked video uploads.
+
+A client starts an upload with the file's name and size (and, ideally, its
+SHA-256), then PUTs the file in numbered chunks of ``chunk_size`` bytes, in
+any order and as often as it needs: the upload lists the chunks received, so
+after a dropped connection only the missing ones are sent again. Finalizing
+concatenates the chunks into the video's storage path and creates the Video
+as a direct upload would.
+
+Memory stays bounded whatever the file size: a chunk is copied from the
+request body to its own file under VIDEO_UPLOAD_DIR/<upload id>/ a block at
+a time, hashed on the way, and moved into place only once it is complete and
+matches its size and optional X-Chunk-SHA256 header. Assembly copies the
+chunk files the same way, checking the whole file's checksum. A worker is
+held for one chunk, not the whole transfer.
+
+Finalizing claims the upload with a conditional UPDATE (uploading ->
+assembling), so concurrent finalize calls create one video.
+
+An upload still uploading that has not started a chunk for
+VIDEO_UPLOAD_EXPIRE_HOURS is deleted by purge_video_uploads, however long
+ago it began. The purge claims it the same way (uploading -> expired, only
+if still idle), and a chunk first bumps last_activity_at on an upload that
+is still uploading, so a chunk either keeps its upload alive or is refused;
+uploads being assembled or complete are never purged.
+"""
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Video, VideoUpload, VideoUploadChunk
+
+READ_BLOCK = 1024 * 1024
+MAX_CHUNKS = 10000
+CHECKSUM_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_dir(upload):
+    return Path(settings.VIDEO_UPLOAD_DIR) / str(upload.pk)
+
+
+def chunk_path(upload, index):
+    return upload_dir(upload) / f'{index}.part'
+
+
+def _checksum(value):
+    value = (value or '').strip().lower()
+    if value and not CHECKSUM_RE.match(value):
+        raise UploadError('Checksums are SHA-256 digests in hex')
+    return value
+
+
+def start(user, filename, size, checksum='', chunk_size=None):
+    """Create an upload session for a file of ``size`` bytes"""
+    filename = os.path.basename(str(filename or '')).strip()
+    if not filename:
+        raise UploadError('filename is required')
+    try:
+        size = int(size)
+        chunk_size = int(chunk_size or settings.VIDEO_UPLOAD_CHUNK_SIZE)
+    except (TypeError, ValueError):
+        raise UploadError('size and chunkSize must be integers')
+    if size <= 0:
+        raise UploadError('size must be positive')
+    if size > settings.VIDEO_UPLOAD_MAX_SIZE:
+        raise UploadError('File too large', status=413)
+    # Bounded both ways: a chunk is one request, and every chunk is a row
+    chunk_size = min(max(chunk_size, -(-size // MAX_CHUNKS), 1), settings.VIDEO_UPLOAD_MAX_CHUNK_SIZE)
+    return VideoUpload.objects.create(
+        user=user, filename=filename[:255], size=size, chunk_size=chunk_size, checksum=_checksum(checksum),
+    )
+
+
+def expected_length(upload, index):
+    """Size of chunk ``index``: chunk_size, except for a shorter last chunk"""
+    if not 0 <= index < upload.chunk_count:
+        raise UploadError('No such chunk', status=404)
+    return min(upload.chunk_size, upload.size - index * upload.chunk_size)
+
+
+def receive_chunk(upload, index, stream, length, checksum=''):
+    """Copy chunk ``index`` from ``stream`` to disk and record it; replaces an earlier copy"""
+    expected = expected_length(upload, index)
+    checksum = _checksum(checksum)
+    if length != expected:
+        raise UploadError(f'Chunk {index} must be {expected} bytes')
+    if not VideoUpload.objects.filter(pk=upload.pk, status='uploading').update(last_activity_at=timezone.now()):
+        raise UploadError('Upload already finalized or expired', status=409)
+    directory = upload_dir(upload)
+    directory.mkdir(parents=True, exist_ok=True)
+    temporary = directory / f'{index}.{uuid.uuid4().hex}.tmp'
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with open(temporary, 'wb') as out:
+            while received < expected:
+                block = stream.read(min(READ_BLOCK, expected - received))
+                if not block:
+                    break
+                digest.update(block)
+                out.write(block)
+                received += len(block)
+        if received != expected:
+            raise UploadError(f'Chunk {index} ended after {received} of {expected} bytes')
+        if checksum and digest.hexdigest() != checksum:
+            raise UploadError(f'Chunk {index} does not match its checksum')
+        os.replace(temporary, chunk_path(upload, index))
+    finally:
+        temporary.unlink(missing_ok=True)
+    chunk, _ = VideoUploadChunk.objects.update_or_create(
+        upload=upload, index=index,
+        defaults={'size': received, 'checksum': digest.hexdigest(), 'received_at': timezone.now()},
+    )
+    return chunk
+
+
+def received_chunks(upload):
+    return list(upload.chunks.order_by('index').values_list('index', flat=True))
+
+
+def claim(upload):
+    """Move an upload from uploading to assembling; False if another request got there first"""
+    return bool(VideoUpload.objects.filter(pk=upload.pk, status='uploading').update(status='assembling'))
+
+
+def release(upload):
+    # The failed finalize counts as activity: the client is still there to resend chunks
+    VideoUpload.objects.filter(pk=upload.pk, status='assembling').update(
+        status='uploading', last_activity_at=timezone.now()
+    )
+
+
+def assemble(upload):
+    """Concatenate the chunks into the video's storage; returns the stored file's name"""
+    chunks = dict(upload.chunks.values_list('index', 'size'))
+    missing = [index for index in range(upload.chunk_count) if index not in chunks]
+    if missing:
+        raise UploadError(f'Missing chunks: {missing[:20]}', status=409)
+    field = Video._meta.get_field('video_file')
+    # Written in place: saving a File through the storage API would copy it a second time
+    while True:
+        name = field.storage.get_available_name(field.generate_filename(None, upload.filename))
+        path = Path(field.storage.path(name))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            out = open(path, 'xb')
+        except FileExistsError:
+            continue  # Taken by a concurrent upload of the same name since get_available_name
+        break
+    digest = hashlib.sha256()
+    try:
+        with out:
+            for index in range(upload.chunk_count):
+                try:
+                    part = open(chunk_path(upload, index), 'rb')
+                except FileNotFoundError:
+                    VideoUploadChunk.objects.filter(upload=upload, index=index).delete()
+                    raise UploadError(f'Missing chunks: [{index}]', status=409)
+                with part:
+                    while block := part.read(READ_BLOCK):
+                        digest.update(block)
+                        out.write(block)
+        if path.stat().st_size != upload.size:
+            raise UploadError('Assembled file has the wrong size', status=409)
+        if upload.checksum and digest.hexdigest() != upload.checksum:
+            raise UploadError('File does not match its checksum', status=409)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return name
+
+
+def discard_chunks(upload):
+    shutil.rmtree(upload_dir(upload), ignore_errors=True)
+
+
+def _idle_cutoff():
+    return timezone.now() - timedelta(hours=settings.VIDEO_UPLOAD_EXPIRE_HOURS)
+
+
+def expired_uploads():
+    """Uploads still uploading with no chunk started for VIDEO_UPLOAD_EXPIRE_HOURS"""
+    return VideoUpload.objects.filter(status='uploading', last_activity_at__lt=_idle_cutoff())
+
+
+def expire(upload):
+    """Claim an idle upload for deletion; False if a chunk or finalize has reached it meanwhile"""
+    return bool(
+        VideoUpload.objects.filter(pk=upload.pk, status='uploading', last_activity_at__lt=_idle_cutoff())
+        .update(status='expired')
+    )